@@ -27,6 +27,43 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     jwt_access_token_expire_minutes: int = 30
     
+    # Telemetry ingest
+    ingest_workers: int = 2
+    ingest_spool_dir: str = "/var/lib/telemetry/spool"
+    upload_max_bytes: int = 1024 * 1024 * 1024
+    upload_chunk_size: int = 1024 * 1024
+    session_info_cache_dir: str = "/var/lib/telemetry/session-info-cache"
+    ibt_store_enabled: bool = False
+    ibt_store_dir: str = "/var/lib/telemetry/ibt-store"
+    
+    # Request-time CPU work (decoding, statistics, large JSON payloads)
+    compute_workers: int = 2
+    
+    # Streamed channel downloads: samples read, rendered and compressed per chunk
+    export_chunk_samples: int = 65536
+    
+    # Decoded channels kept in memory per process (see services.channel_cache)
+    channel_cache_bytes: int = 256 * 1024 * 1024
+    # Host-wide memory-mapped channel cache shared by all workers (see
+    # services.shared_channel_cache); replaces the per-process cache when > 0
+    shared_cache_bytes: int = 0
+    shared_cache_dir: str = "/dev/shm/telemetry-channel-cache"
+    # max-age of session GET responses; they are revalidated with their ETag after it
+    http_cache_max_age: int = 0
+    
+    # Parquet analytics store queried with DuckDB (see services.analytics_service)
+    analytics_dir: str = "/var/lib/telemetry/analytics"
+    # Comma-separated channels to export (default: every numeric channel)
+    analytics_channels: str = ""
+    # Seconds between background refreshes; 0 refreshes only on POST /analytics/refresh
+    analytics_refresh_seconds: int = 0
+    # DuckDB threads per query (0 = one per core)
+    analytics_threads: int = 0
+    
+    # Background compaction of deleted lap samples (see services.compaction_service)
+    compaction_interval_seconds: int = 60
+    compaction_batch_sessions: int = 4
+    
     # Application
     debug: bool = True
     environment: str = "development"
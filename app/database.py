@@ -1,9 +1,10 @@
 """Database connection and configuration."""
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
-def get_database_url():
+def get_database_url(driver: str = "pymysql"):
     """Construct database URL from environment variables."""
     db_user = os.getenv('DB_USER', 'appuser')
     db_password = os.getenv('DB_PASSWORD', 'apppass')
@@ -11,7 +12,7 @@ def get_database_url():
     db_port = os.getenv('DB_PORT', '3306')
     db_name = os.getenv('DB_DATABASE', 'app')
     
-    return f"mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    return f"mysql+{driver}://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 
 # Create SQLAlchemy engine
 engine = create_engine(
@@ -21,13 +22,20 @@ engine = create_engine(
     echo=False           # Set to True for SQL query logging
 )
 
-# Create session factory
+# Create session factory (ingest workers and scripts)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    """Dependency function to get database session."""
-    db = SessionLocal()
-    try:
+# Async engine used by the API so queries never block the event loop
+async_engine = create_async_engine(
+    get_database_url("aiomysql"),
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    echo=False
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    """Dependency function to get an async database session."""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
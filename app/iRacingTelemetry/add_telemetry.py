@@ -1,82 +1,66 @@
 import json
+import time
 import uuid
-import mysql.connector
-import os
-
-def get_db_connection():
-    """Create and return a MySQL database connection."""
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST', 'db'),
-        port=int(os.getenv('DB_PORT', '3306')),
-        database=os.getenv('DB_DATABASE', 'app'),
-        user=os.getenv('DB_USER', 'appuser'),
-        password=os.getenv('DB_PASSWORD', 'apppass')
-    )
-def add_telemetry(telemetry_json):
-    """Parse telemetry data from the given .ibt file and return as JSON."""
+from sqlalchemy import select, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from database import engine
+from models import SessionInfo, Weather, Driver, AttributeValue, Lap, LapChannelStats
+from services.channel_codec import encode_channel, describe_channel
+from services.lap_service import LapService
+from services.stats_service import StatsService, STATS_COLUMNS
+
+# Room left in every statement for SQL text, the other columns and protocol overhead
+STATEMENT_OVERHEAD_BYTES = 64 * 1024
+# Upper bound for the escaped size of a row without its channel payload
+ROW_BYTES = 1024
+
+# Columns filled by describe_channel
+ATTRIBUTE_METADATA_COLUMNS = ("dtype", "values_per_sample", "units", "value_min", "value_max", "value_preview")
+
+# Server max_allowed_packet, read once per process
+_max_allowed_packet = None
+
+def add_telemetry(telemetry_json, timings=None):
+    """
+    Store a parsed .ibt file as a new session in a single transaction.
+    
+    If a timings dict is given, the seconds spent encoding channels and lap
+    stats and inserting them are recorded under `encode` and `insert`.
+    """
+    timings = {} if timings is None else timings
+    
+    stage_start = time.perf_counter()
     session_id = str(uuid.uuid4())
     session_info = get_session_info(session_id, telemetry_json)
     weather_info = get_weather_info(session_id, telemetry_json)
     driver_info = get_driver_info(session_id, telemetry_json)
-    attribute_data = get_attribute_data(session_id, telemetry_json.get("telemetry", {}))
+    player = get_player_driver(telemetry_json, driver_info)
+    session_info["player_driver_user_id"] = player["driver_user_id"] if player else None
+    attribute_data = get_attribute_data(
+        session_id,
+        telemetry_json.get("telemetry", {}),
+        telemetry_json.get("telemetry_types", {}),
+        telemetry_json.get("telemetry_units", {})
+    )
+    lap_data = get_lap_data(
+        session_id,
+        telemetry_json.get("lap_channels", {}),
+        session_info,
+        driver_info
+    )
+    lap_stats = get_lap_stats_data(session_id, telemetry_json.get("telemetry", {}), lap_data)
+    timings["encode"] = time.perf_counter() - stage_start
 
-    # Insert data into database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Insert session_info
-        cursor.execute("""
-            INSERT INTO session_info 
-            (session_id, session_type, track_name, track_id, track_config, 
-             session_date, session_time, track_config_sector_info)
-            VALUES (%(session_id)s, %(session_type)s, %(track_name)s, %(track_id)s, 
-                    %(track_config)s, %(session_date)s, %(session_time)s, 
-                    %(track_config_secttor_info)s)
-        """, session_info)
-        
-        # Insert weather
-        cursor.execute("""
-            INSERT INTO weather 
-            (session_id, track_air_temp, track_surface_temp, track_precipitation, 
-             track_fog_level, track_wind_speed, track_wind_direction)
-            VALUES (%(session_id)s, %(track_air_temp)s, %(track_surface_temp)s, 
-                    %(track_precipitation)s, %(track_fog_level)s, %(track_wind_speed)s, 
-                    %(track_wind_direction)s)
-        """, weather_info)
-        
-        # Insert driver
-        for driver in driver_info:
-            cursor.execute("""
-                INSERT INTO driver 
-                (session_id, driver_user_id, driver_name, car_number, car_name, 
-                car_class_id, driver_rating)
-                VALUES (%(session_id)s, %(driver_user_id)s, %(driver_name)s, %(car_number)s, 
-                        %(car_name)s, %(car_class_id)s, %(driver_rating)s)
-            """, driver)
-
-         # Insert attribute values (multiple records)
-        if attribute_data:
-            insert_sql = """
-                INSERT INTO attribute_values (session_id, attribute, value, value_len)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE value = VALUES(value), value_len = VALUES(value_len)
-            """
-            rows = [
-                (rec["session_id"], rec["attribute_name"], rec["value"], rec["value_len"])
-                for rec in attribute_data
-            ]
-            cursor.executemany(insert_sql, rows)
-        
-        
-        conn.commit()
-        
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cursor.close()
-        conn.close()
+    # Insert data into database using a pooled connection
+    stage_start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(SessionInfo.__table__.insert().values(session_info))
+        conn.execute(Weather.__table__.insert().values(weather_info))
+        insert_rows(conn, lambda rows: Driver.__table__.insert().values(rows), driver_info)
+        insert_attribute_data(conn, attribute_data)
+        insert_rows(conn, lambda rows: Lap.__table__.insert().values(rows), lap_data)
+        insert_lap_stats_data(conn, lap_stats)
+    timings["insert"] = time.perf_counter() - stage_start
 
     return {
         "session_info": session_info,
@@ -84,16 +68,152 @@ def add_telemetry(telemetry_json):
         "driver_info": driver_info
     }
 
+def add_attributes(session_id, telemetry_json, timings=None):
+    """
+    Add telemetry channels to an existing session without touching its other data.
+    
+    The channels come from the session's whole .ibt file, so they only line
+    up with its stored channels and laps as long as no lap was deleted.
+    
+    Raises:
+        ValueError: If a channel's length differs from the stored channels'
+            (the session has had laps deleted)
+    """
+    timings = {} if timings is None else timings
+    
+    stage_start = time.perf_counter()
+    attribute_data = get_attribute_data(
+        session_id,
+        telemetry_json.get("telemetry", {}),
+        telemetry_json.get("telemetry_types", {}),
+        telemetry_json.get("telemetry_units", {})
+    )
+    timings["encode"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    with engine.begin() as conn:
+        # Locked like lap deletes lock them, so none shortens the stored channels meanwhile
+        stored_lengths = set(conn.execute(
+            select(AttributeValue.value_len).where(AttributeValue.session_id == session_id).with_for_update()
+        ).scalars().all())
+        mismatched = [rec["attribute"] for rec in attribute_data if stored_lengths - {rec["value_len"]}]
+        if mismatched:
+            raise ValueError(
+                f"Session {session_id} has had laps deleted; channels extracted from its .ibt file "
+                f"would not line up with its stored channels: {', '.join(mismatched)}"
+            )
+        laps = [
+            dict(row._mapping) for row in conn.execute(
+                text("SELECT lap_number, start_index, end_index FROM lap WHERE session_id = :session_id"),
+                {"session_id": session_id}
+            )
+        ]
+        stats_start = time.perf_counter()
+        lap_stats = get_lap_stats_data(session_id, telemetry_json.get("telemetry", {}), laps)
+        stats_seconds = time.perf_counter() - stats_start
+        
+        insert_attribute_data(conn, attribute_data)
+        insert_lap_stats_data(conn, lap_stats)
+        # Attribute listings and exports of the session change
+        conn.execute(
+            text("UPDATE session_info SET data_version = data_version + 1 WHERE session_id = :session_id"),
+            {"session_id": session_id}
+        )
+    timings["encode"] += stats_seconds
+    timings["insert"] = time.perf_counter() - stage_start - stats_seconds
+
+    return [rec["attribute"] for rec in attribute_data]
+
+def max_statement_bytes(conn):
+    """Largest statement the server accepts (its max_allowed_packet)."""
+    global _max_allowed_packet
+    if _max_allowed_packet is None:
+        _max_allowed_packet = int(conn.execute(text("SELECT @@max_allowed_packet")).scalar())
+    return _max_allowed_packet
+
+def insert_rows(conn, build_insert, rows, row_bytes=lambda row: ROW_BYTES):
+    """
+    Insert rows with as few multi-row INSERT statements as possible.
+    
+    Rows are grouped so that no statement grows past max_allowed_packet;
+    build_insert turns a group of rows into the statement to execute and
+    row_bytes estimates the size a row adds to it.
+    """
+    budget = max_statement_bytes(conn) - STATEMENT_OVERHEAD_BYTES
+    batch = []
+    batch_bytes = 0
+    for row in rows:
+        size = row_bytes(row)
+        if batch and batch_bytes + size > budget:
+            conn.execute(build_insert(batch))
+            batch = []
+            batch_bytes = 0
+        batch.append(row)
+        batch_bytes += size
+    if batch:
+        conn.execute(build_insert(batch))
+
+def insert_attribute_data(conn, attribute_data):
+    """
+    Insert or replace attribute values with batched multi-row statements.
+    
+    Channels too large for one statement are inserted with their first chunk
+    and the rest appended with CONCAT in further statements, all within the
+    caller's transaction.
+    """
+    if not attribute_data:
+        return
+
+    # Escaped binary can take up to twice its size on the wire
+    chunk_bytes = (max_statement_bytes(conn) - STATEMENT_OVERHEAD_BYTES - ROW_BYTES) // 2
+    rows = []
+    appends = []
+    for rec in attribute_data:
+        value = rec["value"]
+        rows.append({**rec, "value": value[:chunk_bytes]})
+        for offset in range(chunk_bytes, len(value), chunk_bytes):
+            appends.append({
+                "session_id": rec["session_id"],
+                "attribute": rec["attribute"],
+                "chunk": value[offset:offset + chunk_bytes]
+            })
+
+    def build_insert(batch):
+        insert = mysql_insert(AttributeValue.__table__).values(batch)
+        return insert.on_duplicate_key_update({
+            column: insert.inserted[column]
+            for column in ("value", "value_len") + ATTRIBUTE_METADATA_COLUMNS
+        })
+
+    insert_rows(conn, build_insert, rows, row_bytes=lambda row: 2 * len(row["value"]) + ROW_BYTES)
+    for append in appends:
+        conn.execute(text(
+            "UPDATE attribute_values SET value = CONCAT(value, :chunk) "
+            "WHERE session_id = :session_id AND attribute = :attribute"
+        ), append)
+
+def insert_lap_stats_data(conn, lap_stats):
+    """Insert or replace per-lap channel stats with batched multi-row statements."""
+    def build_insert(batch):
+        insert = mysql_insert(LapChannelStats.__table__).values(batch)
+        return insert.on_duplicate_key_update({
+            column: insert.inserted[column]
+            for column in STATS_COLUMNS
+        })
+
+    insert_rows(conn, build_insert, lap_stats)
+
 def get_session_info(session_id, telemetry_json):
     return {
         "session_id": session_id,
+        "content_hash": telemetry_json.get("content_hash"),
         "session_type": telemetry_json["session_info"]["SessionInfo"]["Sessions"][0]["SessionType"],
         "track_name": telemetry_json["session_info"]["WeekendInfo"]["TrackDisplayName"],
         "track_id": telemetry_json["session_info"]["WeekendInfo"]["TrackID"],
         "track_config": telemetry_json["session_info"]["WeekendInfo"]["TrackConfigName"],
         "session_date": telemetry_json["session_info"]["WeekendInfo"]["WeekendOptions"]["Date"],
         "session_time": telemetry_json["session_info"]["WeekendInfo"]["WeekendOptions"]["TimeOfDay"],
-        "track_config_secttor_info": json.dumps(telemetry_json["session_info"]["SplitTimeInfo"]["Sectors"])
+        "track_config_sector_info": json.dumps(telemetry_json["session_info"]["SplitTimeInfo"]["Sectors"])
     }
 def get_weather_info(session_id, telemetry_json):
     return {
@@ -120,13 +240,50 @@ def get_driver_info(session_id, telemetry_json):
         })
     return drivers
 
-def get_attribute_data(session_id, telemetry_data):
+def get_player_driver(telemetry_json, driver_info):
+    """The driver row of the car the telemetry was recorded in, or None if it cannot be told."""
+    driver_section = telemetry_json["session_info"]["DriverInfo"]
+    drivers = driver_section["Drivers"]
+    car_idx = driver_section.get("DriverCarIdx")
+    for driver, row in zip(drivers, driver_info):
+        if car_idx is not None and driver.get("CarIdx") == car_idx:
+            return row
+    return driver_info[0] if len(driver_info) == 1 else None
+
+def get_lap_data(session_id, lap_channels, session_info=None, drivers=()):
+    if lap_channels.get("Lap") is None:
+        return []
+    laps = LapService.compute_laps(
+        lap_channels["Lap"],
+        session_time=lap_channels.get("SessionTime"),
+        incident_data=lap_channels.get("PlayerIncidents"),
+        lap_time_data=lap_channels.get("LapCurrentLapTime")
+    )
+    # Copied onto every lap so leaderboards never join the session tables to filter
+    leaderboard = LapService.leaderboard_fields(session_info, drivers)
+    return [{"session_id": session_id, **lap, **leaderboard} for lap in laps]
+
+def get_lap_stats_data(session_id, telemetry_data, laps):
+    records = []
+    if not laps:
+        return records
+    for attribute, values in telemetry_data.items():
+        for stats in StatsService.compute_lap_stats(values, laps):
+            records.append({"session_id": session_id, "attribute": attribute, **stats})
+    return records
+
+def get_attribute_data(session_id, telemetry_data, telemetry_types=None, telemetry_units=None):
+    telemetry_types = telemetry_types or {}
+    telemetry_units = telemetry_units or {}
     records = []
     for attribute, values in telemetry_data.items():
+        if values is None:
+            raise ValueError(f"Unknown telemetry attribute: {attribute}")
         records.append({
             "session_id": session_id,
-            "attribute_name": attribute,
-            "value": json.dumps(values),
-            "value_len": len(values)
+            "attribute": attribute,
+            "value": encode_channel(values, telemetry_types.get(attribute)),
+            "value_len": len(values),
+            **describe_channel(values, telemetry_units.get(attribute))
         })
     return records
\ No newline at end of file
@@ -2,61 +2,261 @@
 from irsdk import IBT, CustomYamlSafeLoader, YAML_TRANSLATER, YAML_CODE_PAGE
 import json
 import re
+import numpy as np
 from yaml.reader import Reader as YamlReader
 from yaml.cyaml import CSafeLoader as YamlSafeLoader
 import yaml
+import os
 import sys
-import json
-from iRacingTelemetry.add_telemetry import add_telemetry
+import time
+import hashlib
+from collections import OrderedDict
+from config import settings
+from iRacingTelemetry.add_telemetry import add_telemetry, add_attributes
+from services.channel_codec import IBT_VAR_DTYPES
+
+# Channels always read for lap boundaries, lap times, incidents and lap validity, stored or not
+LAP_CHANNELS = ['Lap', 'SessionTime', 'PlayerIncidents', 'LapCurrentLapTime']
+SESSION_INFO_SECTIONS = ['SessionInfo', 'DriverInfo', 'WeekendInfo', 'WeatherInfo', 'SplitTimeInfo']
+SESSION_INFO_MEMORY_CACHE_SIZE = 64
+
+# Parsed session info by content hash, shared by every ingest in this process
+_session_info_cache = OrderedDict()
 
-def parse_telemetry(file_path, attributes):
+def parse_telemetry(file_path, attributes, timings=None, content_hash=None, session_id=None):
+    """
+    Parse an .ibt file and store it as a new session.
+    
+    If a timings dict is given, it is filled with the seconds spent in each
+    ingest stage: open, parse (session info and channel extraction), encode
+    (binary channels and lap stats) and insert. content_hash (the SHA-256 of the
+    file, when already known) keys the parsed session info cache and is
+    stored on the session for deduplication. If session_id is given, only
+    the requested attributes are added to that existing session.
+    """
+    timings = {} if timings is None else timings
     try:
         # Initialize irsdk with the .ibt file
+        stage_start = time.perf_counter()
         ir = IBT()
         ir.open(ibt_file=file_path)
-        telemetry_data = to_json(ir, attributes)
-        upserted_data = add_telemetry(telemetry_data)
+        timings["open"] = time.perf_counter() - stage_start
+        
+        stage_start = time.perf_counter()
+        telemetry_data = to_json(ir, list(attributes), content_hash)
+        timings["parse"] = time.perf_counter() - stage_start
+        
+        if session_id:
+            telemetry_data["telemetry"] = {
+                name: values for name, values in telemetry_data["telemetry"].items()
+                if name in attributes
+            }
+            added = add_attributes(session_id, telemetry_data, timings)
+            result = {"uploaded": True, "session_id": session_id, "attributes_added": added}
+        else:
+            upserted_data = add_telemetry(telemetry_data, timings)
+            result = {"uploaded": True, "session_id": upserted_data["session_info"]["session_id"]}
+        
         ir.close()
-        return {"uploaded": True, "session_id": upserted_data["session_info"]["session_id"]}
+        return result
     except Exception as e:
         return json.dumps({
             "error": str(e)
         })
 
-def to_json(self, attributes):
+def to_json(self, attributes, content_hash=None):
     """Convert all telemetry data to a JSON-serializable dictionary."""
     if not self._header:
         return None
     
     result = {
         'file_name': self.file_name,
-        'session_info': get_all_session_info(self),
-        'telemetry': {}
+        'content_hash': content_hash,
+        'session_info': get_all_session_info(self, content_hash),
+        'telemetry': {},
+        'telemetry_types': {},
+        'telemetry_units': {}
     }
     #always include lap data, this is requried to get starting and ending frame for a lap
     if "Lap" not in attributes:
         attributes.append("Lap")
     
-    # Add all variables for all records
+    # Add all variables for all records, keeping each variable's native IBT type
+    channels = extract_channels(self, list(dict.fromkeys(attributes + LAP_CHANNELS)))
+    result['telemetry'] = {var_name: channels[var_name] for var_name in attributes}
+    result['lap_channels'] = {var_name: channels[var_name] for var_name in LAP_CHANNELS}
     for var_name in attributes:
-        result['telemetry'][var_name] = self.get_all(var_name)
+        var_header = self._var_headers_dict.get(var_name)
+        if var_header is not None:
+            result['telemetry_types'][var_name] = var_header.type
+            result['telemetry_units'][var_name] = var_header.unit
     return result
 
-def get_all_session_info(self):
-    """Extract all session info sections as a dictionary."""
+def record_view(self, var_names):
+    """
+    Map the IBT record buffer as a NumPy structured array.
+    
+    Each record is one row of buf_len bytes; the requested variables become
+    fields at their var header offsets, so every field is a strided view
+    straight over the memory-mapped file. Unknown variable names are skipped.
+    """
+    var_headers = [self._var_headers_dict[name] for name in dict.fromkeys(var_names) if name in self._var_headers_dict]
+    buf_len = self._header.buf_len
+    buf_offset = self._header.var_buf[0].buf_offset
+    
+    # Never map past the end of a truncated file
+    available = (len(self._shared_mem) - buf_offset) // buf_len
+    record_count = max(0, min(self._disk_header.session_record_count, available))
+    
+    record_dtype = np.dtype({
+        'names': [var_header.name for var_header in var_headers],
+        'formats': [
+            (IBT_VAR_DTYPES[var_header.type], (var_header.count,)) if var_header.count > 1
+            else IBT_VAR_DTYPES[var_header.type]
+            for var_header in var_headers
+        ],
+        'offsets': [var_header.offset for var_header in var_headers],
+        'itemsize': buf_len
+    })
+    return np.ndarray((record_count,), dtype=record_dtype, buffer=self._shared_mem, offset=buf_offset)
+
+def extract_channels(self, var_names, copy=True):
+    """
+    Extract whole channels from the IBT in a single pass over its var headers.
+    
+    Args:
+        var_names: Variable names to extract
+        copy: Return contiguous copies (safe after the IBT is closed) instead of
+            zero-copy views over the memory-mapped file
+    
+    Returns:
+        Dict of variable name to array (None for unknown variables)
+    """
+    records = record_view(self, var_names)
+    channels = {}
+    for var_name in var_names:
+        if var_name not in records.dtype.names:
+            channels[var_name] = None
+            continue
+        channel = records[var_name]
+        channels[var_name] = np.ascontiguousarray(channel) if copy else channel
+    return channels
+
+def extract_stored_channels(file_path, var_names):
+    """
+    Extract channels from an already ingested .ibt file.
+
+    Only the requested variables are read; session info is not parsed.
+
+    Returns:
+        Dict with `telemetry` (variable name to array), `telemetry_types`
+        (variable name to IBT var type) and `telemetry_units` (variable name
+        to unit) for the variables the file has
+    """
+    ir = IBT()
+    ir.open(ibt_file=file_path)
+    try:
+        channels = extract_channels(ir, list(var_names))
+        found = [name for name, values in channels.items() if values is not None]
+        return {
+            'telemetry': {name: channels[name] for name in found},
+            'telemetry_types': {name: ir._var_headers_dict[name].type for name in found},
+            'telemetry_units': {name: ir._var_headers_dict[name].unit for name in found}
+        }
+    finally:
+        ir.close()
+
+def get_all_session_info(self, content_hash=None):
+    """
+    Extract all session info sections as a dictionary.
+    
+    The session info block is decoded and parsed once with the libyaml-backed
+    loader, and the result is memoized (in memory and in
+    settings.session_info_cache_dir) under the file's content hash, so
+    re-ingesting or re-extracting the same file skips YAML entirely. Without a
+    content hash, the header and session info bytes are hashed instead.
+    """
     if not self._header:
         return None
     
-    session_info = {}
-    # Common session info sections
-    for section in ['SessionInfo', 'DriverInfo', 'WeekendInfo',"WeatherInfo", "SplitTimeInfo"]:
-    #for section in ['SessionInfo']:
-        data = get_session_info_section(self, section)
-        if data:
-            session_info[section] = data
+    cache_key = content_hash or session_info_hash(self)
+    session_info = _load_cached_session_info(cache_key)
+    if session_info is not None:
+        return session_info
     
+    session_info = parse_session_info(self)
+    _store_cached_session_info(cache_key, session_info)
     return session_info
 
+def session_info_hash(self):
+    """Hash the IBT header, disk sub-header and session info block."""
+    start = self._header.session_info_offset
+    end = start + self._header.session_info_len
+    digest = hashlib.sha256(self._shared_mem[:144])
+    digest.update(self._shared_mem[start:end])
+    return digest.hexdigest()
+
+def parse_session_info(self):
+    """Parse the whole session info document once and return the known sections."""
+    start = self._header.session_info_offset
+    end = start + self._header.session_info_len
+    yaml_src = re.sub(YamlReader.NON_PRINTABLE, '',
+                        self._shared_mem[start:end].translate(YAML_TRANSLATER).rstrip(b'\x00').decode(YAML_CODE_PAGE))
+    
+    try:
+        document = yaml.load(yaml_src, Loader=CustomYamlSafeLoader) or {}
+    except Exception as e:
+        # One malformed section should not lose the others; parse them one at a time
+        print(f'Error parsing session info YAML, falling back to per-section parsing: {e}')
+        document = {section: get_session_info_section(self, section) for section in SESSION_INFO_SECTIONS}
+    
+    return {
+        section: document[section]
+        for section in SESSION_INFO_SECTIONS
+        if document.get(section)
+    }
+
+def _session_info_cache_path(cache_key):
+    return os.path.join(settings.session_info_cache_dir, f"{cache_key}.json")
+
+def _load_cached_session_info(cache_key):
+    """Look up parsed session info in the memory cache, then on disk."""
+    if cache_key in _session_info_cache:
+        _session_info_cache.move_to_end(cache_key)
+        return _session_info_cache[cache_key]
+    
+    try:
+        with open(_session_info_cache_path(cache_key), encoding='utf-8') as f:
+            session_info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    _remember_session_info(cache_key, session_info)
+    return session_info
+
+def _store_cached_session_info(cache_key, session_info):
+    """Memoize parsed session info in memory and on disk."""
+    _remember_session_info(cache_key, session_info)
+    # Write to a temporary file first so concurrent workers never read a partial file
+    tmp_path = f"{_session_info_cache_path(cache_key)}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(settings.session_info_cache_dir, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session_info, f)
+        os.replace(tmp_path, _session_info_cache_path(cache_key))
+    except (OSError, TypeError, ValueError) as e:
+        print(f'Could not cache session info {cache_key}: {e}')
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+def _remember_session_info(cache_key, session_info):
+    _session_info_cache[cache_key] = session_info
+    _session_info_cache.move_to_end(cache_key)
+    while len(_session_info_cache) > SESSION_INFO_MEMORY_CACHE_SIZE:
+        _session_info_cache.popitem(last=False)
+
 def get_session_info_section(self, section_name):
     """Parse a specific session info section."""
     data_binary = get_session_info_binary(self, section_name)
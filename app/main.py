@@ -1,10 +1,15 @@
 """Main FastAPI application."""
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import get_db, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, engine, async_engine
 from models import Base
+from services.ingest_service import IngestService
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+from services.analytics_service import AnalyticsService
+from services.compaction_service import CompactionService
 
 # Create FastAPI app
 app = FastAPI(
@@ -39,11 +44,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Metadata of binary telemetry responses (see services.channel_formats)
+    expose_headers=[
+        "X-Telemetry-Session-Id", "X-Telemetry-Attribute", "X-Telemetry-Lap-Number",
+        "X-Telemetry-Start", "X-Telemetry-End", "X-Telemetry-Start-Index", "X-Telemetry-End-Index",
+        "X-Telemetry-Sample-Count", "X-Telemetry-Value-Len", "X-Telemetry-Downsample",
+        "X-Telemetry-Max-Points", "ETag",
+    ],
 )
 
 # Create database tables (if not using migrations)
 # Base.metadata.create_all(bind=engine)
 
+@app.on_event("startup")
+async def start_ingest_workers():
+    """Start the worker pools and resume unfinished ingest jobs."""
+    IngestService.start_pool()
+    ComputePool.start_pool()
+    AnalyticsService.start_refresher()
+    CompactionService.start_compactor()
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    """Stop the worker pools."""
+    AnalyticsService.stop_refresher()
+    CompactionService.stop_compactor()
+    IngestService.shutdown_pool()
+    ComputePool.shutdown_pool()
+    await async_engine.dispose()
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -55,11 +84,11 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_db)):
     """Health check endpoint."""
     try:
         # Test database connection
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected"
@@ -71,11 +100,19 @@ async def health_check(db: Session = Depends(get_db)):
             "error": str(e)
         }
 
+@app.get("/health/cache")
+async def cache_stats():
+    """Counters and size of the decoded channel cache (see ChannelService.cache)."""
+    cache = ChannelService.cache()
+    return {"cache": cache.__name__, **cache.stats()}
+
 # Include routers
-from routers import sessions, telemetry, auth
+from routers import sessions, telemetry, auth, leaderboard, analytics
 app.include_router(auth.router, prefix="/auth", tags=["authentication"], include_in_schema=False)
 app.include_router(sessions.router, prefix="/sessions", tags=["sessions"])
 app.include_router(telemetry.router, prefix="/telemetry", tags=["telemetry"])
+app.include_router(leaderboard.router, prefix="/leaderboard", tags=["leaderboard"])
+app.include_router(analytics.router, prefix="/analytics", tags=["analytics"])
 
 if __name__ == "__main__":
     import uvicorn
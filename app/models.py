@@ -1,16 +1,24 @@
 """SQLAlchemy models matching the database schema."""
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, PrimaryKeyConstraint
-from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy.dialects.mysql import MEDIUMTEXT, INTEGER as MYSQL_INTEGER
+from sqlalchemy import Column, String, Integer, Float, Boolean, Text, DateTime, ForeignKey, PrimaryKeyConstraint, Index
+from sqlalchemy.orm import declarative_base, relationship, deferred
+from sqlalchemy.dialects.mysql import MEDIUMBLOB, DOUBLE, INTEGER as MYSQL_INTEGER, SMALLINT as MYSQL_SMALLINT
 
 Base = declarative_base()
 
 class SessionInfo(Base):
     """Session information table."""
     __tablename__ = "session_info"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        Index("ux_session_info_content_hash", "content_hash", unique=True),
+        # Session listing: each filter followed by the (session_date, session_id) keyset
+        Index("ix_session_info_date", "session_date", "session_id"),
+        Index("ix_session_info_track", "track_id", "track_config", "session_date", "session_id"),
+        Index("ix_session_info_type", "session_type", "session_date", "session_id"),
+        {"mysql_engine": "InnoDB"},
+    )
     
     session_id = Column(String(36), primary_key=True)
+    content_hash = Column(String(64), nullable=True)  # SHA-256 of the uploaded .ibt
     session_type = Column(String(100), nullable=True)
     track_name = Column(String(255), nullable=True)
     track_id = Column(Integer, nullable=True)
@@ -18,11 +26,19 @@ class SessionInfo(Base):
     session_date = Column(String(50), nullable=True)
     session_time = Column(String(50), nullable=True)
     track_config_sector_info = Column(Text, nullable=True)
+    # Driver the telemetry was recorded for (matched on DriverCarIdx at ingest)
+    player_driver_user_id = Column(Integer, nullable=True)
+    # Bumped whenever stored channels change (lap deletes, added attributes); part of
+    # every channel cache key and of the ETags of the session's GET responses
+    data_version = Column(MYSQL_INTEGER(unsigned=True), nullable=False, default=0, server_default="0")
     
     # Relationships
     weather = relationship("Weather", back_populates="session", cascade="all, delete-orphan", uselist=False)
     drivers = relationship("Driver", back_populates="session", cascade="all, delete-orphan")
     attributes = relationship("AttributeValue", back_populates="session", cascade="all, delete-orphan")
+    laps = relationship("Lap", back_populates="session", cascade="all, delete-orphan")
+    lap_stats = relationship("LapChannelStats", cascade="all, delete-orphan")
+    tombstones = relationship("ChannelTombstone", cascade="all, delete-orphan")
 
 class Weather(Base):
     """Weather information table."""
@@ -45,6 +61,7 @@ class Driver(Base):
     __tablename__ = "driver"
     __table_args__ = (
         PrimaryKeyConstraint("session_id", "driver_user_id"),
+        Index("ix_driver_user", "driver_user_id", "session_id"),
         {"mysql_engine": "InnoDB"},
     )
     
@@ -69,8 +86,106 @@ class AttributeValue(Base):
     
     session_id = Column(String(36), ForeignKey('session_info.session_id', ondelete='CASCADE'), nullable=False)
     attribute = Column(String(255), nullable=False)
-    value = Column(MEDIUMTEXT, nullable=True)
+    # Binary channel, see services.channel_codec; only loaded when accessed or undeferred
+    value = deferred(Column(MEDIUMBLOB, nullable=True))
     value_len = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    # Channel metadata computed at ingest, so listings never read value
+    dtype = Column(String(16), nullable=True)  # NumPy dtype of the samples, e.g. <f4
+    values_per_sample = Column(MYSQL_SMALLINT(unsigned=True), nullable=True)
+    units = Column(String(32), nullable=True)
+    value_min = Column(DOUBLE(asdecimal=False), nullable=True)
+    value_max = Column(DOUBLE(asdecimal=False), nullable=True)
+    value_preview = Column(String(128), nullable=True)
     
     # Relationship
     session = relationship("SessionInfo", back_populates="attributes")
+
+class Lap(Base):
+    """Lap boundaries computed from the Lap channel at ingest."""
+    __tablename__ = "lap"
+    __table_args__ = (
+        PrimaryKeyConstraint("session_id", "lap_number"),
+        # Leaderboards: fastest complete valid laps per track/config, per car, per driver
+        Index("ix_lap_leaderboard", "track_id", "track_config", "complete", "valid", "lap_time"),
+        Index("ix_lap_leaderboard_car", "track_id", "track_config", "car_name", "complete", "valid", "lap_time"),
+        Index("ix_lap_leaderboard_driver", "driver_user_id", "track_id", "track_config", "complete", "valid", "lap_time"),
+        {"mysql_engine": "InnoDB"},
+    )
+    
+    session_id = Column(String(36), ForeignKey('session_info.session_id', ondelete='CASCADE'), nullable=False)
+    lap_number = Column(Integer, nullable=False)
+    start_index = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    end_index = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    sample_count = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    lap_time = Column(Float, nullable=True)  # seconds, from SessionTime
+    incidents = Column(Integer, nullable=True)  # PlayerIncidents samples equal to 1
+    valid = Column(Boolean, nullable=True)  # no incidents
+    complete = Column(Boolean, nullable=True)  # neither the partial lap a recording starts nor ends in
+    # Copied from session_info and its player's driver so leaderboards are one index scan
+    track_id = Column(Integer, nullable=True)
+    track_config = Column(String(255), nullable=True)
+    session_date = Column(String(50), nullable=True)
+    driver_user_id = Column(Integer, nullable=True)
+    car_name = Column(String(255), nullable=True)
+    
+    # Relationship
+    session = relationship("SessionInfo", back_populates="laps")
+
+class LapChannelStats(Base):
+    """Per-lap aggregates of each numeric telemetry channel, computed at ingest."""
+    __tablename__ = "lap_channel_stats"
+    __table_args__ = (
+        PrimaryKeyConstraint("session_id", "lap_number", "attribute"),
+        {"mysql_engine": "InnoDB"},
+    )
+    
+    session_id = Column(String(36), ForeignKey('session_info.session_id', ondelete='CASCADE'), nullable=False)
+    lap_number = Column(Integer, nullable=False)
+    attribute = Column(String(255), nullable=False)
+    sample_count = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    value_sum = Column(DOUBLE(asdecimal=False), nullable=True)
+    value_sum_sq = Column(DOUBLE(asdecimal=False), nullable=True)
+    value_min = Column(DOUBLE(asdecimal=False), nullable=True)
+    value_max = Column(DOUBLE(asdecimal=False), nullable=True)
+    p50 = Column(DOUBLE(asdecimal=False), nullable=True)
+    p95 = Column(DOUBLE(asdecimal=False), nullable=True)
+
+class ChannelTombstone(Base):
+    """Sample ranges deleted from a stored channel but not yet compacted out of its value."""
+    __tablename__ = "channel_tombstone"
+    __table_args__ = (
+        PrimaryKeyConstraint("session_id", "attribute", "start_index"),
+        {"mysql_engine": "InnoDB"},
+    )
+    
+    session_id = Column(String(36), ForeignKey('session_info.session_id', ondelete='CASCADE'), nullable=False)
+    attribute = Column(String(255), nullable=False)
+    # Positions in the stored value (before any tombstone is applied), inclusive
+    start_index = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    end_index = Column(MYSQL_INTEGER(unsigned=True), nullable=False)
+    lap_number = Column(Integer, nullable=True)  # lap whose deletion recorded it
+    created_at = Column(DateTime, nullable=False)
+
+class IngestJob(Base):
+    """Background telemetry ingest jobs queued by uploads."""
+    __tablename__ = "ingest_job"
+    __table_args__ = (
+        Index("ix_ingest_job_status", "status"),
+        {"mysql_engine": "InnoDB"},
+    )
+    
+    job_id = Column(String(36), primary_key=True)
+    status = Column(String(20), nullable=False)
+    file_name = Column(String(255), nullable=True)
+    mode = Column(String(20), nullable=False, default="ingest")  # "ingest" or "merge"
+    file_path = Column(String(1024), nullable=False)
+    content_hash = Column(String(64), nullable=True)  # SHA-256 of the uploaded file
+    file_size = Column(MYSQL_INTEGER(unsigned=True), nullable=True)
+    attributes = Column(Text, nullable=True)
+    session_id = Column(String(36), nullable=True)
+    error = Column(Text, nullable=True)
+    timings = Column(Text, nullable=True)
+    worker = Column(String(100), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
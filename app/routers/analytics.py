@@ -0,0 +1,62 @@
+"""Cross-session analytics endpoints."""
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from auth_helpers import get_current_user
+from services.analytics_service import AnalyticsService
+
+router = APIRouter()
+
+@router.get("/")
+async def query_analytics(
+    attribute: List[str] = Query(..., description="Attribute names to aggregate"),
+    group_by: Optional[List[str]] = Query(None, description="Columns to group by (repeatable): sector, lap_dist, lap_number, session_id, session_date, track_config, car_name, driver_user_id"),
+    bins: int = Query(100, ge=1, le=10000, description="Number of LapDistPct buckets when grouping by lap_dist"),
+    track_id: Optional[int] = Query(None),
+    track_config: Optional[str] = Query(None),
+    car_name: Optional[str] = Query(None),
+    driver_user_id: Optional[int] = Query(None),
+    date_from: Optional[date] = Query(None, description="Earliest session date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Latest session date (inclusive)"),
+    valid_only: bool = Query(False, description="Only samples of valid laps")
+):
+    """
+    Aggregate attributes over the samples of every session matching the filters.
+
+    Reads the analytics store, so sessions ingested or changed since its last
+    refresh are not included yet.
+    """
+    if not AnalyticsService.available():
+        raise HTTPException(status_code=503, detail="The analytics store is not available")
+    try:
+        return await run_in_threadpool(
+            AnalyticsService.query,
+            attribute,
+            group_by or [],
+            bins=bins,
+            track_id=track_id,
+            track_config=track_config,
+            car_name=car_name,
+            driver_user_id=driver_user_id,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=date_to.isoformat() if date_to else None,
+            valid_only=valid_only
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/refresh")
+async def refresh_analytics(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Export sessions added or changed since the last refresh to the analytics store."""
+    if not AnalyticsService.available():
+        raise HTTPException(status_code=503, detail="The analytics store is not available")
+    result = await AnalyticsService.refresh(db)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A refresh is already running")
+    return result
@@ -0,0 +1,37 @@
+"""Lap leaderboard endpoints."""
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from services.leaderboard_service import LeaderboardService
+
+router = APIRouter()
+
+@router.get("/")
+async def get_leaderboard(
+    track_id: int = Query(..., description="Track to rank laps on"),
+    track_config: Optional[str] = Query(None, description="Track configuration (default: every configuration)"),
+    car_name: Optional[str] = Query(None, description="Only laps driven in this car"),
+    driver_user_id: Optional[int] = Query(None, description="Only laps of this driver"),
+    date_from: Optional[date] = Query(None, description="Earliest session date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Latest session date (inclusive)"),
+    limit: int = Query(10, ge=1, le=500, description="Number of laps to return"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the fastest valid laps on a track across all sessions, fastest first.
+
+    A lap is valid if it is complete (neither the partial lap a recording
+    starts mid-way nor the one it ends in) and has no incidents.
+    """
+    return await LeaderboardService.top_laps(
+        db,
+        track_id,
+        limit,
+        track_config=track_config,
+        car_name=car_name,
+        driver_user_id=driver_user_id,
+        date_from=date_from.isoformat() if date_from else None,
+        date_to=date_to.isoformat() if date_to else None
+    )
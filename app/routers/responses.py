@@ -0,0 +1,133 @@
+"""Helpers for keeping CPU-bound response work off the event loop, and for conditional GETs."""
+import hashlib
+from typing import AsyncIterator, Callable, Dict, Optional
+from fastapi import Depends, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import get_db
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+from services.channel_formats import (
+    FORMAT_JSON, MEDIA_TYPES, NotAcceptable, negotiate, metadata_headers, render_channel, render_stored_channel
+)
+from services.export_service import ExportService, ENCODING_IDENTITY, negotiate_encoding
+
+# OpenAPI description of the content-negotiated channel responses
+CHANNEL_RESPONSES = {
+    200: {
+        "description": "Channel samples in the format chosen by the Accept header",
+        "content": {media_type: {} for media_type in MEDIA_TYPES.values()},
+    },
+    406: {"description": "None of the formats in the Accept header can be produced"},
+}
+
+def render_json(build: Callable, *args) -> bytes:
+    """Build a response body with build(*args) and render it the way JSONResponse does."""
+    return JSONResponse(content=build(*args)).body
+
+async def offload_json(build: Callable, *args, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Build and render a JSON response in the compute pool.
+
+    Large channel payloads take longer to turn into lists and serialize than
+    the queries that fetch them, so both happen in a worker process. build
+    must be a module-level function.
+    """
+    body = await ComputePool.run(render_json, build, *args)
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+def negotiated_format(accept: Optional[str] = Header(None)) -> str:
+    """Dependency resolving the Accept header to a channel format (406 if none can be produced)."""
+    try:
+        return negotiate(accept)
+    except NotAcceptable as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+async def offload_channel(fmt: str, values, metadata: Dict, build_json: Callable, *json_args,
+                          stored: bool = False, index=None) -> Response:
+    """
+    Render channel samples in the negotiated format in the compute pool.
+
+    FORMAT_JSON keeps the endpoint's regular body, built by build_json(*json_args);
+    every other format is serialized straight from the samples, with their
+    sample indices if index is given. With stored set, values is a stored
+    channel value and is decoded in the worker.
+    """
+    headers = {"Vary": "Accept"}
+    if fmt == FORMAT_JSON:
+        return await offload_json(build_json, *json_args, headers=headers)
+
+    if stored:
+        body = await ComputePool.run(render_stored_channel, fmt, values, metadata)
+    else:
+        body = await ComputePool.run(render_channel, fmt, values, metadata, index)
+    return Response(content=body, headers={**headers, **metadata_headers(metadata)}, media_type=MEDIA_TYPES[fmt])
+
+def stream_response(chunks: AsyncIterator[bytes], media_type: str, accept_encoding: Optional[str],
+                    headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """
+    Send a generated body as a chunked response, compressed with the best
+    coding in the Accept-Encoding header.
+    """
+    encoding = negotiate_encoding(accept_encoding)
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    if encoding != ENCODING_IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(ExportService.encode(chunks, encoding), media_type=media_type, headers=headers)
+
+async def session_cache_headers(
+    session_id: str,
+    request: Request,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+) -> Dict[str, str]:
+    """
+    Dependency making GETs of a session's data conditional.
+
+    A session's data only changes when its data_version is bumped (lap
+    deletes, added attributes), so the session's data_version and the request
+    (path, query, Accept and Accept-Encoding) identify a response body; their
+    digest is its strong ETag. A request whose If-None-Match carries it gets
+    304 Not Modified before the endpoint reads anything else.
+
+    The ETag and Cache-Control headers are set on the response FastAPI builds
+    from a returned dict; endpoints that return a Response themselves add
+    them with with_cache_headers. Nothing is set for unknown sessions, so
+    their 404s are never cached.
+    """
+    data_version = await ChannelService.data_version(session_id, db)
+    if data_version is None:
+        return {}
+
+    digest = hashlib.sha256("\n".join([
+        request.app.version,
+        request.url.path,
+        str(sorted(request.query_params.multi_items())),
+        request.headers.get("accept", ""),
+        request.headers.get("accept-encoding", ""),
+    ]).encode("utf-8")).hexdigest()[:20]
+    etag = f'"{data_version}-{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.http_cache_max_age}, must-revalidate",
+        "Vary": "Accept, Accept-Encoding"
+    }
+    if if_none_match and _etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return headers
+
+def with_cache_headers(response: Response, headers: Dict[str, str]) -> Response:
+    """Add the headers from session_cache_headers to a response an endpoint built itself."""
+    response.headers.update(headers)
+    return response
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored."""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return etag in [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
@@ -1,45 +1,177 @@
 """Session management endpoints."""
-import json
+import numpy as np
+from datetime import date
 from fastapi import APIRouter, Depends, HTTPException, Form, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional
 from database import get_db
 from models import SessionInfo, Weather, Driver, AttributeValue
 from auth_helpers import get_current_user
 from services.lap_service import LapService
+from services.session_service import SessionService
+from services.stats_service import StatsService
+from services.ibt_store import IbtStore
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+from services.comparison_service import ComparisonService, MAX_COMPARE_LAPS
+from services.compaction_service import CompactionService
+from services.downsampling import downsample, MODE_LTTB
+from routers.responses import (
+    offload_json, offload_channel, negotiated_format, session_cache_headers, with_cache_headers, CHANNEL_RESPONSES
+)
 
 router = APIRouter()
 
 @router.get("/")
-async def list_sessions(db: Session = Depends(get_db)):
-    """List all sessions."""
-    sessions = db.query(SessionInfo).all()
+async def list_sessions(
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of sessions to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    track_id: Optional[int] = Query(None),
+    track_config: Optional[str] = Query(None),
+    session_type: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None, description="Earliest session date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Latest session date (inclusive)"),
+    driver_user_id: Optional[int] = Query(None, description="Only sessions this driver took part in"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return (default: all)"),
+    include_total: bool = Query(True, description="Count all sessions matching the filters"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List sessions, newest first.
+    
+    Pages are fetched with a keyset cursor: pass the `next_cursor` of a
+    response as `cursor` to get the next page (`null` on the last page).
+    `count` is the number of sessions matching the filters across all pages.
+    """
+    try:
+        return await SessionService.list_sessions(
+            db,
+            limit,
+            cursor=cursor,
+            track_id=track_id,
+            track_config=track_config,
+            session_type=session_type,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=date_to.isoformat() if date_to else None,
+            driver_user_id=driver_user_id,
+            fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+            include_total=include_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Declared before /{session_id}, which would otherwise match "compare"
+@router.get("/compare")
+async def compare_laps(
+    lap: List[str] = Query(..., description="Laps to compare as SESSION_ID:LAP_NUMBER (repeatable); the first is the reference"),
+    attribute: List[str] = Query(..., description="Attribute names to align"),
+    points: int = Query(500, ge=2, le=10000, description="Number of LapDistPct grid positions"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Compare laps point by point along the track.
+
+    Every lap, possibly from different sessions at the same track and
+    configuration (lap lengths differ between configurations), is
+    resampled onto a common grid of `points` LapDistPct positions from 0 to
+    1, so all channels line up by track position. Each lap also gets its
+    elapsed time and a cumulative time delta to the first lap (positive:
+    behind) on the same grid. Positions a lap did not cover are null.
+    LapDistPct is extracted from a session's retained .ibt file if it was
+    not stored at upload.
+    """
+    pairs = []
+    for pair in dict.fromkeys(lap):
+        session_id, _, lap_number = pair.rpartition(":")
+        try:
+            pairs.append((session_id, int(lap_number)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Malformed lap '{pair}'; expected SESSION_ID:LAP_NUMBER")
+    if len(pairs) > MAX_COMPARE_LAPS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COMPARE_LAPS} laps can be compared")
+    attributes = list(dict.fromkeys(attribute))
+
+    try:
+        sessions = {
+            row.session_id: row for row in (await db.execute(
+                select(
+                    SessionInfo.session_id, SessionInfo.track_id, SessionInfo.track_config,
+                    SessionInfo.data_version, SessionInfo.content_hash
+                )
+                .where(SessionInfo.session_id.in_({session_id for session_id, _ in pairs}))
+            )).all()
+        }
+        unknown = [session_id for session_id in dict.fromkeys(session_id for session_id, _ in pairs) if session_id not in sessions]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Sessions not found: {', '.join(unknown)}")
+        tracks = {(sessions[session_id].track_id, sessions[session_id].track_config) for session_id, _ in pairs}
+        if len(tracks) > 1:
+            raise HTTPException(status_code=400, detail="Laps must be from sessions at the same track and configuration")
+
+        laps = []
+        for session_id, lap_number in pairs:
+            lap_data = await LapService.get_lap(session_id, lap_number, db)
+            if not lap_data:
+                raise HTTPException(status_code=404, detail=f"Lap {lap_number} not found in session {session_id}")
+            laps.append({
+                **lap_data,
+                "session_id": session_id,
+                "data_version": sessions[session_id].data_version,
+                "content_hash": sessions[session_id].content_hash
+            })
+
+        try:
+            compared = await ComparisonService.compare(laps, attributes, points, db)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Serializing the traces runs in a compute worker
+        track_id, track_config = tracks.pop()
+        return await offload_json(_comparison_payload, track_id, track_config, attributes, points, compared)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _comparison_payload(track_id: Optional[int], track_config: Optional[str], attributes: List[str], points: int,
+                        compared: List[dict]) -> dict:
+    """Aligned laps on the LapDistPct grid; NaN (positions a lap did not cover) becomes null."""
+    def trace(values):
+        if values is None:
+            return None
+        return np.where(np.isfinite(values), values, None).tolist()
+
     return {
-        "count": len(sessions),
-        "sessions": [
+        "track_id": track_id,
+        "track_config": track_config,
+        "points": points,
+        "attributes": attributes,
+        "lap_dist_pct": ComparisonService.grid(points).tolist(),
+        "laps": [
             {
-                "session_id": s.session_id,
-                "session_type": s.session_type,
-                "track_name": s.track_name,
-                "track_config": s.track_config,
-                "session_date": s.session_date,
-                "session_time": s.session_time
+                "session_id": lap["session_id"],
+                "lap_number": lap["lap_number"],
+                "lap_time": lap["lap_time"],
+                "time": trace(lap["time"]),
+                "time_delta": trace(lap["time_delta"]),
+                "channels": {attr: trace(values) for attr, values in lap["channels"].items()}
             }
-            for s in sessions
+            for lap in compared
         ]
     }
 
-@router.get("/{session_id}")
-async def get_session(session_id: str, db: Session = Depends(get_db)):
+@router.get("/{session_id}", dependencies=[Depends(session_cache_headers)])
+async def get_session(session_id: str, db: AsyncSession = Depends(get_db)):
     """Get detailed session information."""
-    session = db.query(SessionInfo).filter(SessionInfo.session_id == session_id).first()
+    session = await db.get(SessionInfo, session_id)
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Get related data
-    weather = db.query(Weather).filter(Weather.session_id == session_id).first()
-    drivers = db.query(Driver).filter(Driver.session_id == session_id).all()
+    weather = await db.get(Weather, session_id)
+    drivers = (await db.execute(select(Driver).where(Driver.session_id == session_id))).scalars().all()
     
     return {
         "session": {
@@ -73,12 +205,12 @@ async def get_session(session_id: str, db: Session = Depends(get_db)):
         ]
     }
 
-@router.get("/{session_id}/laps")
-async def get_session_lap_count(session_id: str, db: Session = Depends(get_db)):
+@router.get("/{session_id}/laps", dependencies=[Depends(session_cache_headers)])
+async def get_session_lap_count(session_id: str, db: AsyncSession = Depends(get_db)):
     """Get lap count and lap data for a session with optional incident detection."""
     try:
         # Include incident detection in lap data
-        laps = LapService.get_lap_indices(session_id, db, include_incidents=True)
+        laps = await LapService.get_lap_indices(session_id, db, include_incidents=True)
         
         # Count valid laps (no incidents)
         valid_lap_count = sum(1 for lap in laps if lap.get('valid_lap', True))
@@ -95,123 +227,180 @@ async def get_session_lap_count(session_id: str, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/{session_id}/laps/{lap_number}")
+# Declared before /laps/{lap_number}, which would otherwise match "stats"
+@router.get("/{session_id}/laps/stats", dependencies=[Depends(session_cache_headers)])
+async def get_laps_stats(
+    session_id: str,
+    attribute: List[str] = Query(..., description="Attribute names to calculate stats for"),
+    lap: Optional[List[int]] = Query(None, description="Lap numbers to include (repeatable; default: all laps)"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get average, min, max, stddev and percentiles for many attributes in many laps.
+
+    Returns one row per lap, each with the stats of every requested
+    attribute: the laps × attributes table of a stint analysis in one
+    request instead of one averages call per lap.
+    """
+    try:
+        laps = await LapService.get_lap_indices(session_id, db)
+
+        if lap:
+            lap_numbers = list(dict.fromkeys(lap))
+            known = {lap_data['lap_number'] for lap_data in laps}
+            unknown = [lap_number for lap_number in lap_numbers if lap_number not in known]
+            if unknown:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Laps not found in session: {', '.join(str(lap_number) for lap_number in unknown)}"
+                )
+        else:
+            lap_numbers = [lap_data['lap_number'] for lap_data in laps]
+
+        try:
+            laps_stats = await StatsService.get_laps_stats(session_id, laps, attribute, db, lap_numbers=lap_numbers)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        laps_by_number = {lap_data['lap_number']: lap_data for lap_data in laps}
+        return {
+            "session_id": session_id,
+            "lap_count": len(lap_numbers),
+            "attributes": list(dict.fromkeys(attribute)),
+            "laps": [
+                {
+                    "lap_number": lap_number,
+                    "start_index": laps_by_number[lap_number]['start_index'],
+                    "end_index": laps_by_number[lap_number]['end_index'],
+                    "lap_sample_count": laps_by_number[lap_number]['sample_count'],
+                    "attributes": attributes_stats
+                }
+                for lap_number, attributes_stats in laps_stats.items()
+            ]
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{session_id}/laps/{lap_number}", responses=CHANNEL_RESPONSES)
 async def get_lap_attribute_data(
     session_id: str,
     lap_number: int,
     attribute: str = Query(..., description="Attribute name to retrieve"),
-    db: Session = Depends(get_db)
+    max_points: Optional[int] = Query(None, ge=3, description="Downsample the lap to at most this many samples"),
+    downsample_mode: str = Query(MODE_LTTB, alias="downsample", description="Downsampling mode: lttb or minmax"),
+    fmt: str = Depends(negotiated_format),
+    cache_headers: Dict[str, str] = Depends(session_cache_headers),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get telemetry data for a specific attribute in a specific lap."""
+    """
+    Get telemetry data for a specific attribute in a specific lap.
+    
+    Honors the Accept header: JSON keyed by sample index (default), a plain
+    JSON array, Arrow IPC, .npy or MessagePack (see services.channel_formats).
+    
+    With `max_points`, laps with more samples are downsampled for charts
+    (see services.downsampling) and only the picked samples are returned,
+    still keyed by (or sent with) their sample index.
+    """
     try:
         # Get lap data
-        laps = LapService.get_lap_indices(session_id, db)
-        
-        # Find the specific lap
-        lap_data = next((lap for lap in laps if lap['lap_number'] == lap_number), None)
+        lap_data = await LapService.get_lap(session_id, lap_number, db)
         
         if not lap_data:
             raise HTTPException(status_code=404, detail=f"Lap {lap_number} not found in session")
         
-        # Fetch the attribute value
-        attr_value = db.query(AttributeValue).filter(
-            AttributeValue.session_id == session_id,
-            AttributeValue.attribute == attribute
-        ).first()
-        
-        if not attr_value:
-            raise HTTPException(status_code=404, detail=f"Attribute '{attribute}' not found for this session")
-        
-        # Parse the attribute data
+        # Read only the bytes covering the lap
         try:
-            attribute_data = json.loads(attr_value.value)
-        except json.JSONDecodeError as e:
+            # Dashboards read lap after lap of the same channel, so cache it whole
+            lap_range = await ChannelService.read_range(
+                session_id, attribute, lap_data['start_index'], lap_data['end_index'], db, populate=True
+            )
+        except ValueError as e:
             raise HTTPException(status_code=500, detail=f"Failed to parse attribute data: {str(e)}")
         
-        # Extract data for the specific lap range
-        start_index = lap_data['start_index']
-        end_index = lap_data['end_index']
-        
-        lap_attribute_data = {
-            str(i): attribute_data[i] if i < len(attribute_data) else None
-            for i in range(start_index, end_index + 1)
-        }
+        if lap_range is None:
+            raise HTTPException(status_code=404, detail=f"Attribute '{attribute}' not found for this session")
         
-        return {
+        # Building and serializing the payload run in a compute worker
+        metadata = {
             "session_id": session_id,
             "lap_number": lap_number,
             "attribute": attribute,
-            "start_index": start_index,
-            "end_index": end_index,
-            "sample_count": lap_data['sample_count'],
-            "data": lap_attribute_data
+            "start_index": lap_data['start_index'],
+            "end_index": lap_data['end_index'],
+            "sample_count": lap_data['sample_count']
         }
+        values = lap_range[0]
+        index = None
+        if max_points is not None:
+            try:
+                index, values = await ComputePool.run(downsample, values, max_points, downsample_mode)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            index = index + lap_data['start_index']
+            metadata.update(downsample=downsample_mode, max_points=max_points)
+        return with_cache_headers(await offload_channel(
+            fmt, values, metadata,
+            _lap_attribute_payload, session_id, lap_data, attribute, values, index, index=index
+        ), cache_headers)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/{session_id}/laps/{lap_number}/averages")
+def _lap_attribute_payload(session_id: str, lap_data: dict, attribute: str, lap_values, index=None) -> dict:
+    """Lap samples of a channel, keyed by sample index (index: those of downsampled samples)."""
+    start_index = lap_data['start_index']
+    end_index = lap_data['end_index']
+    
+    lap_values = lap_values.tolist()
+    if index is not None:
+        lap_attribute_data = dict(zip(map(str, index.tolist()), lap_values))
+    else:
+        lap_values += [None] * (end_index - start_index + 1 - len(lap_values))
+        lap_attribute_data = {
+            str(start_index + offset): value
+            for offset, value in enumerate(lap_values)
+        }
+    
+    return {
+        "session_id": session_id,
+        "lap_number": lap_data['lap_number'],
+        "attribute": attribute,
+        "start_index": start_index,
+        "end_index": end_index,
+        "sample_count": lap_data['sample_count'],
+        "data": lap_attribute_data
+    }
+
+@router.get("/{session_id}/laps/{lap_number}/averages", dependencies=[Depends(session_cache_headers)])
 async def get_lap_attribute_averages(
     session_id: str,
     lap_number: int,
     attribute: List[str] = Query(..., description="Attribute names to calculate averages for"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get average, min, and max values for specified attributes in a specific lap."""
+    """Get average, min, max, stddev and percentiles for specified attributes in a specific lap."""
     try:
         # Get lap data
-        laps = LapService.get_lap_indices(session_id, db)
-        
-        # Find the specific lap
-        lap_data = next((lap for lap in laps if lap['lap_number'] == lap_number), None)
+        lap_data = await LapService.get_lap(session_id, lap_number, db)
         
         if not lap_data:
             raise HTTPException(status_code=404, detail=f"Lap {lap_number} not found in session")
         
+        # Per-lap aggregates are precomputed at ingest
+        try:
+            attributes_averages = await StatsService.get_lap_stats(session_id, lap_number, attribute, db)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        
         start_index = lap_data['start_index']
         end_index = lap_data['end_index']
         
-        # Fetch all requested attributes and calculate averages
-        attributes_averages = {}
-        for attr_name in attribute:
-            attr_value = db.query(AttributeValue).filter(
-                AttributeValue.session_id == session_id,
-                AttributeValue.attribute == attr_name
-            ).first()
-            
-            if not attr_value:
-                attributes_averages[attr_name] = None
-                continue
-            
-            # Parse the attribute data
-            try:
-                parsed_data = json.loads(attr_value.value)
-            except json.JSONDecodeError as e:
-                raise HTTPException(status_code=500, detail=f"Failed to parse attribute '{attr_name}': {str(e)}")
-            
-            # Calculate statistics for this lap's frame range
-            values = [
-                parsed_data[i] for i in range(start_index, end_index + 1)
-                if i < len(parsed_data) and isinstance(parsed_data[i], (int, float))
-            ]
-            
-            # Calculate statistics
-            if values:
-                attributes_averages[attr_name] = {
-                    "average": sum(values) / len(values),
-                    "min": min(values),
-                    "max": max(values),
-                    "sample_count": len(values)
-                }
-            else:
-                attributes_averages[attr_name] = {
-                    "average": None,
-                    "min": None,
-                    "max": None,
-                    "sample_count": 0
-                }
-        
         return {
             "session_id": session_id,
             "lap_number": lap_number,
@@ -230,64 +419,58 @@ async def delete_lap_attribute_data(
     session_id: str,
     lap_number: int,
     current_user: dict = Depends(get_current_user),
-    attribute: Optional[List[str]] = Query(None, description="Specific attributes to delete (default: all)"),
-    db: Session = Depends(get_db)
+    attribute: Optional[List[str]] = Query(None, description="Attributes to delete; must name every stored attribute (default: all)"),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Delete telemetry data for a specific lap. Requires authentication."""
+    """
+    Delete telemetry data for a specific lap. Requires authentication.
+    
+    The lap's samples are deleted from every channel of the session, so the
+    boundaries of the other laps stay valid for all of them; naming only
+    some attributes is rejected. The samples disappear from every read at
+    once; they are removed from storage by the background compaction.
+    """
     try:
-        # Get lap data
-        laps = LapService.get_lap_indices(session_id, db)
-        
-        # Find the specific lap
-        lap_data = next((lap for lap in laps if lap['lap_number'] == lap_number), None)
+        # Also backfills the laps of sessions ingested before the lap table
+        if not await LapService.get_lap(session_id, lap_number, db):
+            raise HTTPException(status_code=404, detail=f"Lap {lap_number} not found in session")
         
+        # Lock the session's channels, then read the lap's bounds again under
+        # that lock: a concurrent delete of this or an earlier lap shifts them
+        all_attrs = (await db.execute(
+            select(AttributeValue.attribute)
+            .where(AttributeValue.session_id == session_id)
+            .order_by(AttributeValue.attribute)
+            .with_for_update()
+        )).all()
+        lap_data = await LapService.lock_lap(session_id, lap_number, db)
         if not lap_data:
             raise HTTPException(status_code=404, detail=f"Lap {lap_number} not found in session")
         
         start_index = lap_data['start_index']
         end_index = lap_data['end_index']
         
-        # Determine which attributes to delete
+        attributes_to_delete = [attr[0] for attr in all_attrs]
         if attribute:
-            attributes_to_delete = attribute
-        else:
-            # Get all attributes for this session
-            all_attrs = db.query(AttributeValue.attribute).filter(
-                AttributeValue.session_id == session_id
-            ).distinct().all()
-            attributes_to_delete = [attr[0] for attr in all_attrs]
+            # A channel cut on its own would no longer line up with the lap table
+            kept = [attr for attr in attributes_to_delete if attr not in attribute]
+            if kept:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"A lap is deleted from every attribute of the session; also name: {', '.join(kept)}"
+                )
         
-        # Delete data for each attribute in the lap range
-        deleted_count = 0
-        for attr_name in attributes_to_delete:
-            attr_value = db.query(AttributeValue).filter(
-                AttributeValue.session_id == session_id,
-                AttributeValue.attribute == attr_name
-            ).first()
-            
-            if not attr_value:
-                continue
-            
-            # Parse the attribute data
-            try:
-                attribute_data = json.loads(attr_value.value)
-            except json.JSONDecodeError as e:
-                raise HTTPException(status_code=500, detail=f"Failed to parse attribute '{attr_name}': {str(e)}")
-            
-            # Remove data for indices in the lap range
-            original_length = len(attribute_data)
-            attribute_data = [
-                val for i, val in enumerate(attribute_data)
-                if i < start_index or i > end_index
-            ]
-            deleted_count += original_length - len(attribute_data)
-            
-            # Update the attribute with modified data
-            new_value = json.dumps(attribute_data)
-            attr_value.value = new_value
-            attr_value.value_len = len(attribute_data)
+        # Mask the lap's samples; the channels themselves are rewritten by the compactor
+        deleted_count = await CompactionService.delete_samples(
+            session_id, attributes_to_delete, start_index, end_index, lap_number, db
+        )
+        
+        await LapService.remove_lap(session_id, lap_data, db)
+        await StatsService.invalidate_for_lap_delete(session_id, lap_number, db)
+        await ChannelService.bump_data_version(session_id, db)
         
-        db.commit()
+        await db.commit()
+        ChannelService.invalidate_cache(session_id)
         
         return {
             "session_id": session_id,
@@ -301,22 +484,26 @@ async def delete_lap_attribute_data(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{session_id}")
 async def delete_session(
     session_id: str,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a session (and all related data via CASCADE)."""
-    session = db.query(SessionInfo).filter(SessionInfo.session_id == session_id).first()
+    session = await db.get(SessionInfo, session_id)
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    db.delete(session)
-    db.commit()
+    # Related rows go with it through ON DELETE CASCADE
+    content_hash = session.content_hash
+    await db.execute(delete(SessionInfo).where(SessionInfo.session_id == session_id))
+    await db.commit()
+    ChannelService.invalidate_cache(session_id)
+    IbtStore.discard(content_hash)
     
     return {"message": f"Session {session_id} deleted successfully"}
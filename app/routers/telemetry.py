@@ -1,135 +1,433 @@
 """Telemetry data endpoints."""
 import os
-import json
-import tempfile
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
+import numpy as np
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import undefer
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from models import SessionInfo, AttributeValue
+from models import SessionInfo, AttributeValue, IngestJob
 from auth_helpers import get_current_user
-
-from iRacingTelemetry.telemetry_parser import parse_telemetry
+from services.channel_codec import decode_channel
+from services.ibt_store import IbtStore
+from services.channel_service import ChannelService
+from services.compute_pool import ComputePool
+from services.downsampling import downsample, MODE_LTTB
+from services.channel_formats import FORMAT_JSON, MEDIA_TYPES, NotAcceptable, metadata_headers
+from services.export_service import ExportService, STREAMED_FORMATS, EXPORT_CSV, EXPORT_MEDIA_TYPES, negotiate_export
+from services.ingest_service import IngestService, MODE_MERGE
+from services.upload_service import receive_ibt_upload, UploadRejected
+from routers.responses import (
+    offload_channel, negotiated_format, stream_response, session_cache_headers, with_cache_headers, CHANNEL_RESPONSES
+)
 
 router = APIRouter()
 
-@router.post("/upload")
+# The upload body is parsed by hand as it streams in, so describe it for the OpenAPI docs
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["telemetry_file"],
+                    "properties": {
+                        "telemetry_file": {"type": "string", "format": "binary"},
+                        "attributes": {"type": "string", "default": ""},
+                        "merge_attributes": {"type": "boolean", "default": False}
+                    }
+                }
+            }
+        }
+    }
+}
+
+@router.post("/upload", status_code=202, openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_telemetry(
+    request: Request,
     _: dict = Depends(get_current_user),  # Protected endpoint with oauth
-    telemetry_file: UploadFile = File(...),
-    attributes: str = Form(""),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Upload and parse iRacing telemetry file (.ibt).
+    Upload an iRacing telemetry file (.ibt) for background ingest.
+    
+    The file is streamed to disk as it arrives and rejected early if it is
+    too large or does not start with an IBT header. It is then queued and
+    parsed by an ingest worker; poll `/telemetry/jobs/{job_id}` for progress
+    and the resulting session_id.
+    
+    Files are identified by their SHA-256. Re-uploading a file that is
+    already stored returns the existing session_id (200) without parsing
+    anything, and re-uploading one that is still being ingested returns the
+    pending job.
     
     Parameters:
     - telemetry_file: The .ibt file to upload
-    - attributes: JSON array of telemetry attributes to extract (default: [])
+    - attributes: Comma-separated telemetry attributes to extract (default: none).
+      With the IBT store enabled, other attributes are extracted from the
+      retained file the first time they are requested
+    - merge_attributes: When the file is already stored, add any requested
+      attributes that the existing session does not have yet
     """
-    # Validate file type
-    if not telemetry_file.filename.lower().endswith('.ibt'):
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid file type. Only .ibt files are allowed"
-        )
-    
     try:
-        # Parse attributes JSON
+        # Stream the uploaded file into the spool where the ingest workers pick it up
+        job_id = IngestService.new_job_id()
         try:
-            attributes_list = [attr.strip() for attr in attributes.split(',') if attr.strip()] if attributes else []
-        except Exception:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid attributes format. Must be a JSON array"
-            )
+            upload = await receive_ibt_upload(request, IngestService.spool_path(job_id))
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
         
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ibt') as temp_file:
-            content = await telemetry_file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Parse attributes list
+        attributes = upload.fields.get("attributes", "")
+        attributes_list = [attr.strip() for attr in attributes.split(',') if attr.strip()]
+        merge = upload.fields.get("merge_attributes", "").strip().lower() in ("1", "true", "yes", "on")
         
         try:
-            # Call telemetry parser directly
-            telemetry_data = parse_telemetry(temp_file_path, attributes_list)
-            
-            # Check if there was an error
-            if isinstance(telemetry_data, str):
-                # If it's a string, it's likely an error JSON
-                error_data = json.loads(telemetry_data)
-                if 'error' in error_data:
-                    raise HTTPException(
-                        status_code=500,
-                        detail=error_data['error']
-                    )
-            
-            if isinstance(telemetry_data, dict) and 'error' in telemetry_data:
-                raise HTTPException(
-                    status_code=500,
-                    detail=telemetry_data['error']
+            existing = await db.run_sync(IngestService.find_session_by_hash, upload.content_hash)
+            if existing:
+                stored = set((await db.execute(
+                    select(AttributeValue.attribute).where(AttributeValue.session_id == existing.session_id)
+                )).scalars().all())
+                missing = [attr for attr in dict.fromkeys(attributes_list) if attr not in stored]
+                if not merge or not missing:
+                    # Keeps the file if this session was ingested before the store was enabled
+                    await run_in_threadpool(IbtStore.retain_or_remove, upload.file_path, upload.content_hash)
+                    duplicate = {
+                        "duplicate": True,
+                        "session_id": existing.session_id,
+                        "content_hash": upload.content_hash
+                    }
+                    if merge:
+                        duplicate["attributes_added"] = []
+                    return JSONResponse(status_code=200, content=duplicate)
+                job = await db.run_sync(
+                    IngestService.create_job, job_id, upload, missing, mode=MODE_MERGE, session_id=existing.session_id
                 )
-            
-            return telemetry_data
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                
+            else:
+                pending = await db.run_sync(IngestService.find_active_job_by_hash, upload.content_hash)
+                if pending:
+                    os.unlink(upload.file_path)
+                    return {
+                        "duplicate": True,
+                        "job_id": pending.job_id,
+                        "status": pending.status,
+                        "content_hash": pending.content_hash,
+                        "file_size": pending.file_size,
+                        "status_url": f"/telemetry/jobs/{pending.job_id}"
+                    }
+                job = await db.run_sync(IngestService.create_job, job_id, upload, attributes_list)
+        except Exception:
+            if os.path.exists(upload.file_path):
+                os.unlink(upload.file_path)
+            raise
+        
+        IngestService.submit(job.job_id)
+        
+        return {
+            "duplicate": False,
+            "job_id": job.job_id,
+            "status": job.status,
+            "mode": job.mode,
+            "content_hash": job.content_hash,
+            "file_size": job.file_size,
+            "status_url": f"/telemetry/jobs/{job.job_id}"
+        }
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred: {str(e)}"
         )
 
-@router.get("/{session_id}/attributes")
-async def get_session_attributes(session_id: str, db: Session = Depends(get_db)):
-    """Get all telemetry attributes for a session."""
+@router.get("/jobs")
+async def list_ingest_jobs(
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of jobs to return"),
+    db: AsyncSession = Depends(get_db)
+):
+    """List the most recent ingest jobs."""
+    jobs = (await db.execute(
+        select(IngestJob).order_by(IngestJob.created_at.desc()).limit(limit)
+    )).scalars().all()
+    return {
+        "count": len(jobs),
+        "jobs": [IngestService.job_to_dict(job) for job in jobs]
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """Get the status, per-stage timings and resulting session of an ingest job."""
+    job = await db.get(IngestJob, job_id)
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return IngestService.job_to_dict(job)
+
+@router.get("/{session_id}/attributes", dependencies=[Depends(session_cache_headers)])
+async def get_session_attributes(session_id: str, db: AsyncSession = Depends(get_db)):
+    """
+    List the telemetry attributes stored for a session.
+    
+    Each attribute is described by the metadata stored at ingest (dtype,
+    values per sample, units, min/max and a short preview); channel values
+    are not read.
+    """
     # Check if session exists
-    session = db.query(SessionInfo).filter(SessionInfo.session_id == session_id).first()
+    session = await db.get(SessionInfo, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get all attributes
-    attributes = db.query(AttributeValue).filter(
-        AttributeValue.session_id == session_id
-    ).all()
+    attributes = await ChannelService.list_channels(session_id, db)
     
     return {
         "session_id": session_id,
         "attribute_count": len(attributes),
-        "attributes": [
-            {
-                "attribute": attr.attribute,
-                "value_len": attr.value_len,
-                "value_preview": attr.value[:100] + "..." if attr.value and len(attr.value) > 100 else attr.value
-            }
-            for attr in attributes
-        ]
+        "attributes": attributes
     }
 
-@router.get("/{session_id}/attributes/{attribute_name}")
+@router.get("/{session_id}/attributes/{attribute_name}", responses=CHANNEL_RESPONSES)
 async def get_session_attribute(
     session_id: str,
     attribute_name: str,
-    db: Session = Depends(get_db)
+    start: Optional[int] = Query(None, ge=0, description="First sample index to return"),
+    end: Optional[int] = Query(None, ge=0, description="Last sample index to return (inclusive)"),
+    max_points: Optional[int] = Query(None, ge=3, description="Downsample to at most this many samples"),
+    downsample_mode: str = Query(MODE_LTTB, alias="downsample", description="Downsampling mode: lttb or minmax"),
+    fmt: str = Depends(negotiated_format),
+    accept_encoding: Optional[str] = Header(None),
+    cache_headers: Dict[str, str] = Depends(session_cache_headers),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get a specific telemetry attribute for a session."""
-    attribute = db.query(AttributeValue).filter(
-        AttributeValue.session_id == session_id,
-        AttributeValue.attribute == attribute_name
-    ).first()
+    """
+    Get a specific telemetry attribute for a session.
+    
+    With `start` and/or `end`, only samples in [start, end] are returned and
+    only the bytes covering them are read from the database.
+    
+    With `max_points`, the samples are downsampled for charts (see
+    services.downsampling) and returned with their sample `index`.
+    
+    Honors the Accept header: JSON (default), a plain JSON array, Arrow IPC,
+    .npy or MessagePack (see services.channel_formats).
+    
+    Whole stored channels in JSON, JSON array or .npy are streamed chunk by
+    chunk and compressed per Accept-Encoding (zstd or gzip), so they are
+    never held in memory whole.
+    
+    Attributes that were not extracted at upload are extracted from the
+    session's retained .ibt file (when the IBT store is enabled) and stored
+    for later reads.
+    """
+    if start is not None and end is not None and end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    ranged = start is not None or end is not None
+    range_start = start or 0
+    range_end = end if end is not None else np.iinfo(np.int64).max
+    
+    if ranged or max_points is not None:
+        try:
+            # Zoomed views of a chart come back for other ranges of the same channel, so cache it whole
+            stored = await ChannelService.read_range(
+                session_id, attribute_name, range_start, range_end, db, populate=max_points is not None
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to parse attribute data: {str(e)}")
+        if stored is not None:
+            values, value_len = stored
+            return with_cache_headers(await _range_response(
+                fmt, session_id, attribute_name, values, value_len, range_start, max_points, downsample_mode
+            ), cache_headers)
+        attribute = None
+    elif fmt in STREAMED_FORMATS:
+        try:
+            channels = await ExportService.open_channels(session_id, [attribute_name], db)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to parse attribute data: {str(e)}")
+        if channels:
+            channel = channels[attribute_name]
+            metadata = _range_metadata(session_id, attribute_name, 0, channel.length, channel.value_len)
+            # The stream reads with sessions of its own; don't hold this connection while it is sent
+            await db.close()
+            return with_cache_headers(stream_response(
+                ExportService.stream_channel(fmt, channel, metadata), MEDIA_TYPES[fmt], accept_encoding,
+                headers=None if fmt == FORMAT_JSON else metadata_headers(metadata)
+            ), cache_headers)
+        attribute = None
+    elif await ChannelService.tombstones(session_id, attribute_name, db):
+        # Samples of deleted laps are only masked until the channel is compacted
+        try:
+            values = await ChannelService.read_channel(session_id, attribute_name, db)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to parse attribute data: {str(e)}")
+        return with_cache_headers(await offload_channel(
+            fmt, values, _range_metadata(session_id, attribute_name, 0, len(values), len(values)),
+            _attribute_payload, session_id, attribute_name, values, len(values)
+        ), cache_headers)
+    else:
+        attribute = await db.get(AttributeValue, (session_id, attribute_name), options=[undefer(AttributeValue.value)])
     
-    if not attribute:
+    if attribute:
+        # Decoding and serializing the whole channel run in a compute worker
+        try:
+            return with_cache_headers(await offload_channel(
+                fmt, attribute.value,
+                _range_metadata(session_id, attribute_name, 0, attribute.value_len, attribute.value_len),
+                _stored_attribute_payload, session_id, attribute_name, attribute.value, attribute.value_len,
+                stored=True
+            ), cache_headers)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to parse attribute data: {str(e)}")
+    
+    # Not stored yet: extract it from the retained .ibt file
+    session = await db.get(SessionInfo, session_id)
+    materialized = None
+    if session:
+        try:
+            materialized = await run_in_threadpool(
+                IbtStore.materialize_channel, session_id, session.content_hash, attribute_name
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to extract attribute data: {str(e)}")
+    if not materialized:
         raise HTTPException(
             status_code=404,
             detail=f"Attribute '{attribute_name}' not found for session '{session_id}'"
         )
+    value_len = materialized["value_len"]
+    if ranged or max_points is not None:
+        values = materialized["value"][range_start:range_end + 1]
+        return with_cache_headers(await _range_response(
+            fmt, session_id, attribute_name, values, value_len, range_start, max_points, downsample_mode
+        ), cache_headers)
+    return with_cache_headers(await offload_channel(
+        fmt, materialized["value"], _range_metadata(session_id, attribute_name, 0, value_len, value_len),
+        _attribute_payload, session_id, attribute_name, materialized["value"], value_len
+    ), cache_headers)
+
+@router.get("/{session_id}/export", responses={
+    200: {
+        "description": "The session's channels as JSON or CSV",
+        "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()},
+    },
+    406: {"description": "Neither JSON nor CSV is acceptable"},
+})
+async def export_session_attributes(
+    session_id: str,
+    attribute: Optional[List[str]] = Query(None, description="Attributes to export (repeatable; default: all stored)"),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    cache_headers: Dict[str, str] = Depends(session_cache_headers),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download several stored channels of a session in one streamed response.
     
+    Honors the Accept header: JSON (default) lists the channels one after the
+    other; CSV (`text/csv`) has one row per sample index and a column per
+    channel. The body is generated chunk by chunk from storage and compressed
+    per Accept-Encoding (zstd or gzip).
+    """
+    try:
+        fmt = negotiate_export(accept)
+    except NotAcceptable as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    
+    session = await db.get(SessionInfo, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if attribute:
+        attributes = list(dict.fromkeys(attribute))
+    else:
+        attributes = (await db.execute(
+            select(AttributeValue.attribute).where(AttributeValue.session_id == session_id)
+            .order_by(AttributeValue.attribute)
+        )).scalars().all()
+    
+    try:
+        channels = await ExportService.open_channels(session_id, attributes, db)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=f"Failed to parse attribute data: {str(e)}")
+    missing = [name for name in attributes if name not in channels]
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Attributes not found for session '{session_id}': {', '.join(missing)}"
+        )
+    
+    # The stream reads with sessions of its own; don't hold this connection while it is sent
+    await db.close()
+    extension = "csv" if fmt == EXPORT_CSV else "json"
+    return with_cache_headers(stream_response(
+        ExportService.stream_export(fmt, session_id, list(channels.values())),
+        EXPORT_MEDIA_TYPES[fmt], accept_encoding,
+        headers={"Content-Disposition": f'attachment; filename="{session_id}.{extension}"'}
+    ), cache_headers)
+
+async def _range_response(fmt: str, session_id: str, attribute_name: str, values, value_len: int, start: int,
+                          max_points: Optional[int] = None, mode: str = MODE_LTTB) -> Response:
+    """A sample range of a channel in the negotiated format, downsampled to max_points if given."""
+    metadata = _range_metadata(session_id, attribute_name, start, len(values), value_len)
+    if max_points is None:
+        return await offload_channel(
+            fmt, values, metadata,
+            _attribute_range_payload, session_id, attribute_name, values, value_len, start
+        )
+
+    try:
+        index, values = await ComputePool.run(downsample, values, max_points, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    index = index + start
+    metadata.update(downsample=mode, max_points=max_points)
+    return await offload_channel(fmt, values, metadata, _downsampled_payload, metadata, values, index, index=index)
+
+def _range_metadata(session_id: str, attribute_name: str, start: int, count: int, value_len: int) -> dict:
+    """Metadata sent with binary channel responses."""
+    return {
+        "session_id": session_id,
+        "attribute": attribute_name,
+        "start": start,
+        "end": start + count - 1,
+        "value_len": value_len
+    }
+
+def _attribute_payload(session_id: str, attribute_name: str, values, value_len: int) -> dict:
+    """Response body for a whole channel."""
+    return {
+        "session_id": session_id,
+        "attribute": attribute_name,
+        "value": values.tolist(),
+        "value_len": value_len
+    }
+
+def _attribute_range_payload(session_id: str, attribute_name: str, values, value_len: int, start: int) -> dict:
+    """Response body for a sample range of a channel."""
     return {
         "session_id": session_id,
-        "attribute": attribute.attribute,
-        "value": attribute.value,
-        "value_len": attribute.value_len
+        "attribute": attribute_name,
+        "start": start,
+        "end": start + len(values) - 1,
+        "value": values.tolist(),
+        "value_len": value_len
     }
+
+def _downsampled_payload(metadata: dict, values, index) -> dict:
+    """Response body for downsampled samples of a channel, with the sample index of each."""
+    return {
+        **metadata,
+        "index": index.tolist(),
+        "value": values.tolist()
+    }
+
+def _stored_attribute_payload(session_id: str, attribute_name: str, value: bytes, value_len: int) -> dict:
+    """Response body for a whole channel as stored in attribute_values."""
+    return _attribute_payload(session_id, attribute_name, decode_channel(value), value_len)
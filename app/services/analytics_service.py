@@ -0,0 +1,473 @@
+"""Columnar analytics store: every session's channels as partitioned Parquet, queried with DuckDB.
+
+Cross-session questions ("mean Speed per track sector over all sessions at a
+track last month") would otherwise decode one blob per session in Python.
+Here each session is exported once to a Parquet file with one row per
+sample, one column per channel, the session's track and date and its
+player's driver and car next to the lap, lap validity and track sector of
+every sample. Queries scan only the partitions their filters select, and
+DuckDB aggregates them in parallel without loading whole files.
+
+Layout under settings.analytics_dir:
+
+    manifest.json                                                 {"format", "sessions": {session_id: {"data_version", "path"}}}
+    .lock                                                         flock held by the process refreshing the store
+    samples/track_id={track_id}/session_date={date}/{session_id}.parquet
+
+refresh() is incremental: it compares session_info with the manifest,
+exports new sessions and sessions whose data_version changed (lap deletes,
+added attributes) in the compute workers, and removes the files of deleted
+sessions. Sessions exported with an older EXPORT_FORMAT are exported again.
+Files are written to a temporary name and renamed into place, so queries
+never see a partial file.
+"""
+import os
+import re
+import json
+import glob
+import fcntl
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import SessionLocal, AsyncSessionLocal
+from models import SessionInfo, Driver, AttributeValue, Lap, ChannelTombstone
+from services.tombstones import decode_masked
+from services.lap_service import LapService
+from services.compute_pool import ComputePool
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pa_parquet
+except ImportError:  # optional: sessions cannot be exported
+    pa = None
+
+try:
+    import duckdb
+except ImportError:  # optional: the store cannot be queried
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the columns of exported files change
+EXPORT_FORMAT = 2
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+SAMPLES_DIR = "samples"
+UNKNOWN_PARTITION = "unknown"
+
+# Channels stored as dedicated columns rather than under their own name
+LAP_CHANNEL = "Lap"
+LAP_DIST_CHANNEL = "LapDistPct"
+
+# Columns /analytics can group by (lap_dist is the LapDistPct bucket, see bins)
+GROUP_COLUMNS = [
+    "sector",
+    "lap_dist",
+    "lap_number",
+    "session_id",
+    "session_date",
+    "track_config",
+    "car_name",
+    "driver_user_id",
+]
+
+# Channel names are DuckDB column names; only plain identifiers are queried
+_ATTRIBUTE_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_refresher: Optional[asyncio.Task] = None
+
+class AnalyticsService:
+    """Service for exporting sessions to the analytics store and aggregating over it."""
+
+    @staticmethod
+    def available() -> bool:
+        """Whether this process can export and query (pyarrow and duckdb installed)."""
+        return pa is not None and duckdb is not None
+
+    @staticmethod
+    async def refresh(db: AsyncSession) -> Optional[Dict]:
+        """
+        Bring the store up to date with session_info.
+
+        Sessions are exported in batches in the compute workers, and the
+        manifest is saved after every batch so an interrupted refresh resumes
+        where it stopped. Only one process on the host refreshes at a time.
+
+        Returns:
+            Counts of `exported`, `removed` and stored `sessions`, or None if
+            another refresh is already running
+        """
+        if not AnalyticsService.available():
+            raise RuntimeError("The analytics store requires pyarrow and duckdb")
+
+        with _refresh_lock() as acquired:
+            if not acquired:
+                return None
+
+            manifest = _read_manifest()
+            stored = manifest["sessions"]
+            current = dict((await db.execute(select(SessionInfo.session_id, SessionInfo.data_version))).all())
+            # Do not hold the connection while exporting
+            await db.close()
+
+            removed = [session_id for session_id in stored if session_id not in current]
+            for session_id in removed:
+                _remove_file(stored.pop(session_id)["path"])
+            if removed:
+                _write_manifest(manifest)
+
+            stale = [
+                session_id for session_id, data_version in current.items()
+                if stored.get(session_id, {}).get("data_version") != data_version
+            ]
+            exported = 0
+            batch_size = max(settings.compute_workers, 1) * 2
+            for offset in range(0, len(stale), batch_size):
+                batch = stale[offset:offset + batch_size]
+                results = await asyncio.gather(*(
+                    ComputePool.run(AnalyticsService.export_session, session_id) for session_id in batch
+                ), return_exceptions=True)
+                for session_id, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        logger.error("Could not export session %s for analytics: %s", session_id, result)
+                        continue
+                    previous = stored.pop(session_id, None)
+                    if previous and previous["path"] != (result or {}).get("path"):
+                        _remove_file(previous["path"])
+                    if result is not None:
+                        stored[session_id] = result
+                        exported += 1
+                _write_manifest(manifest)
+
+            return {"exported": exported, "removed": len(removed), "sessions": len(stored)}
+
+    @staticmethod
+    async def run_refresher():
+        """Refresh the store every settings.analytics_refresh_seconds until cancelled."""
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    result = await AnalyticsService.refresh(db)
+                if result and (result["exported"] or result["removed"]):
+                    logger.info("Analytics store refreshed: %s", result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Analytics store refresh failed: %s", e)
+            await asyncio.sleep(settings.analytics_refresh_seconds)
+
+    @staticmethod
+    def start_refresher():
+        """Start refreshing the store in the background, if enabled."""
+        global _refresher
+        if _refresher is None and settings.analytics_refresh_seconds > 0 and AnalyticsService.available():
+            _refresher = asyncio.get_running_loop().create_task(AnalyticsService.run_refresher())
+
+    @staticmethod
+    def stop_refresher():
+        """Stop the background refresh."""
+        global _refresher
+        if _refresher is not None:
+            _refresher.cancel()
+            _refresher = None
+
+    @staticmethod
+    def export_session(session_id: str) -> Optional[Dict]:
+        """
+        Write one session's samples to its Parquet partition.
+
+        Runs in a compute worker with its own database connection. Only
+        numeric single-value channels (those in settings.analytics_channels,
+        if set) that line up with the Lap channel are exported.
+
+        Returns:
+            The manifest entry (data_version and relative path, None if the
+            session has no exportable channels), or None if the session no
+            longer exists
+        """
+        db = SessionLocal()
+        try:
+            session = db.get(SessionInfo, session_id)
+            if session is None:
+                return None
+            drivers = db.query(Driver.driver_user_id, Driver.car_name).filter(Driver.session_id == session_id).all()
+            driver = LapService.player_driver(session.player_driver_user_id, [row._mapping for row in drivers])
+            laps = db.query(Lap).filter(Lap.session_id == session_id).order_by(Lap.start_index).all()
+            attributes = db.query(AttributeValue).filter(AttributeValue.session_id == session_id).all()
+
+            wanted = [name.strip() for name in settings.analytics_channels.split(",") if name.strip()]
+            by_name = {row.attribute: row for row in attributes}
+            sample_count = by_name[LAP_CHANNEL].value_len if LAP_CHANNEL in by_name else max(
+                (row.value_len for row in attributes), default=0
+            )
+
+            def read(name):
+                value = db.query(AttributeValue.value).filter(
+                    AttributeValue.session_id == session_id,
+                    AttributeValue.attribute == name
+                ).scalar()
+                tombstones = db.query(ChannelTombstone.start_index, ChannelTombstone.end_index).filter(
+                    ChannelTombstone.session_id == session_id,
+                    ChannelTombstone.attribute == name
+                ).order_by(ChannelTombstone.start_index).all()
+                return decode_masked(value, [tuple(row) for row in tombstones])
+
+            channels = {}
+            for row in attributes:
+                name = row.attribute
+                if name in (LAP_CHANNEL, LAP_DIST_CHANNEL) or (wanted and name not in wanted):
+                    continue
+                if (row.values_per_sample or 1) != 1 or row.value_len != sample_count:
+                    continue
+                if not _ATTRIBUTE_NAME.match(name):
+                    continue
+                values = read(name)
+                if values.ndim == 1 and values.dtype.kind in 'biuf':
+                    channels[name] = values
+            lap_dist = read(LAP_DIST_CHANNEL) if LAP_DIST_CHANNEL in by_name else None
+            if lap_dist is not None and lap_dist.shape[0] != sample_count:
+                lap_dist = None
+
+            entry = {"data_version": session.data_version, "path": None}
+            if not channels:
+                return entry
+
+            table = _session_table(session, driver, laps, sample_count, lap_dist, channels)
+            relative_path = _session_path(session)
+            path = os.path.join(settings.analytics_dir, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            pa_parquet.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, path)
+            entry["path"] = relative_path
+            return entry
+        finally:
+            db.close()
+
+    @staticmethod
+    def query(
+        attributes: List[str],
+        group_by: List[str],
+        bins: int = 100,
+        track_id: Optional[int] = None,
+        track_config: Optional[str] = None,
+        car_name: Optional[str] = None,
+        driver_user_id: Optional[int] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        valid_only: bool = False
+    ) -> Dict:
+        """
+        Aggregate channels over every stored sample matching the filters.
+
+        track_id and the date range select partition directories, so files of
+        other tracks and dates are never opened; the other filters are pushed
+        down into the Parquet scans. Blocking (DuckDB runs on its own
+        threads); call it from the threadpool.
+
+        Args:
+            attributes: Channels to aggregate
+            group_by: Columns to group by, from GROUP_COLUMNS
+            bins: Number of LapDistPct buckets for lap_dist
+            valid_only: Only samples of valid laps
+
+        Returns:
+            Dict with `files` scanned and one `groups` row per group: the
+            group columns, `sample_count` and, per attribute, its count,
+            mean, min, max, stddev, p50 and p95
+
+        Raises:
+            ValueError: If a group column or an attribute is unknown
+            RuntimeError: If duckdb is not installed
+        """
+        if duckdb is None:
+            raise RuntimeError("Analytics queries require duckdb")
+        attributes = list(dict.fromkeys(attributes))
+        group_by = list(dict.fromkeys(group_by))
+        unknown = [column for column in group_by if column not in GROUP_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown group_by columns: {', '.join(unknown)}; available: {', '.join(GROUP_COLUMNS)}")
+        invalid = [attr for attr in attributes if not _ATTRIBUTE_NAME.match(attr)]
+        if invalid:
+            raise ValueError(f"Invalid attribute names: {', '.join(invalid)}")
+
+        files = _partition_files(track_id, date_from, date_to)
+        result = {"attributes": attributes, "group_by": group_by, "files": len(files), "groups": []}
+        if not files:
+            return result
+
+        conditions, params = [], []
+        for column, value in (
+            ("track_id", track_id), ("track_config", track_config), ("car_name", car_name),
+            ("driver_user_id", driver_user_id)
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if date_from is not None:
+            conditions.append("session_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("session_date <= ?")
+            params.append(date_to)
+        if valid_only:
+            conditions.append("lap_valid")
+
+        group_exprs = [
+            f"floor(lap_dist_pct * {int(bins)}) / {int(bins)} AS lap_dist" if column == "lap_dist" else column
+            for column in group_by
+        ]
+        aggregates = ["count(*) AS sample_count"]
+        for i, attr in enumerate(attributes):
+            aggregates += [
+                f'count("{attr}") AS a{i}_count', f'avg("{attr}") AS a{i}_mean',
+                f'min("{attr}") AS a{i}_min', f'max("{attr}") AS a{i}_max',
+                f'stddev_pop("{attr}") AS a{i}_stddev',
+                f'quantile_cont("{attr}", 0.5) AS a{i}_p50', f'quantile_cont("{attr}", 0.95) AS a{i}_p95'
+            ]
+        file_list = ", ".join("'" + path.replace("'", "''") + "'" for path in files)
+        sql = (
+            f"SELECT {', '.join(group_exprs + aggregates)} "
+            f"FROM read_parquet([{file_list}], union_by_name = true, hive_partitioning = false)"
+            + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+            + (f" GROUP BY {', '.join(str(i + 1) for i in range(len(group_by)))}"
+               f" ORDER BY {', '.join(str(i + 1) for i in range(len(group_by)))} NULLS LAST" if group_by else "")
+        )
+
+        connection = duckdb.connect()
+        try:
+            if settings.analytics_threads > 0:
+                connection.execute(f"SET threads = {int(settings.analytics_threads)}")
+            try:
+                cursor = connection.execute(sql, params)
+            except duckdb.BinderException as e:
+                raise ValueError(str(e).splitlines()[0])
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        for row in rows:
+            values = dict(zip(columns, row))
+            group = {column: values[column] for column in group_by}
+            group["sample_count"] = values["sample_count"]
+            for i, attr in enumerate(attributes):
+                group[attr] = {
+                    stat: values[f"a{i}_{stat}"]
+                    for stat in ("count", "mean", "min", "max", "stddev", "p50", "p95")
+                }
+            result["groups"].append(group)
+        return result
+
+def _session_table(session: SessionInfo, driver: Optional[Dict], laps: List[Lap], sample_count: int, lap_dist, channels: Dict):
+    """Arrow table of one session: session columns, per-sample lap, validity and sector, then the channels."""
+    lap_number = np.full(sample_count, -1, dtype=np.int32)
+    lap_valid = np.zeros(sample_count, dtype=bool)
+    for lap in laps:
+        lap_number[lap.start_index:lap.end_index + 1] = lap.lap_number
+        lap_valid[lap.start_index:lap.end_index + 1] = bool(lap.complete and lap.valid)
+    outside = lap_number < 0
+
+    # Sector of every sample from the track's sector start positions
+    sector = None
+    if lap_dist is not None and session.track_config_sector_info:
+        try:
+            starts = sorted(float(s["SectorStartPct"]) for s in json.loads(session.track_config_sector_info))
+        except (ValueError, TypeError, KeyError):
+            starts = []
+        if starts:
+            sector = np.maximum(np.searchsorted(starts, np.asarray(lap_dist, dtype=np.float64), side="right") - 1, 0)
+
+    def constant(value, type_):
+        return pa.repeat(pa.scalar(value, type=type_), sample_count)
+
+    columns = {
+        "session_id": constant(session.session_id, pa.string()),
+        "track_id": constant(session.track_id, pa.int32()),
+        "track_config": constant(session.track_config, pa.string()),
+        "session_date": constant(session.session_date, pa.string()),
+        "session_type": constant(session.session_type, pa.string()),
+        "driver_user_id": constant(driver["driver_user_id"] if driver else None, pa.int32()),
+        "car_name": constant(driver["car_name"] if driver else None, pa.string()),
+        "sample_index": pa.array(np.arange(sample_count, dtype=np.int32)),
+        "lap_number": pa.array(lap_number, mask=outside),
+        "lap_valid": pa.array(lap_valid, mask=outside),
+        "sector": pa.array(sector.astype(np.int16)) if sector is not None else pa.nulls(sample_count, pa.int16()),
+        "lap_dist_pct": pa.array(np.asarray(lap_dist)) if lap_dist is not None else pa.nulls(sample_count, pa.float32()),
+    }
+    for name, values in channels.items():
+        columns[name] = pa.array(np.asarray(values))
+    return pa.table(columns)
+
+def _session_path(session: SessionInfo) -> str:
+    """Relative path of a session's file: its track and date partition."""
+    track = UNKNOWN_PARTITION if session.track_id is None else str(session.track_id)
+    day = quote(session.session_date, safe="-") if session.session_date else UNKNOWN_PARTITION
+    return os.path.join(
+        SAMPLES_DIR, f"track_id={track}", f"session_date={day}", f"{quote(session.session_id, safe='')}.parquet"
+    )
+
+def _partition_files(track_id: Optional[int], date_from: Optional[str], date_to: Optional[str]) -> List[str]:
+    """Files of the partitions a query's track and date range select."""
+    track = "*" if track_id is None else str(track_id)
+    files = []
+    for directory in glob.glob(os.path.join(settings.analytics_dir, SAMPLES_DIR, f"track_id={track}", "session_date=*")):
+        day = unquote(os.path.basename(directory)[len("session_date="):])
+        if date_from is not None or date_to is not None:
+            if day == UNKNOWN_PARTITION or (date_from is not None and day < date_from) or (date_to is not None and day > date_to):
+                continue
+        files.extend(glob.glob(os.path.join(directory, "*.parquet")))
+    return sorted(files)
+
+@contextmanager
+def _refresh_lock():
+    """Non-blocking exclusive lock shared by every process on the host; yields whether it was taken."""
+    os.makedirs(settings.analytics_dir, exist_ok=True)
+    with open(os.path.join(settings.analytics_dir, LOCK_FILE), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _read_manifest() -> Dict:
+    try:
+        with open(os.path.join(settings.analytics_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("sessions"), dict):
+            if manifest.get("format") != EXPORT_FORMAT:
+                # Files of an older format are kept (and queried) until exported again
+                for entry in manifest["sessions"].values():
+                    entry["data_version"] = None
+                manifest["format"] = EXPORT_FORMAT
+            return manifest
+    except (OSError, ValueError, AttributeError):
+        pass
+    # Without a manifest every session is exported again, overwriting its file
+    return {"format": EXPORT_FORMAT, "sessions": {}}
+
+def _write_manifest(manifest: Dict):
+    """Replace the manifest atomically. Caller holds the refresh lock."""
+    path = os.path.join(settings.analytics_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def _remove_file(relative_path: Optional[str]):
+    if relative_path is None:
+        return
+    try:
+        os.unlink(os.path.join(settings.analytics_dir, relative_path))
+    except FileNotFoundError:
+        pass
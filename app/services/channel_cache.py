@@ -0,0 +1,97 @@
+"""Process-local cache of decoded telemetry channels."""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+from config import settings
+
+# Decoded arrays by (session_id, attribute, data_version), least recently used first
+_entries: "OrderedDict[Tuple[str, str, int], np.ndarray]" = OrderedDict()
+_lock = threading.Lock()
+_size_bytes = 0
+_counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+class ChannelCache:
+    """
+    LRU cache of decoded channels, bounded by settings.channel_cache_bytes.
+
+    Entries are keyed by the session's data_version, which every change to a
+    session's stored samples bumps, so a stale entry is never returned even
+    when another process made the change; explicit invalidation just frees
+    the memory early. Cached arrays are read-only and shared by all readers.
+    """
+
+    @staticmethod
+    def get(session_id: str, attribute: str, data_version: int) -> Optional[np.ndarray]:
+        """Return the cached channel, or None (counted as a miss)."""
+        key = (session_id, attribute, data_version)
+        with _lock:
+            values = _entries.get(key)
+            if values is None:
+                _counters["misses"] += 1
+                return None
+            _entries.move_to_end(key)
+            _counters["hits"] += 1
+            return values
+
+    @staticmethod
+    def put(session_id: str, attribute: str, data_version: int, values: np.ndarray) -> np.ndarray:
+        """
+        Cache a decoded channel, evicting least recently used entries to stay
+        within the byte budget. Channels larger than the budget are not cached.
+
+        Returns:
+            The read-only array to use in place of values
+        """
+        global _size_bytes
+        values.setflags(write=False)
+        budget = settings.channel_cache_bytes
+        if values.nbytes > budget:
+            return values
+
+        key = (session_id, attribute, data_version)
+        with _lock:
+            previous = _entries.pop(key, None)
+            if previous is not None:
+                _size_bytes -= previous.nbytes
+            while _entries and _size_bytes + values.nbytes > budget:
+                _, evicted = _entries.popitem(last=False)
+                _size_bytes -= evicted.nbytes
+                _counters["evictions"] += 1
+            _entries[key] = values
+            _size_bytes += values.nbytes
+        return values
+
+    @staticmethod
+    def invalidate(session_id: str, attributes=None):
+        """Drop every cached version of a session's channels (only the given attributes, if any)."""
+        global _size_bytes
+        with _lock:
+            stale = [
+                key for key in _entries
+                if key[0] == session_id and (attributes is None or key[1] in attributes)
+            ]
+            for key in stale:
+                _size_bytes -= _entries.pop(key).nbytes
+            _counters["invalidations"] += len(stale)
+
+    @staticmethod
+    def clear():
+        """Drop every entry; counters are kept."""
+        global _size_bytes
+        with _lock:
+            _entries.clear()
+            _size_bytes = 0
+
+    @staticmethod
+    def stats() -> Dict:
+        """Hit/miss/eviction/invalidation counters and current size."""
+        with _lock:
+            lookups = _counters["hits"] + _counters["misses"]
+            return {
+                **_counters,
+                "hit_ratio": _counters["hits"] / lookups if lookups else None,
+                "entries": len(_entries),
+                "size_bytes": _size_bytes,
+                "budget_bytes": settings.channel_cache_bytes
+            }
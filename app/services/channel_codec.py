@@ -0,0 +1,196 @@
+"""Binary storage format for telemetry channel values.
+
+Each channel is stored as a fixed header followed by the samples packed as a
+little-endian array in the IBT variable's native type:
+
+    magic (4s) | format version (B) | IBT var type (B) | values per sample (H) | sample count (I)
+"""
+import json
+import struct
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+CHANNEL_MAGIC = b'IRCH'
+CHANNEL_FORMAT_VERSION = 1
+HEADER_STRUCT = struct.Struct('<4sBBHI')
+HEADER_LEN = HEADER_STRUCT.size
+
+# IBT var types, in irsdk.VAR_TYPE_MAP order: char, bool, int, bitfield, float, double
+VAR_TYPE_CHAR = 0
+VAR_TYPE_BOOL = 1
+VAR_TYPE_INT = 2
+VAR_TYPE_BITFIELD = 3
+VAR_TYPE_FLOAT = 4
+VAR_TYPE_DOUBLE = 5
+
+IBT_VAR_DTYPES = {
+    VAR_TYPE_CHAR: np.dtype('u1'),
+    VAR_TYPE_BOOL: np.dtype('?'),
+    VAR_TYPE_INT: np.dtype('<i4'),
+    VAR_TYPE_BITFIELD: np.dtype('<u4'),
+    VAR_TYPE_FLOAT: np.dtype('<f4'),
+    VAR_TYPE_DOUBLE: np.dtype('<f8'),
+}
+
+
+class ChannelHeader(NamedTuple):
+    """Decoded channel header."""
+    var_type: int
+    count: int
+    length: int
+
+    @property
+    def dtype(self) -> np.dtype:
+        return IBT_VAR_DTYPES[self.var_type]
+
+
+def is_legacy_json(blob) -> bool:
+    """Return True if the stored value is a pre-binary JSON array."""
+    if blob is None:
+        return False
+    if isinstance(blob, str):
+        return True
+    return bytes(blob[:len(CHANNEL_MAGIC)]) != CHANNEL_MAGIC
+
+
+def infer_var_type(values: np.ndarray, narrow: bool = False) -> int:
+    """
+    Pick the IBT var type for an array.
+
+    Arrays already in a native IBT dtype keep it unless narrow is set, in which
+    case the narrowest type that holds the values losslessly is chosen (used
+    for values that went through JSON and lost their original type).
+    """
+    if not narrow:
+        for var_type, dtype in IBT_VAR_DTYPES.items():
+            if values.dtype == dtype:
+                return var_type
+    if values.dtype == np.bool_:
+        return VAR_TYPE_BOOL
+    if np.issubdtype(values.dtype, np.integer):
+        if values.size == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+            return VAR_TYPE_INT
+        return VAR_TYPE_DOUBLE
+    if np.issubdtype(values.dtype, np.floating):
+        as_float32 = values.astype(np.float32)
+        if np.array_equal(as_float32.astype(values.dtype), values, equal_nan=True):
+            return VAR_TYPE_FLOAT
+        return VAR_TYPE_DOUBLE
+    raise ValueError(f"Unsupported channel dtype: {values.dtype}")
+
+
+def encode_channel(values, var_type: Optional[int] = None) -> bytes:
+    """
+    Encode channel values into the binary storage format.
+
+    Args:
+        values: Sequence or array of samples (scalars, or fixed-size lists for array variables)
+        var_type: IBT var type; inferred from the values when omitted
+
+    Returns:
+        Header and packed little-endian sample data
+    """
+    if values is None:
+        raise ValueError("Cannot encode an empty channel")
+
+    array = np.asarray(values)
+    if array.dtype.kind == 'S':
+        # char variables come back from irsdk as single bytes
+        array = array.view(np.uint8)
+    if var_type is None:
+        var_type = infer_var_type(array)
+    array = array.astype(IBT_VAR_DTYPES[var_type], copy=False)
+
+    length = array.shape[0] if array.ndim else 1
+    count = array.shape[1] if array.ndim > 1 else 1
+    header = HEADER_STRUCT.pack(CHANNEL_MAGIC, CHANNEL_FORMAT_VERSION, var_type, count, length)
+    return header + np.ascontiguousarray(array).tobytes()
+
+
+def decode_header(blob) -> ChannelHeader:
+    """Decode the header of a binary channel value."""
+    magic, version, var_type, count, length = HEADER_STRUCT.unpack_from(blob, 0)
+    if magic != CHANNEL_MAGIC or version != CHANNEL_FORMAT_VERSION:
+        raise ValueError("Unrecognized channel storage format")
+    return ChannelHeader(var_type, count, length)
+
+
+def sample_range(header: ChannelHeader, start: int, end: int):
+    """
+    Byte range of samples [start, end] (inclusive, clamped to the channel) in a
+    stored value.
+
+    Returns:
+        (offset, length) from the start of the stored value
+    """
+    start = max(start, 0)
+    end = min(end, header.length - 1)
+    sample_bytes = header.dtype.itemsize * header.count
+    return HEADER_LEN + start * sample_bytes, max(end - start + 1, 0) * sample_bytes
+
+
+def decode_samples(header: ChannelHeader, data) -> np.ndarray:
+    """Decode packed samples read from a stored value, e.g. a byte range from sample_range."""
+    values = np.frombuffer(data, dtype=header.dtype)
+    return values.reshape(-1, header.count) if header.count > 1 else values
+
+
+def decode_channel(blob) -> np.ndarray:
+    """
+    Decode a stored channel value into a NumPy array.
+
+    Values still stored as legacy JSON text are parsed and converted so
+    unmigrated rows keep working.
+
+    Returns:
+        Read-only 1-D array, or a 2-D (samples x count) array for array variables
+    """
+    if blob is None:
+        return np.empty(0, dtype=np.float32)
+
+    if is_legacy_json(blob):
+        values = np.asarray(json.loads(blob))
+        return values.astype(IBT_VAR_DTYPES[infer_var_type(values, narrow=True)], copy=False)
+
+    header = decode_header(blob)
+    values = np.frombuffer(blob, dtype=header.dtype, count=header.length * header.count, offset=HEADER_LEN)
+    return values.reshape(header.length, header.count) if header.count > 1 else values
+
+
+PREVIEW_CHARS = 100
+
+
+def describe_channel(values, units: Optional[str] = None) -> dict:
+    """
+    Metadata stored alongside a channel so it can be listed without reading
+    the samples.
+
+    Returns:
+        Dict with dtype, values_per_sample, units, value_min/value_max (over
+        the finite values, None if there are none) and value_preview (the
+        first samples as JSON, cut to PREVIEW_CHARS characters)
+    """
+    array = np.asarray(values)
+    if array.dtype.kind == 'S':
+        array = array.view(np.uint8)
+
+    numeric = array.astype(np.uint8) if array.dtype == np.bool_ else array
+    if numeric.dtype.kind == 'f':
+        numeric = numeric[np.isfinite(numeric)]
+    value_min = value_max = None
+    if numeric.size:
+        value_min, value_max = float(numeric.min()), float(numeric.max())
+
+    preview = json.dumps(array[:PREVIEW_CHARS].tolist())
+    if len(preview) > PREVIEW_CHARS:
+        preview = preview[:PREVIEW_CHARS] + "..."
+
+    return {
+        "dtype": array.dtype.str,
+        "values_per_sample": array.shape[1] if array.ndim > 1 else 1,
+        "units": units or None,
+        "value_min": value_min,
+        "value_max": value_max,
+        "value_preview": preview
+    }
@@ -0,0 +1,198 @@
+"""Serialization of channel samples for content-negotiated responses.
+
+Telemetry read endpoints honor the Accept header:
+
+    application/json                       the endpoint's regular JSON body (default)
+    application/json; layout=array         metadata plus a plain `values` array
+    application/vnd.apache.arrow.stream    Arrow IPC stream, one column (requires pyarrow)
+    application/x-npy                      NumPy .npy array
+    application/msgpack                    metadata plus dtype, shape and raw little-endian `data` (requires msgpack)
+
+Binary formats carry the response metadata in X-Telemetry-* headers; Arrow
+also stores it in the schema metadata and MessagePack in the body.
+
+Downsampled responses (see services.downsampling) also carry the sample
+index of every value: an `index` array next to `values` in the JSON array
+layout, an `index` column in Arrow, `index` bytes (little-endian int64) in
+MessagePack, and a structured array with `index` and `value` fields in .npy.
+"""
+import io
+import json
+from typing import Dict, Optional
+
+import numpy as np
+
+from services.channel_codec import decode_channel
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # optional: Arrow responses are not offered
+    pa = None
+
+try:
+    import msgpack
+except ImportError:  # optional: MessagePack responses are not offered
+    msgpack = None
+
+FORMAT_JSON = "json"
+FORMAT_JSON_ARRAY = "json-array"
+FORMAT_ARROW = "arrow"
+FORMAT_NPY = "npy"
+FORMAT_MSGPACK = "msgpack"
+
+MEDIA_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_JSON_ARRAY: "application/json; layout=array",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+    FORMAT_NPY: "application/x-npy",
+    FORMAT_MSGPACK: "application/msgpack",
+}
+
+# Accepted media types (and common aliases) by format
+_ACCEPT_TYPES = {
+    "application/vnd.apache.arrow.stream": FORMAT_ARROW,
+    "application/x-npy": FORMAT_NPY,
+    "application/npy": FORMAT_NPY,
+    "application/msgpack": FORMAT_MSGPACK,
+    "application/x-msgpack": FORMAT_MSGPACK,
+    "application/vnd.msgpack": FORMAT_MSGPACK,
+}
+
+class NotAcceptable(Exception):
+    """Raised when none of the formats in an Accept header can be produced."""
+
+def available_formats():
+    """Formats this process can produce (optional dependencies installed)."""
+    formats = [FORMAT_JSON, FORMAT_JSON_ARRAY, FORMAT_NPY]
+    if pa is not None:
+        formats.append(FORMAT_ARROW)
+    if msgpack is not None:
+        formats.append(FORMAT_MSGPACK)
+    return formats
+
+def parse_accept(header: str):
+    """
+    Split an Accept (or Accept-Encoding) header into its entries.
+
+    Yields:
+        (lower-cased media type or coding, parameters dict, quality) per entry;
+        entries with an unparseable quality are skipped
+    """
+    for media_range in header.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        options = dict(
+            (key.strip().lower(), value.strip().strip('"'))
+            for key, _, value in (param.partition("=") for param in params)
+        )
+        try:
+            quality = float(options.get("q", 1))
+        except ValueError:
+            continue
+        yield media_type.lower(), options, quality
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Pick the response format for an Accept header.
+
+    The acceptable format with the highest quality wins; ties go to the one
+    listed first. A missing or empty header, */* and application/* mean JSON.
+
+    Raises:
+        NotAcceptable: If the header lists no format that can be produced
+    """
+    if not accept or not accept.strip():
+        return FORMAT_JSON
+
+    available = available_formats()
+    best = None
+    best_quality = 0.0
+    for media_type, options, quality in parse_accept(accept):
+        if media_type in ("*/*", "application/*"):
+            fmt = FORMAT_JSON
+        elif media_type == "application/json":
+            fmt = FORMAT_JSON_ARRAY if options.get("layout") == "array" else FORMAT_JSON
+        else:
+            fmt = _ACCEPT_TYPES.get(media_type)
+
+        if fmt in available and quality > best_quality:
+            best, best_quality = fmt, quality
+
+    if best is None:
+        raise NotAcceptable(
+            "Cannot produce any requested format; available: "
+            + ", ".join(MEDIA_TYPES[fmt] for fmt in available)
+        )
+    return best
+
+def metadata_headers(metadata: Dict) -> Dict[str, str]:
+    """Response metadata as X-Telemetry-* headers for binary formats."""
+    return {
+        "X-Telemetry-" + key.replace("_", "-").title(): str(value)
+        for key, value in metadata.items() if value is not None
+    }
+
+def render_channel(fmt: str, values: np.ndarray, metadata: Dict, index: Optional[np.ndarray] = None) -> bytes:
+    """
+    Serialize channel samples in a non-default format.
+
+    Args:
+        fmt: One of the FORMAT_* constants other than FORMAT_JSON
+        values: 1-D samples, or 2-D (samples x count) for array variables
+        metadata: JSON-serializable fields describing the samples
+        index: Sample index of each value, for samples that are not contiguous
+            (downsampled responses)
+    """
+    values = np.asarray(values)
+    if index is not None:
+        index = np.asarray(index, dtype="<i8")
+
+    if fmt == FORMAT_JSON_ARRAY:
+        body = {**metadata, "values": values.tolist()}
+        if index is not None:
+            body["index"] = index.tolist()
+        return json.dumps(body, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    if fmt == FORMAT_NPY:
+        if index is not None:
+            records = np.empty(len(values), dtype=[("index", "<i8"), ("value", values.dtype, values.shape[1:])])
+            records["index"] = index
+            records["value"] = values
+            values = records
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(values), allow_pickle=False)
+        return buffer.getvalue()
+
+    if fmt == FORMAT_ARROW:
+        if values.ndim > 1:
+            column = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1])
+        else:
+            column = pa.array(values)
+        fields = [pa.field(str(metadata.get("attribute", "values")), column.type)]
+        columns = [column]
+        if index is not None:
+            fields.insert(0, pa.field("index", pa.int64()))
+            columns.insert(0, pa.array(index))
+        schema = pa.schema(fields, metadata={key: json.dumps(value) for key, value in metadata.items()})
+        sink = pa.BufferOutputStream()
+        with pa_ipc.new_stream(sink, schema) as writer:
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+        return sink.getvalue().to_pybytes()
+
+    if fmt == FORMAT_MSGPACK:
+        values = np.ascontiguousarray(values)
+        body = {
+            **metadata,
+            "dtype": values.dtype.str,
+            "shape": list(values.shape),
+            "data": values.tobytes()
+        }
+        if index is not None:
+            body["index"] = index.tobytes()
+        return msgpack.packb(body)
+
+    raise ValueError(f"Unsupported channel format: {fmt}")
+
+def render_stored_channel(fmt: str, value: bytes, metadata: Dict) -> bytes:
+    """Decode a stored channel value and serialize it with render_channel."""
+    return render_channel(fmt, decode_channel(value), metadata)
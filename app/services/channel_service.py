@@ -0,0 +1,238 @@
+"""Reads of stored telemetry channels."""
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select, update, func, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AttributeValue, SessionInfo, ChannelTombstone
+from services.channel_codec import (
+    HEADER_LEN, decode_header, decode_channel, decode_samples, describe_channel, is_legacy_json, sample_range
+)
+from services.compute_pool import ComputePool
+from services.channel_cache import ChannelCache
+from services.shared_channel_cache import SharedChannelCache
+from services.tombstones import decode_masked
+
+# Columns returned by list_channels; value is never among them
+METADATA_COLUMNS = [
+    AttributeValue.attribute,
+    AttributeValue.value_len,
+    AttributeValue.dtype,
+    AttributeValue.values_per_sample,
+    AttributeValue.units,
+    AttributeValue.value_min,
+    AttributeValue.value_max,
+    AttributeValue.value_preview,
+]
+
+class ChannelService:
+    """Service for reading stored channels, whole or by sample range."""
+
+    @staticmethod
+    async def data_version(session_id: str, db: AsyncSession) -> Optional[int]:
+        """The session's data_version, or None if there is no such session."""
+        return (await db.execute(
+            select(SessionInfo.data_version).where(SessionInfo.session_id == session_id)
+        )).scalar()
+
+    @staticmethod
+    async def bump_data_version(session_id: str, db: AsyncSession):
+        """
+        Mark a session's stored samples as changed, so no process serves its
+        cached channels any more. The caller commits, then calls
+        invalidate_cache.
+        """
+        await db.execute(
+            update(SessionInfo)
+            .where(SessionInfo.session_id == session_id)
+            .values(data_version=SessionInfo.data_version + 1)
+        )
+
+    @staticmethod
+    async def tombstones(session_id: str, attribute: str, db: AsyncSession) -> List[Tuple[int, int]]:
+        """A channel's tombstones (see services.tombstones), sorted by start."""
+        return [
+            tuple(row) for row in (await db.execute(
+                select(ChannelTombstone.start_index, ChannelTombstone.end_index).where(
+                    ChannelTombstone.session_id == session_id,
+                    ChannelTombstone.attribute == attribute
+                ).order_by(ChannelTombstone.start_index)
+            )).all()
+        ]
+    
+    @staticmethod
+    def cache():
+        """
+        The decoded channel cache in use: the host-wide SharedChannelCache when
+        it is enabled (shared_cache_bytes > 0), else the per-process ChannelCache.
+        """
+        return SharedChannelCache if SharedChannelCache.enabled() else ChannelCache
+
+    @staticmethod
+    def invalidate_cache(session_id: str):
+        """Drop a session's cached channels after its samples changed or it was deleted."""
+        ChannelCache.invalidate(session_id)
+        if SharedChannelCache.enabled():
+            SharedChannelCache.invalidate(session_id)
+
+    @staticmethod
+    async def read_channel(session_id: str, attribute: str, db: AsyncSession,
+                           data_version: Optional[int] = None) -> Optional[np.ndarray]:
+        """
+        Read a whole decoded channel through the channel cache.
+        
+        Tombstoned samples are removed before caching. The value and the
+        tombstones are read in one transaction, so they come from the same
+        snapshot even while the channel is being compacted.
+
+        Args:
+            data_version: The session's data_version, if the caller already has it
+
+        Returns:
+            The read-only samples, or None if the session or attribute is not stored
+
+        Raises:
+            ValueError: If the stored value cannot be decoded
+        """
+        if data_version is None:
+            data_version = await ChannelService.data_version(session_id, db)
+            if data_version is None:
+                return None
+
+        cache = ChannelService.cache()
+        values = cache.get(session_id, attribute, data_version)
+        if values is not None:
+            return values
+
+        row = (await db.execute(
+            select(AttributeValue.value).where(
+                AttributeValue.session_id == session_id,
+                AttributeValue.attribute == attribute
+            )
+        )).first()
+        if row is None:
+            return None
+        tombstones = await ChannelService.tombstones(session_id, attribute, db)
+        values = await ComputePool.run(decode_masked, row[0], tombstones)
+        return cache.put(session_id, attribute, data_version, values)
+
+    @staticmethod
+    async def list_channels(session_id: str, db: AsyncSession) -> List[Dict]:
+        """
+        List a session's stored channels from their metadata columns.
+
+        Only the metadata written at ingest is read, never the samples, so the
+        cost does not depend on the session length. Channels stored before the
+        metadata existed are described from their values once and backfilled.
+
+        Returns:
+            One dict per channel, ordered by attribute name
+        """
+        rows = [
+            dict(row) for row in (await db.execute(
+                select(*METADATA_COLUMNS)
+                .where(AttributeValue.session_id == session_id)
+                .order_by(AttributeValue.attribute)
+            )).mappings().all()
+        ]
+
+        missing = [row for row in rows if row["dtype"] is None]
+        if missing:
+            await ChannelService._backfill_metadata(session_id, missing, db)
+        return rows
+
+    @staticmethod
+    async def _backfill_metadata(session_id: str, rows: List[Dict], db: AsyncSession):
+        """Describe channels that have no stored metadata, updating rows in place and in the database."""
+        for row in rows:
+            value = (await db.execute(
+                select(AttributeValue.value).where(
+                    AttributeValue.session_id == session_id,
+                    AttributeValue.attribute == row["attribute"]
+                )
+            )).scalar()
+            metadata = await ComputePool.run(_describe_stored_channel, value)
+            await db.execute(
+                update(AttributeValue)
+                .where(AttributeValue.session_id == session_id, AttributeValue.attribute == row["attribute"])
+                .values(**metadata)
+            )
+            row.update(metadata)
+        await db.commit()
+
+    @staticmethod
+    async def read_range(session_id: str, attribute: str, start: int, end: int, db: AsyncSession,
+                         populate: bool = False) -> Optional[Tuple[np.ndarray, int]]:
+        """
+        Read samples [start, end] (inclusive) of a stored channel.
+
+        Cached channels are sliced from the channel cache. Otherwise samples are
+        fixed-width, so only the channel header and the bytes covering the
+        range are fetched (SUBSTR on the stored value); nothing outside the
+        range is transferred or decoded. Values still stored as legacy JSON
+        are read and decoded whole, and channels with tombstones are read
+        whole through the cache until they are compacted.
+
+        Args:
+            populate: On a cache miss, read and cache the whole channel instead
+                (for ranges of channels that are likely to be read again, like laps)
+
+        Returns:
+            The samples in range (clamped to the channel) and the channel's
+            total sample count, or None if the attribute is not stored
+        """
+        data_version = await ChannelService.data_version(session_id, db)
+        if data_version is None:
+            return None
+        if populate:
+            values = await ChannelService.read_channel(session_id, attribute, db, data_version)
+        else:
+            values = ChannelService.cache().get(session_id, attribute, data_version)
+        if values is not None:
+            return values[max(start, 0):end + 1], len(values)
+
+        head = (await db.execute(
+            select(
+                func.substr(AttributeValue.value, 1, HEADER_LEN),
+                AttributeValue.value_len,
+                exists().where(
+                    ChannelTombstone.session_id == session_id,
+                    ChannelTombstone.attribute == attribute
+                )
+            ).where(
+                AttributeValue.session_id == session_id,
+                AttributeValue.attribute == attribute
+            )
+        )).first()
+        if head is None:
+            return None
+        
+        if head[2]:
+            values = await ChannelService.read_channel(session_id, attribute, db, data_version)
+            return values[max(start, 0):end + 1], len(values)
+
+        if head[0] is None or is_legacy_json(head[0]):
+            value = (await db.execute(
+                select(AttributeValue.value).where(
+                    AttributeValue.session_id == session_id,
+                    AttributeValue.attribute == attribute
+                )
+            )).scalar()
+            return decode_channel(value)[max(start, 0):end + 1], head[1]
+
+        header = decode_header(head[0])
+        offset, length = sample_range(header, start, end)
+        if length == 0:
+            return decode_samples(header, b""), head[1]
+
+        # SUBSTR positions are 1-based
+        data = (await db.execute(
+            select(func.substr(AttributeValue.value, offset + 1, length)).where(
+                AttributeValue.session_id == session_id,
+                AttributeValue.attribute == attribute
+            )
+        )).scalar()
+        return decode_samples(header, data), head[1]
+
+def _describe_stored_channel(value) -> Dict:
+    """describe_channel for a stored channel value."""
+    return describe_channel(decode_channel(value))
@@ -0,0 +1,297 @@
+"""Lap deletion through tombstones, and background compaction of the deleted samples.
+
+Deleting a lap used to decode, cut, re-encode and write back every channel of
+the session within the request, holding row locks on all of them. Now the
+request only records tombstones (see services.tombstones) and shortens each
+channel's value_len; readers apply them at once. The compactor later
+rewrites every channel with tombstones, one channel per transaction, and
+rebuilds the session's laps from its compacted Lap channel.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import engine, AsyncSessionLocal
+from models import SessionInfo, Driver, AttributeValue, Lap, LapChannelStats, ChannelTombstone
+from services.channel_codec import encode_channel, describe_channel
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+from services.lap_service import LapService
+from services.tombstones import physical_ranges, decode_masked
+
+logger = logging.getLogger(__name__)
+
+# Channels laps are rebuilt from after compaction (see LapService.compute_laps)
+LAP_CHANNELS = ['Lap', 'SessionTime', 'PlayerIncidents', 'LapCurrentLapTime']
+
+_compactor: Optional[asyncio.Task] = None
+
+class CompactionService:
+    """Service for masking deleted samples and compacting them out of stored channels."""
+
+    @staticmethod
+    async def delete_samples(session_id: str, attributes: List[str], start: int, end: int,
+                             lap_number: Optional[int], db: AsyncSession) -> int:
+        """
+        Delete samples [start, end] (as readers see them) from several channels
+        by recording tombstones; no channel value is read or written.
+
+        The channels' rows are locked first, as the compactor does, so
+        tombstone positions are never computed against a value that is being
+        rewritten. Attributes that are not stored are skipped. The caller
+        commits, bumps the data_version and invalidates the channel cache.
+
+        Returns:
+            The number of samples deleted across all channels
+        """
+        rows = (await db.execute(
+            select(AttributeValue.attribute, AttributeValue.value_len).where(
+                AttributeValue.session_id == session_id,
+                AttributeValue.attribute.in_(attributes)
+            ).with_for_update()
+        )).all()
+        existing = {}
+        for attribute, tomb_start, tomb_end in (await db.execute(
+            select(ChannelTombstone.attribute, ChannelTombstone.start_index, ChannelTombstone.end_index).where(
+                ChannelTombstone.session_id == session_id,
+                ChannelTombstone.attribute.in_(attributes)
+            ).order_by(ChannelTombstone.start_index).with_for_update()
+        )).all():
+            existing.setdefault(attribute, []).append((tomb_start, tomb_end))
+
+        created_at = datetime.utcnow()
+        deleted = 0
+        for attribute, value_len in rows:
+            ranges = physical_ranges(existing.get(attribute, []), max(start, 0), min(end, value_len - 1))
+            count = sum(range_end - range_start + 1 for range_start, range_end in ranges)
+            if not count:
+                continue
+            db.add_all([
+                ChannelTombstone(
+                    session_id=session_id,
+                    attribute=attribute,
+                    start_index=range_start,
+                    end_index=range_end,
+                    lap_number=lap_number,
+                    created_at=created_at
+                )
+                for range_start, range_end in ranges
+            ])
+            await db.execute(
+                update(AttributeValue)
+                .where(AttributeValue.session_id == session_id, AttributeValue.attribute == attribute)
+                .values(value_len=value_len - count)
+            )
+            deleted += count
+        return deleted
+
+    @staticmethod
+    async def compact_pending(db: AsyncSession) -> List[str]:
+        """
+        Compact the sessions with the oldest tombstones, at most
+        settings.compaction_batch_sessions of them, in the compute workers.
+
+        Returns:
+            The sessions compacted
+        """
+        session_ids = [row[0] for row in (await db.execute(
+            select(ChannelTombstone.session_id)
+            .group_by(ChannelTombstone.session_id)
+            .order_by(func.min(ChannelTombstone.created_at))
+            .limit(settings.compaction_batch_sessions)
+        )).all()]
+        # Do not hold the connection while compacting
+        await db.close()
+
+        results = await asyncio.gather(*(
+            ComputePool.run(CompactionService.compact_session, session_id) for session_id in session_ids
+        ), return_exceptions=True)
+        compacted = []
+        for session_id, result in zip(session_ids, results):
+            if isinstance(result, Exception):
+                logger.error("Could not compact session %s: %s", session_id, result)
+                continue
+            ChannelService.invalidate_cache(session_id)
+            compacted.append(session_id)
+        return compacted
+
+    @staticmethod
+    def compact_session(session_id: str) -> List[str]:
+        """
+        Rewrite every channel of a session that has tombstones, then rebuild its laps.
+
+        Runs in a compute worker with its own connection. Each channel is
+        rewritten in a transaction of its own that locks only its row, so
+        neither the lock time nor the memory used grows with the session.
+        What readers see does not change, except the refreshed channel
+        metadata (min/max/preview) and laps that had drifted from the Lap
+        channel; the data_version is bumped for those.
+
+        Returns:
+            The channels compacted
+        """
+        # Imported here so the API process does not load the ingest code until it is needed
+        from iRacingTelemetry.add_telemetry import insert_attribute_data
+
+        with engine.connect() as conn:
+            attributes = [row[0] for row in conn.execute(
+                select(ChannelTombstone.attribute).where(ChannelTombstone.session_id == session_id).distinct()
+            ).all()]
+
+        compacted = []
+        for attribute in attributes:
+            with engine.begin() as conn:
+                locked = conn.execute(
+                    select(AttributeValue.units).where(
+                        AttributeValue.session_id == session_id,
+                        AttributeValue.attribute == attribute
+                    ).with_for_update()
+                ).first()
+                tombstones = [tuple(row) for row in conn.execute(
+                    select(ChannelTombstone.start_index, ChannelTombstone.end_index).where(
+                        ChannelTombstone.session_id == session_id,
+                        ChannelTombstone.attribute == attribute
+                    ).order_by(ChannelTombstone.start_index).with_for_update()
+                ).all()]
+                if locked is not None and tombstones:
+                    value = conn.execute(select(AttributeValue.value).where(
+                        AttributeValue.session_id == session_id,
+                        AttributeValue.attribute == attribute
+                    )).scalar()
+                    values = decode_masked(value, tombstones)
+                    insert_attribute_data(conn, [{
+                        "session_id": session_id,
+                        "attribute": attribute,
+                        "value": encode_channel(values),
+                        "value_len": len(values),
+                        **describe_channel(values, locked.units)
+                    }])
+                    compacted.append(attribute)
+                conn.execute(delete(ChannelTombstone).where(
+                    ChannelTombstone.session_id == session_id,
+                    ChannelTombstone.attribute == attribute
+                ))
+
+        with engine.begin() as conn:
+            if 'Lap' in compacted:
+                _rebuild_laps(conn, session_id)
+            if compacted:
+                conn.execute(
+                    update(SessionInfo)
+                    .where(SessionInfo.session_id == session_id)
+                    .values(data_version=SessionInfo.data_version + 1)
+                )
+        return compacted
+
+    @staticmethod
+    async def run_compactor():
+        """Compact pending sessions every settings.compaction_interval_seconds until cancelled."""
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    compacted = await CompactionService.compact_pending(db)
+                if compacted:
+                    logger.info("Compacted deleted laps of %d sessions", len(compacted))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Compaction failed: %s", e)
+            await asyncio.sleep(settings.compaction_interval_seconds)
+
+    @staticmethod
+    def start_compactor():
+        """Start compacting in the background, if enabled."""
+        global _compactor
+        if _compactor is None and settings.compaction_interval_seconds > 0:
+            _compactor = asyncio.get_running_loop().create_task(CompactionService.run_compactor())
+
+    @staticmethod
+    def stop_compactor():
+        """Stop the background compaction."""
+        global _compactor
+        if _compactor is not None:
+            _compactor.cancel()
+            _compactor = None
+
+def _rebuild_laps(conn, session_id: str) -> bool:
+    """
+    Recompute a session's laps from its Lap channel and replace the stored
+    ones if they differ, dropping the session's lap stats (recomputed on
+    next read). Locks the Lap channel against concurrent lap deletes.
+
+    The compacted channels no longer hold the samples of deleted laps, so
+    the lap before one would be timed up to the lap after it. Laps whose
+    sample count is unchanged keep their stored lap_time, incidents, valid
+    and complete; any other lap followed by a gap in lap numbers is not
+    complete.
+
+    Returns:
+        Whether the laps changed
+    """
+    conn.execute(
+        select(AttributeValue.value_len).where(
+            AttributeValue.session_id == session_id,
+            AttributeValue.attribute == 'Lap'
+        ).with_for_update()
+    )
+    channels = {}
+    for name in LAP_CHANNELS:
+        value = conn.execute(select(AttributeValue.value).where(
+            AttributeValue.session_id == session_id,
+            AttributeValue.attribute == name
+        )).scalar()
+        if value is None:
+            channels[name] = None
+            continue
+        tombstones = [tuple(row) for row in conn.execute(
+            select(ChannelTombstone.start_index, ChannelTombstone.end_index).where(
+                ChannelTombstone.session_id == session_id,
+                ChannelTombstone.attribute == name
+            ).order_by(ChannelTombstone.start_index)
+        ).all()]
+        channels[name] = decode_masked(value, tombstones)
+    if channels['Lap'] is None:
+        return False
+
+    laps = LapService.compute_laps(
+        channels['Lap'], channels['SessionTime'], channels['PlayerIncidents'], channels['LapCurrentLapTime']
+    )
+    stored = conn.execute(
+        select(
+            Lap.lap_number, Lap.start_index, Lap.end_index, Lap.sample_count,
+            Lap.lap_time, Lap.incidents, Lap.valid, Lap.complete
+        ).where(Lap.session_id == session_id).order_by(Lap.start_index)
+    ).mappings().all()
+    if [(row['lap_number'], row['start_index'], row['end_index']) for row in stored] == [
+        (lap['lap_number'], lap['start_index'], lap['end_index']) for lap in laps
+    ]:
+        return False
+
+    stored_laps = {row['lap_number']: row for row in stored}
+    for position, lap in enumerate(laps):
+        kept = stored_laps.get(lap['lap_number'])
+        if kept is not None and kept['sample_count'] == lap['sample_count']:
+            lap.update({field: kept[field] for field in ('lap_time', 'incidents', 'valid', 'complete')})
+        elif position < len(laps) - 1 and laps[position + 1]['lap_number'] != lap['lap_number'] + 1:
+            lap['complete'] = False
+
+    session_info = conn.execute(
+        select(
+            SessionInfo.track_id, SessionInfo.track_config, SessionInfo.session_date,
+            SessionInfo.player_driver_user_id
+        ).where(SessionInfo.session_id == session_id)
+    ).mappings().first()
+    drivers = conn.execute(
+        select(Driver.driver_user_id, Driver.car_name).where(Driver.session_id == session_id)
+    ).mappings().all()
+    fields = LapService.leaderboard_fields(session_info, drivers)
+    conn.execute(delete(Lap).where(Lap.session_id == session_id))
+    conn.execute(delete(LapChannelStats).where(LapChannelStats.session_id == session_id))
+    if laps:
+        conn.execute(Lap.__table__.insert().values([
+            {"session_id": session_id, **lap, **fields} for lap in laps
+        ]))
+    return True
@@ -0,0 +1,189 @@
+"""Distance-aligned comparison of laps."""
+from typing import List, Dict, Optional
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+from services.ibt_store import IbtStore
+
+# Track position channel (0.0 at the start/finish line to 1.0) the laps are aligned on
+GRID_CHANNEL = "LapDistPct"
+# Timing channel the time-delta trace is derived from
+TIME_CHANNEL = "SessionTime"
+# Laps one comparison may include
+MAX_COMPARE_LAPS = 20
+
+class ComparisonService:
+    """Service for resampling laps onto a common track-position grid."""
+
+    @staticmethod
+    def grid(points: int) -> np.ndarray:
+        """The common LapDistPct grid: points evenly spaced positions from 0.0 to 1.0."""
+        return np.linspace(0.0, 1.0, points)
+
+    @staticmethod
+    def resample_lap(lap_dist, channels: Dict[str, np.ndarray], points: int) -> Dict[str, np.ndarray]:
+        """
+        Resample one lap's channels onto the common LapDistPct grid.
+
+        The lap's LapDistPct is turned into a non-decreasing track position
+        first: samples before the start/finish crossing at the beginning of
+        the lap (still near 1.0) and after the one at its end (back near 0.0)
+        are dropped, and jitter while stationary is flattened with a running
+        maximum. Channels are then linearly interpolated at the grid positions
+        with np.interp, 2-D channels column by column. Grid positions more
+        than one grid step outside the part of the track the lap covered (an
+        unfinished lap) are NaN.
+
+        Args:
+            lap_dist: LapDistPct samples of the lap
+            channels: Samples of the same lap range per channel name
+            points: Grid size
+
+        Returns:
+            Resampled channels (float64, points rows)
+
+        Raises:
+            ValueError: If a channel is not numeric
+        """
+        dist = np.asarray(lap_dist, dtype=np.float64)
+        grid = ComparisonService.grid(points)
+
+        # A drop of more than half a lap between samples is a start/finish crossing
+        crossings = np.flatnonzero(np.diff(dist) < -0.5) + 1
+        start = next((int(i) for i in crossings if i < dist.size / 2), 0)
+        stop = next((int(i) for i in crossings if i >= dist.size / 2), dist.size)
+        position = np.maximum.accumulate(dist[start:stop]) if stop > start else np.empty(0)
+
+        resampled = {}
+        for name, values in channels.items():
+            values = np.asarray(values)
+            if values.dtype.kind not in 'biuf':
+                raise ValueError(f"Attribute '{name}' is not numeric")
+            values = values[start:stop].astype(np.float64)
+            if position.size == 0 or values.shape[0] < position.size:
+                resampled[name] = np.full((points,) + values.shape[1:], np.nan)
+                continue
+            if values.ndim == 1:
+                resampled[name] = np.interp(grid, position, values)
+            else:
+                flat = values.reshape(values.shape[0], -1)
+                resampled[name] = np.column_stack([
+                    np.interp(grid, position, flat[:, column]) for column in range(flat.shape[1])
+                ]).reshape((points,) + values.shape[1:])
+
+        if position.size:
+            step = 1.0 / (points - 1)
+            uncovered = (grid < position[0] - step) | (grid > position[-1] + step)
+            for values in resampled.values():
+                values[uncovered] = np.nan
+        return resampled
+
+    @staticmethod
+    async def compare(laps: List[Dict], attributes: List[str], points: int, db: AsyncSession) -> List[Dict]:
+        """
+        Align laps on the LapDistPct grid and compute their time deltas.
+
+        The first lap is the reference. Every lap's SessionTime is resampled
+        like any channel as time elapsed since the lap's first sample, so
+        laps that did not cover the whole grid are timed from their start
+        too; its time delta is the difference to the reference's elapsed
+        time at each grid position (positive: behind).
+
+        Args:
+            laps: Laps to compare, each with session_id, data_version,
+                content_hash and the lap's lap_number, start_index, end_index
+                and lap_time
+            attributes: Channels to resample
+            points: Grid size
+
+        Returns:
+            One dict per lap with its identity, lap_time, `time` and
+            `time_delta` traces (None if SessionTime is not stored) and the
+            resampled `channels` (None for channels that are not stored)
+
+        Raises:
+            ValueError: If a lap has no LapDistPct channel (neither stored nor
+                extractable from the session's retained .ibt file) or a
+                channel is not numeric
+        """
+        compared = []
+        for lap in laps:
+            grids = await ComparisonService._lap_grids(lap, attributes, points, db)
+            compared.append({
+                "session_id": lap['session_id'],
+                "lap_number": lap['lap_number'],
+                "lap_time": lap['lap_time'],
+                "time": grids.get(TIME_CHANNEL),
+                "channels": {attr: grids.get(attr) for attr in attributes}
+            })
+
+        reference = compared[0]["time"]
+        for lap in compared:
+            lap["time_delta"] = (
+                lap["time"] - reference if lap["time"] is not None and reference is not None else None
+            )
+        return compared
+
+    @staticmethod
+    async def _lap_grids(lap: Dict, attributes: List[str], points: int, db: AsyncSession) -> Dict[str, np.ndarray]:
+        """
+        Resampled channels of one lap, through the channel cache.
+
+        Grids are cached per (session, lap, points) and channel next to the
+        decoded channels, keyed by the session's data_version like them, so
+        lap deletes retire them too. Only missing channels are read (just
+        the lap's samples) and resampled. Channels that are not stored are
+        left out, except LapDistPct, which is extracted from the session's
+        retained .ibt file if need be. SessionTime is kept as elapsed time.
+        """
+        session_id = lap['session_id']
+        data_version = lap['data_version']
+        cache = ChannelService.cache()
+        names = list(dict.fromkeys([TIME_CHANNEL] + list(attributes)))
+
+        grids = {}
+        for name in names:
+            values = cache.get(session_id, _grid_key(lap['lap_number'], points, name), data_version)
+            if values is not None:
+                grids[name] = values
+        missing = [name for name in names if name not in grids]
+        if not missing:
+            return grids
+
+        lap_dist = await _read_lap(session_id, GRID_CHANNEL, lap, db)
+        if lap_dist is None:
+            # Not stored: extract it from the retained .ibt file (raises once laps were deleted)
+            materialized = await run_in_threadpool(
+                IbtStore.materialize_channel, session_id, lap.get('content_hash'), GRID_CHANNEL
+            )
+            if materialized is None:
+                raise ValueError(
+                    f"No {GRID_CHANNEL} data found for session {session_id}, and its .ibt file is not retained"
+                )
+            lap_dist = materialized["value"][lap['start_index']:lap['end_index'] + 1]
+        channels = {}
+        for name in missing:
+            values = await _read_lap(session_id, name, lap, db)
+            if values is not None:
+                channels[name] = values
+
+        # Interpolating every channel is CPU-bound; run it in a compute worker
+        resampled = await ComputePool.run(ComparisonService.resample_lap, lap_dist, channels, points)
+        if TIME_CHANNEL in resampled and len(channels[TIME_CHANNEL]):
+            resampled[TIME_CHANNEL] -= float(channels[TIME_CHANNEL][0])
+        for name, values in resampled.items():
+            grids[name] = cache.put(session_id, _grid_key(lap['lap_number'], points, name), data_version, values)
+        return grids
+
+def _grid_key(lap_number: int, points: int, name: str) -> str:
+    """Channel cache attribute under which a lap's resampled channel (SessionTime: elapsed time) is kept."""
+    if name == TIME_CHANNEL:
+        name = f"{name}.elapsed"
+    return f"{name}#lap{lap_number}@{points}"
+
+async def _read_lap(session_id: str, attribute: str, lap: Dict, db: AsyncSession) -> Optional[np.ndarray]:
+    """A channel's samples within the lap, or None if it is not stored."""
+    stored = await ChannelService.read_range(session_id, attribute, lap['start_index'], lap['end_index'], db)
+    return stored[0] if stored is not None else None
@@ -0,0 +1,46 @@
+"""Worker processes for CPU-bound request work."""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+from fastapi.concurrency import run_in_threadpool
+from config import settings
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+class ComputePool:
+    """
+    Service for running CPU-bound request work (channel decoding, slicing,
+    per-lap statistics and JSON rendering of large payloads) in worker
+    processes, so it neither blocks the event loop nor holds its GIL.
+    """
+
+    @staticmethod
+    def start_pool():
+        """Start the compute worker pool."""
+        global _executor
+        if _executor is None and settings.compute_workers > 0:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.compute_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+    @staticmethod
+    def shutdown_pool():
+        """Stop the compute worker pool."""
+        global _executor
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+    @staticmethod
+    async def run(fn: Callable, *args):
+        """
+        Run fn(*args) in a compute worker and return its result.
+
+        fn must be a module-level function and its arguments picklable. Without
+        a running pool (scripts, compute_workers=0) it runs in the threadpool.
+        """
+        if _executor is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
@@ -0,0 +1,110 @@
+"""Shape-preserving decimation of channel samples for chart-sized responses.
+
+    lttb     Largest-Triangle-Three-Buckets: one sample per bucket, the one
+             spanning the largest triangle with its neighbouring buckets;
+             keeps the visual shape of a line
+    minmax   min/max envelope: the lowest and highest sample of every
+             bucket; keeps every peak and dip
+
+Both are computed in one vectorized pass over the channel and return sample
+indices, so responses can keep the original x positions.
+"""
+from typing import Tuple
+import numpy as np
+
+MODE_LTTB = "lttb"
+MODE_MINMAX = "minmax"
+DOWNSAMPLING_MODES = (MODE_LTTB, MODE_MINMAX)
+
+def downsample(values, max_points: int, mode: str = MODE_LTTB) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pick at most max_points samples of a channel.
+
+    Array channels (2-D) are decimated on the mean of each sample's values
+    and keep whole rows. Channels that already fit are returned unchanged.
+
+    Args:
+        values: Decoded samples
+        max_points: Maximum number of samples to return (at least 3)
+        mode: MODE_LTTB or MODE_MINMAX
+
+    Returns:
+        The picked sample indices (ascending) and the samples at them
+
+    Raises:
+        ValueError: If the mode is unknown or the channel is not numeric
+    """
+    values = np.asarray(values)
+    if mode not in DOWNSAMPLING_MODES:
+        raise ValueError(f"Unknown downsampling mode '{mode}'; available: {', '.join(DOWNSAMPLING_MODES)}")
+    if values.shape[0] <= max_points:
+        return np.arange(values.shape[0]), values
+    if values.dtype.kind not in 'biuf':
+        raise ValueError("Only numeric channels can be downsampled")
+
+    y = values.astype(np.float64)
+    if y.ndim > 1:
+        y = y.reshape(y.shape[0], -1).mean(axis=1)
+    index = lttb_indices(y, max_points) if mode == MODE_LTTB else min_max_indices(y, max_points)
+    return index, values[index]
+
+def lttb_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets over samples y (x is the sample index).
+
+    The first and last samples are always kept and the rest is split into
+    max_points - 2 buckets. Classic LTTB anchors each bucket's triangle on
+    the sample picked in the previous bucket, which makes it sequential;
+    here it is anchored on the previous bucket's average, like the next
+    bucket, so all buckets are scored at once. Non-finite samples are only
+    picked from buckets without finite ones.
+    """
+    n = y.size
+    bucket_count = max_points - 2
+    edges = np.linspace(1, n - 1, bucket_count + 1).astype(np.intp)
+    starts, stops = edges[:-1], edges[1:]
+
+    # Bucket averages, with the fixed first and last samples as outer neighbours
+    # (the last sample is left out of the sums so the last bucket ends before it)
+    finite = np.isfinite(y)
+    y_finite = np.where(finite, y, 0.0)
+    counts = np.maximum(np.add.reduceat(finite[:-1].astype(np.int64), starts), 1)
+    avg_x = (starts + stops - 1) / 2.0
+    avg_y = np.add.reduceat(y_finite[:-1], starts) / counts
+    anchor_x = np.concatenate(([0.0], avg_x, [n - 1.0]))
+    anchor_y = np.concatenate(([y_finite[0]], avg_y, [y_finite[-1]]))
+    a_x, a_y = anchor_x[:-2, None], anchor_y[:-2, None]
+    c_x, c_y = anchor_x[2:, None], anchor_y[2:, None]
+
+    # Score every sample of every bucket in a (buckets x longest bucket) matrix
+    width = int((stops - starts).max())
+    candidates = starts[:, None] + np.arange(width)
+    in_bucket = candidates < stops[:, None]
+    candidates = np.minimum(candidates, n - 1)
+    areas = np.abs((a_x - c_x) * (y_finite[candidates] - a_y) - (a_x - candidates) * (c_y - a_y))
+    areas[~in_bucket | ~finite[candidates]] = -1.0
+    picked = candidates[np.arange(bucket_count), areas.argmax(axis=1)]
+
+    return np.concatenate(([0], picked, [n - 1]))
+
+def min_max_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Min/max envelope over samples y: the lowest and highest finite sample of
+    each of max_points // 2 buckets, in sample order.
+    """
+    n = y.size
+    bucket_count = max(max_points // 2, 1)
+    edges = np.linspace(0, n, bucket_count + 1).astype(np.intp)
+    starts, stops = edges[:-1], edges[1:]
+
+    width = int((stops - starts).max())
+    candidates = starts[:, None] + np.arange(width)
+    in_bucket = candidates < stops[:, None]
+    candidates = np.minimum(candidates, n - 1)
+    samples = y[candidates]
+    usable = in_bucket & np.isfinite(samples)
+    rows = np.arange(bucket_count)
+    lows = candidates[rows, np.where(usable, samples, np.inf).argmin(axis=1)]
+    highs = candidates[rows, np.where(usable, samples, -np.inf).argmax(axis=1)]
+
+    return np.unique(np.concatenate((lows, highs)))
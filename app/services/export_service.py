@@ -0,0 +1,375 @@
+"""Streamed downloads of stored telemetry channels.
+
+Whole-channel and multi-channel downloads are generated chunk by chunk: the
+samples are read from attribute_values settings.export_chunk_samples at a
+time (SUBSTR on the stored value), rendered in the compute pool and
+compressed as they are sent. Server memory per download is bounded by the
+chunk size, however long the session is. Channels still stored as legacy
+JSON are the exception: they can only be decoded whole.
+
+Every chunk read checks that the session's data_version is still the one
+the download started with; a lap delete or compaction in between would
+shift the byte offsets, so the download is aborted instead (ChannelChanged).
+
+Responses are compressed with the best coding in the Accept-Encoding header:
+
+    zstd       (requires zstandard)
+    gzip
+    identity   (default)
+"""
+import io
+import json
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, func, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from models import SessionInfo, AttributeValue, ChannelTombstone
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+from services.tombstones import decode_masked
+from services.channel_codec import (
+    HEADER_LEN, ChannelHeader, decode_header, decode_samples, infer_var_type,
+    is_legacy_json, sample_range
+)
+from services.channel_formats import FORMAT_JSON, FORMAT_JSON_ARRAY, FORMAT_NPY, NotAcceptable, parse_accept
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd responses are not offered
+    zstandard = None
+
+ENCODING_ZSTD = "zstd"
+ENCODING_GZIP = "gzip"
+ENCODING_IDENTITY = "identity"
+
+# Channel formats that are streamed; the others are rendered whole
+STREAMED_FORMATS = (FORMAT_JSON, FORMAT_JSON_ARRAY, FORMAT_NPY)
+
+EXPORT_JSON = "json"
+EXPORT_CSV = "csv"
+
+EXPORT_MEDIA_TYPES = {
+    EXPORT_JSON: "application/json",
+    EXPORT_CSV: "text/csv; charset=utf-8",
+}
+
+_JSON_SEPARATORS = (",", ":")
+
+def available_encodings() -> List[str]:
+    """Content codings this process can produce, most preferred first."""
+    encodings = [ENCODING_GZIP]
+    if zstandard is not None:
+        encodings.insert(0, ENCODING_ZSTD)
+    return encodings
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    """
+    Pick the content coding for an Accept-Encoding header.
+
+    The acceptable coding with the highest quality wins; ties go to zstd,
+    then gzip. Without an acceptable coding the response is sent as is.
+    """
+    if not accept_encoding or not accept_encoding.strip():
+        return ENCODING_IDENTITY
+
+    qualities = {}
+    for coding, _, quality in parse_accept(accept_encoding):
+        qualities[coding] = quality
+
+    best = ENCODING_IDENTITY
+    best_quality = 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def negotiate_export(accept: Optional[str]) -> str:
+    """
+    Pick the multi-channel export format for an Accept header.
+
+    A missing or empty header, */* and application/* mean JSON.
+
+    Raises:
+        NotAcceptable: If the header lists neither JSON nor CSV
+    """
+    if not accept or not accept.strip():
+        return EXPORT_JSON
+
+    best = None
+    best_quality = 0.0
+    for media_type, _, quality in parse_accept(accept):
+        if media_type in ("*/*", "application/*", "application/json"):
+            fmt = EXPORT_JSON
+        elif media_type in ("text/*", "text/csv"):
+            fmt = EXPORT_CSV
+        else:
+            continue
+        if quality > best_quality:
+            best, best_quality = fmt, quality
+
+    if best is None:
+        raise NotAcceptable(
+            "Cannot produce any requested format; available: " + ", ".join(EXPORT_MEDIA_TYPES.values())
+        )
+    return best
+
+class ChannelChanged(Exception):
+    """Raised when a session's channels change while one of them is being read in chunks."""
+
+class StoredChannel:
+    """A stored channel read in sample chunks."""
+
+    def __init__(self, session_id: str, attribute: str, header: ChannelHeader, value_len: int,
+                 data_version: int, values: Optional[np.ndarray] = None):
+        self.session_id = session_id
+        self.attribute = attribute
+        self.header = header
+        self.value_len = value_len
+        # The session's data_version the header was read at
+        self.data_version = data_version
+        # Decoded samples of channels that cannot be read by byte range
+        self._values = values
+
+    @property
+    def length(self) -> int:
+        return self.header.length
+
+    async def read(self, start: int, count: int, db: AsyncSession) -> bytes:
+        """
+        Packed samples [start, start + count) (clamped to the channel).
+
+        Raises:
+            ChannelChanged: If the session's data_version is no longer the
+                one the header was read at
+        """
+        if self._values is not None:
+            return np.ascontiguousarray(self._values[start:start + count]).tobytes()
+
+        offset, length = sample_range(self.header, start, start + count - 1)
+        if length == 0:
+            return b""
+        # SUBSTR positions are 1-based
+        row = (await db.execute(
+            select(func.substr(AttributeValue.value, offset + 1, length), SessionInfo.data_version)
+            .join(SessionInfo, SessionInfo.session_id == AttributeValue.session_id)
+            .where(
+                AttributeValue.session_id == self.session_id,
+                AttributeValue.attribute == self.attribute
+            )
+        )).first()
+        if row is None or row[1] != self.data_version:
+            raise ChannelChanged(f"Channel {self.attribute} of session {self.session_id} changed while it was read")
+        return bytes(row[0] or b"")
+
+class ExportService:
+    """Service for streaming stored channels as chunked, compressed downloads."""
+
+    @staticmethod
+    async def open_channels(session_id: str, attributes: List[str], db: AsyncSession) -> Dict[str, StoredChannel]:
+        """
+        Read the headers of stored channels.
+
+        Only the headers are fetched; legacy JSON values and channels with
+        tombstones (until they are compacted) are decoded whole. The
+        session's data_version is read first, so the headers are at least as
+        recent as the version the chunk reads are checked against.
+
+        Returns:
+            StoredChannel by attribute name, in the order requested; attributes
+            that are not stored are left out
+        """
+        data_version = await ChannelService.data_version(session_id, db)
+        rows = (await db.execute(
+            select(
+                AttributeValue.attribute,
+                func.substr(AttributeValue.value, 1, HEADER_LEN),
+                AttributeValue.value_len,
+                exists().where(
+                    ChannelTombstone.session_id == AttributeValue.session_id,
+                    ChannelTombstone.attribute == AttributeValue.attribute
+                )
+            ).where(
+                AttributeValue.session_id == session_id,
+                AttributeValue.attribute.in_(attributes)
+            )
+        )).all()
+
+        channels = {}
+        for attribute, head, value_len, masked in rows:
+            if head is not None and not is_legacy_json(head) and not masked:
+                channels[attribute] = StoredChannel(session_id, attribute, decode_header(head), value_len, data_version)
+                continue
+
+            value = (await db.execute(
+                select(AttributeValue.value).where(
+                    AttributeValue.session_id == session_id,
+                    AttributeValue.attribute == attribute
+                )
+            )).scalar()
+            tombstones = await ChannelService.tombstones(session_id, attribute, db) if masked else []
+            values = await ComputePool.run(decode_masked, value, tombstones)
+            header = ChannelHeader(
+                infer_var_type(values), values.shape[1] if values.ndim > 1 else 1, values.shape[0]
+            )
+            channels[attribute] = StoredChannel(session_id, attribute, header, value_len, data_version, values)
+
+        return {attribute: channels[attribute] for attribute in attributes if attribute in channels}
+
+    @staticmethod
+    async def stream_channel(fmt: str, channel: StoredChannel, metadata: Dict) -> AsyncIterator[bytes]:
+        """
+        Stream a whole channel in one of STREAMED_FORMATS.
+
+        FORMAT_JSON produces the same body as the buffered attribute endpoint;
+        FORMAT_JSON_ARRAY the metadata plus `values`; FORMAT_NPY a .npy file.
+        """
+        if fmt == FORMAT_NPY:
+            yield npy_header(channel.header)
+            async for _, data in _iter_chunks(channel):
+                yield data
+            return
+
+        if fmt == FORMAT_JSON:
+            fields = {"session_id": channel.session_id, "attribute": channel.attribute}
+            prefix, suffix = _json_open(fields, "value"), _json_close({"value_len": channel.value_len})
+        elif fmt == FORMAT_JSON_ARRAY:
+            prefix, suffix = _json_open(metadata, "values"), _json_close({})
+        else:
+            raise ValueError(f"Channel format is not streamed: {fmt}")
+
+        yield prefix
+        async for chunk in _iter_json_values(channel):
+            yield chunk
+        yield suffix
+
+    @staticmethod
+    async def stream_export(fmt: str, session_id: str, channels: List[StoredChannel]) -> AsyncIterator[bytes]:
+        """
+        Stream several channels of a session.
+
+        EXPORT_JSON produces {"session_id", "attributes": [{"attribute",
+        "value", "value_len"}, ...]}, one channel after the other; EXPORT_CSV
+        one row per sample index with a column per channel (array variables
+        get a column per element, shorter channels are padded with empty
+        cells).
+        """
+        if fmt == EXPORT_CSV:
+            yield (",".join(["index"] + [
+                name for channel in channels for name in _csv_column_names(channel)
+            ]) + "\n").encode("utf-8")
+            row_count = max((channel.length for channel in channels), default=0)
+            for start in range(0, row_count, settings.export_chunk_samples):
+                count = min(settings.export_chunk_samples, row_count - start)
+                async with AsyncSessionLocal() as db:
+                    columns = [(channel.header, await channel.read(start, count, db)) for channel in channels]
+                yield await ComputePool.run(render_csv_chunk, start, count, columns)
+            return
+
+        yield _json_open({"session_id": session_id}, "attributes")
+        for i, channel in enumerate(channels):
+            fields = {"attribute": channel.attribute}
+            yield (b"," if i else b"") + _json_open(fields, "value")
+            async for chunk in _iter_json_values(channel):
+                yield chunk
+            yield _json_close({"value_len": channel.value_len})
+        yield b"]}"
+
+    @staticmethod
+    async def encode(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+        """Compress a stream of body chunks with a content coding from negotiate_encoding."""
+        if encoding == ENCODING_IDENTITY:
+            async for chunk in chunks:
+                if chunk:
+                    yield chunk
+            return
+
+        if encoding == ENCODING_ZSTD:
+            compressor = zstandard.ZstdCompressor().compressobj()
+        elif encoding == ENCODING_GZIP:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        else:
+            raise ValueError(f"Unsupported content coding: {encoding}")
+
+        async for chunk in chunks:
+            if chunk:
+                # zlib and zstandard release the GIL while compressing
+                compressed = await run_in_threadpool(compressor.compress, chunk)
+                if compressed:
+                    yield compressed
+        yield compressor.flush()
+
+async def _iter_chunks(channel: StoredChannel) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Yield (start, packed samples) for consecutive chunks of a channel.
+
+    Each chunk is read in its own session, so a slow client never holds a
+    pooled connection between chunks.
+    """
+    for start in range(0, channel.length, settings.export_chunk_samples):
+        async with AsyncSessionLocal() as db:
+            data = await channel.read(start, settings.export_chunk_samples, db)
+        yield start, data
+
+async def _iter_json_values(channel: StoredChannel) -> AsyncIterator[bytes]:
+    """Yield the comma-separated JSON samples of a channel, chunk by chunk."""
+    async for start, data in _iter_chunks(channel):
+        rendered = await ComputePool.run(render_json_chunk, channel.header, data)
+        if rendered:
+            yield (b"," if start else b"") + rendered
+
+def _json_open(fields: Dict, key: str) -> bytes:
+    """Opening of a JSON object with fields, up to the `[` of the array under key."""
+    body = json.dumps(fields, ensure_ascii=False, separators=_JSON_SEPARATORS)
+    return (body[:-1] + ("," if fields else "") + json.dumps(key) + ":[").encode("utf-8")
+
+def _json_close(fields: Dict) -> bytes:
+    """Closing of an array opened by _json_open, followed by the remaining fields."""
+    body = json.dumps(fields, ensure_ascii=False, separators=_JSON_SEPARATORS)
+    return ("]" + ("," + body[1:] if fields else "}")).encode("utf-8")
+
+def npy_header(header: ChannelHeader) -> bytes:
+    """The .npy file header for a whole stored channel."""
+    shape = (header.length, header.count) if header.count > 1 else (header.length,)
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buffer, {"descr": np.lib.format.dtype_to_descr(header.dtype), "fortran_order": False, "shape": shape}
+    )
+    return buffer.getvalue()
+
+def render_json_chunk(header: ChannelHeader, data: bytes) -> bytes:
+    """
+    Render packed samples as comma-separated JSON values (no brackets).
+
+    Non-finite floats, which JSON cannot represent, become null.
+    """
+    values = decode_samples(header, data)
+    if values.size == 0:
+        return b""
+    if values.dtype.kind == "f" and not np.isfinite(values).all():
+        values = np.where(np.isfinite(values), values.astype(object), None)
+    return json.dumps(values.tolist(), ensure_ascii=False, separators=_JSON_SEPARATORS)[1:-1].encode("utf-8")
+
+def _csv_column_names(channel: StoredChannel) -> List[str]:
+    if channel.header.count > 1:
+        return [f"{channel.attribute}[{i}]" for i in range(channel.header.count)]
+    return [channel.attribute]
+
+def render_csv_chunk(start: int, row_count: int, columns: List[Tuple[ChannelHeader, bytes]]) -> bytes:
+    """Render rows [start, start + row_count) of packed channel chunks as CSV lines."""
+    cells = [np.arange(start, start + row_count).astype(str).tolist()]
+    for header, data in columns:
+        values = decode_samples(header, data)
+        if values.dtype == np.bool_:
+            values = values.astype(np.uint8)
+        values = values.reshape(len(values), header.count)
+        for i in range(header.count):
+            column = values[:, i].astype(str).tolist()
+            cells.append(column + [""] * (row_count - len(column)))
+    return "".join(",".join(row) + "\n" for row in zip(*cells)).encode("utf-8")
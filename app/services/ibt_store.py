@@ -0,0 +1,93 @@
+"""Content-addressed store of uploaded .ibt files for on-demand channel extraction."""
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+from config import settings
+
+class IbtStore:
+    """
+    Service for keeping uploaded .ibt files by content hash.
+
+    When settings.ibt_store_enabled is set, ingested files are retained under
+    settings.ibt_store_dir instead of being deleted, so any IBT variable can
+    later be extracted and stored without re-uploading the file.
+    """
+
+    @staticmethod
+    def path_for(content_hash: str) -> str:
+        """Path of the retained file for a content hash."""
+        return os.path.join(settings.ibt_store_dir, content_hash[:2], f"{content_hash}.ibt")
+
+    @staticmethod
+    def find(content_hash: Optional[str]) -> Optional[str]:
+        """Path of the retained file for a content hash, if there is one."""
+        if not content_hash:
+            return None
+        path = IbtStore.path_for(content_hash)
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def retain_or_remove(file_path: str, content_hash: Optional[str]):
+        """
+        Move an ingested file into the store, or delete it if the store is
+        disabled, the hash is unknown or the file is already stored.
+        """
+        if not os.path.exists(file_path):
+            return
+        if not settings.ibt_store_enabled or not content_hash or IbtStore.find(content_hash):
+            os.unlink(file_path)
+            return
+
+        path = IbtStore.path_for(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The spool may be on another filesystem; copy next to the target, then rename atomically
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.move(file_path, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def discard(content_hash: Optional[str]):
+        """Delete the retained file for a content hash, if any."""
+        path = IbtStore.find(content_hash)
+        if path:
+            os.unlink(path)
+
+    @staticmethod
+    def materialize_channel(session_id: str, content_hash: Optional[str], attribute: str) -> Optional[Dict]:
+        """
+        Extract a channel from a session's retained file and store it.
+
+        The channel is stored with its per-lap stats exactly as if it had been
+        requested at upload, so later reads come from the database. Once laps
+        of the session were deleted, the file no longer matches its stored
+        channels and nothing is extracted.
+
+        Returns:
+            Dict with the channel `value` array and `value_len`, or None if the
+            file is not retained or has no such variable
+
+        Raises:
+            ValueError: If the session has had laps deleted
+        """
+        path = IbtStore.find(content_hash)
+        if not path:
+            return None
+
+        # Imported here so the API process only loads the parser when it has to extract
+        from iRacingTelemetry.telemetry_parser import extract_stored_channels
+        from iRacingTelemetry.add_telemetry import add_attributes
+
+        telemetry_data = extract_stored_channels(path, [attribute])
+        values = telemetry_data["telemetry"].get(attribute)
+        if values is None:
+            return None
+
+        add_attributes(session_id, telemetry_data)
+        return {"value": values, "value_len": len(values)}
@@ -0,0 +1,269 @@
+"""Background ingest of uploaded telemetry files."""
+import os
+import json
+import uuid
+import socket
+import logging
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from config import settings
+from database import SessionLocal
+from models import IngestJob, SessionInfo
+from services.ibt_store import IbtStore
+from services.upload_service import ReceivedUpload
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+MODE_INGEST = "ingest"
+MODE_MERGE = "merge"
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+class IngestService:
+    """Service for queuing telemetry ingest jobs and running them in worker processes."""
+
+    @staticmethod
+    def new_job_id() -> str:
+        """Mint a new job ID."""
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def spool_path(job_id: str) -> str:
+        """Path where the uploaded file for a job is kept until it has been ingested."""
+        return os.path.join(settings.ingest_spool_dir, f"{job_id}.ibt")
+
+    @staticmethod
+    def create_job(
+        db: Session,
+        job_id: str,
+        upload: ReceivedUpload,
+        attributes: List[str],
+        mode: str = MODE_INGEST,
+        session_id: Optional[str] = None
+    ) -> IngestJob:
+        """
+        Record a queued ingest job for a file already written to its spool path.
+
+        Args:
+            db: Database session
+            job_id: Job ID the file was spooled under
+            upload: The received upload
+            attributes: Telemetry attributes to extract
+            mode: MODE_INGEST to create a new session, MODE_MERGE to add the
+                attributes to session_id
+            session_id: Existing session to merge into
+
+        Returns:
+            The persisted job
+        """
+        job = IngestJob(
+            job_id=job_id,
+            status=JOB_QUEUED,
+            mode=mode,
+            session_id=session_id,
+            file_name=upload.file_name,
+            file_path=upload.file_path,
+            content_hash=upload.content_hash,
+            file_size=upload.size,
+            attributes=json.dumps(attributes),
+            created_at=datetime.utcnow()
+        )
+        db.add(job)
+        db.commit()
+        return job
+
+    @staticmethod
+    def find_session_by_hash(db: Session, content_hash: str) -> Optional[SessionInfo]:
+        """Find a session already ingested from a file with this content hash."""
+        return db.query(SessionInfo).filter(SessionInfo.content_hash == content_hash).first()
+
+    @staticmethod
+    def find_active_job_by_hash(db: Session, content_hash: str) -> Optional[IngestJob]:
+        """Find a queued or running ingest of a file with this content hash."""
+        return db.query(IngestJob).filter(
+            IngestJob.content_hash == content_hash,
+            IngestJob.mode == MODE_INGEST,
+            IngestJob.status.in_([JOB_QUEUED, JOB_RUNNING])
+        ).order_by(IngestJob.created_at).first()
+
+    @staticmethod
+    def job_to_dict(job: IngestJob) -> Dict:
+        """Serialize a job for API responses."""
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "mode": job.mode,
+            "file_name": job.file_name,
+            "content_hash": job.content_hash,
+            "file_size": job.file_size,
+            "session_id": job.session_id,
+            "error": job.error,
+            "timings": json.loads(job.timings) if job.timings else None,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    @staticmethod
+    def start_pool():
+        """Start the ingest worker pool and resubmit jobs left over from a previous run."""
+        global _executor
+        if _executor is not None:
+            return
+        os.makedirs(settings.ingest_spool_dir, exist_ok=True)
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.ingest_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        IngestService.recover_jobs()
+
+    @staticmethod
+    def shutdown_pool():
+        """Stop the ingest worker pool; unfinished jobs are recovered on next start."""
+        global _executor
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+    @staticmethod
+    def submit(job_id: str):
+        """Hand a queued job to the worker pool."""
+        if _executor is None:
+            raise RuntimeError("Ingest worker pool is not running")
+        future = _executor.submit(run_ingest_job, job_id)
+        future.add_done_callback(lambda f: IngestService._on_job_done(job_id, f))
+
+    @staticmethod
+    def _on_job_done(job_id: str, future):
+        """Mark a job failed if its worker process died before it could report back."""
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error("Ingest worker for job %s crashed: %s", job_id, future.exception())
+        db = SessionLocal()
+        try:
+            db.query(IngestJob).filter(
+                IngestJob.job_id == job_id,
+                IngestJob.status.in_([JOB_QUEUED, JOB_RUNNING])
+            ).update({
+                "status": JOB_FAILED,
+                "error": f"Ingest worker crashed: {future.exception()}",
+                "finished_at": datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def recover_jobs():
+        """
+        Requeue jobs whose worker process on this host no longer exists, then
+        submit every queued job. Claiming is atomic, so jobs submitted by more
+        than one API process still run once.
+        """
+        db = SessionLocal()
+        try:
+            host_prefix = f"{socket.gethostname()}:"
+            running = db.query(IngestJob).filter(
+                IngestJob.status == JOB_RUNNING,
+                IngestJob.worker.like(f"{host_prefix}%")
+            ).all()
+            for job in running:
+                if not _pid_alive(int(job.worker[len(host_prefix):])):
+                    job.status = JOB_QUEUED
+                    job.worker = None
+                    job.started_at = None
+            db.commit()
+
+            queued = db.query(IngestJob.job_id).filter(
+                IngestJob.status == JOB_QUEUED
+            ).order_by(IngestJob.created_at).all()
+        finally:
+            db.close()
+
+        for (job_id,) in queued:
+            IngestService.submit(job_id)
+
+def _pid_alive(pid: int) -> bool:
+    """Check whether a process with the given PID exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def run_ingest_job(job_id: str):
+    """Worker process entry point: claim a queued job, parse and store its file."""
+    # Imported here so the API process does not load the parser until it is needed
+    from iRacingTelemetry.telemetry_parser import parse_telemetry
+
+    db = SessionLocal()
+    try:
+        claimed = db.query(IngestJob).filter(
+            IngestJob.job_id == job_id,
+            IngestJob.status == JOB_QUEUED
+        ).update({
+            "status": JOB_RUNNING,
+            "worker": f"{socket.gethostname()}:{os.getpid()}",
+            "started_at": datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+
+        job = db.query(IngestJob).filter(IngestJob.job_id == job_id).first()
+        timings = {}
+        
+        # The same file may have been ingested since this job was queued
+        existing = None
+        if job.mode == MODE_INGEST and job.content_hash:
+            existing = IngestService.find_session_by_hash(db, job.content_hash)
+        
+        if existing:
+            result = {"session_id": existing.session_id}
+        else:
+            try:
+                result = parse_telemetry(
+                    job.file_path,
+                    json.loads(job.attributes or "[]"),
+                    timings=timings,
+                    content_hash=job.content_hash,
+                    session_id=job.session_id if job.mode == MODE_MERGE else None
+                )
+            except Exception as e:
+                result = {"error": str(e)}
+            if isinstance(result, str):
+                result = json.loads(result)
+            
+            # A concurrent ingest of the same file wins the unique content hash
+            if "error" in result and job.mode == MODE_INGEST and job.content_hash:
+                db.rollback()  # start a new transaction so the other ingest's commit is visible
+                existing = IngestService.find_session_by_hash(db, job.content_hash)
+                if existing:
+                    result = {"session_id": existing.session_id}
+
+        if "error" in result:
+            job.status = JOB_FAILED
+            job.error = result["error"]
+        else:
+            job.status = JOB_SUCCEEDED
+            job.session_id = result["session_id"]
+        job.timings = json.dumps(timings)
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+        if job.status == JOB_SUCCEEDED:
+            IbtStore.retain_or_remove(job.file_path, job.content_hash)
+        elif os.path.exists(job.file_path):
+            os.unlink(job.file_path)
+    finally:
+        db.close()
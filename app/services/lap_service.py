@@ -1,21 +1,32 @@
 """Lap analysis service for telemetry data."""
-import json
 from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
-from models import AttributeValue
+import numpy as np
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Lap, SessionInfo, Driver
+from services.compute_pool import ComputePool
+from services.channel_service import ChannelService
+
+# LapCurrentLapTime at the first sample of a lap that started at the start/finish line
+FIRST_LAP_START_SECONDS = 1.0
 
 class LapService:
     """Service for analyzing lap data from telemetry."""
     
     @staticmethod
-    def get_lap_indices(session_id: str, db: Session, include_incidents: bool = False) -> List[Dict]:
+    async def get_lap_indices(session_id: str, db: AsyncSession, include_incidents: bool = False) -> List[Dict]:
         """
-        Get lap data for a specific session and parse lap start/end indices.
+        Get lap data for a specific session with lap start/end indices.
+        
+        Lap boundaries are read from the lap table filled at ingest. Sessions
+        ingested before the table existed are parsed from their Lap channel
+        once and backfilled.
         
         Args:
             session_id: The session ID to fetch lap data for
             db: Database session
-            include_incidents: Whether to check for incidents in each lap
+            include_incidents: Whether to include incident counts for each lap
             
         Returns:
             Array containing lap information with start and end indices for each lap
@@ -23,128 +34,252 @@ class LapService:
         Raises:
             ValueError: If session not found or data cannot be parsed
         """
-        # Fetch the Lap attribute value for the session
-        lap_attr = db.query(AttributeValue).filter(
-            AttributeValue.session_id == session_id,
-            AttributeValue.attribute == 'Lap'
-        ).first()
+        rows = (await db.execute(
+            select(Lap).where(Lap.session_id == session_id).order_by(Lap.start_index)
+        )).scalars().all()
+        if not rows:
+            return await LapService._backfill_laps(session_id, db, include_incidents)
         
-        if not lap_attr:
-            raise ValueError(f"No lap data found for session: {session_id}")
+        return [LapService._lap_to_dict(row, include_incidents) for row in rows]
+    
+    @staticmethod
+    async def get_lap(session_id: str, lap_number: int, db: AsyncSession, include_incidents: bool = False) -> Optional[Dict]:
+        """
+        Get the boundaries of a single lap with a primary key lookup.
         
-        # Parse the lap data
-        try:
-            lap_data = json.loads(lap_attr.value)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to parse lap data: {str(e)}")
+        Returns:
+            The lap, or None if the session has no such lap
+            
+        Raises:
+            ValueError: If session not found or data cannot be parsed
+        """
+        row = await db.get(Lap, (session_id, lap_number))
+        if row:
+            return LapService._lap_to_dict(row, include_incidents)
         
-        # Process lap data to find start and end indices for each lap
+        # Not stored: either no such lap, or a session that has not been backfilled yet
+        if (await db.execute(select(Lap.lap_number).where(Lap.session_id == session_id).limit(1))).first():
+            return None
+        laps = await LapService._backfill_laps(session_id, db, include_incidents)
+        return next((lap for lap in laps if lap['lap_number'] == lap_number), None)
+    
+    @staticmethod
+    async def lock_lap(session_id: str, lap_number: int, db: AsyncSession) -> Optional[Dict]:
+        """
+        Read a stored lap with a locking read, for a caller about to change it.
+
+        A locking read sees the latest committed boundaries, not the
+        transaction's snapshot, so they reflect any lap delete that committed
+        while the caller waited for its locks. Laps are not backfilled.
+
+        Returns:
+            The lap, or None if the session has no such lap (any more)
+        """
+        row = (await db.execute(
+            select(Lap).where(Lap.session_id == session_id, Lap.lap_number == lap_number).with_for_update()
+        )).scalar_one_or_none()
+        return LapService._lap_to_dict(row, False) if row else None
+
+    @staticmethod
+    def compute_laps(lap_data, session_time=None, incident_data=None, lap_time_data=None) -> List[Dict]:
+        """
+        Compute lap boundaries, lap times, incident counts, validity and completeness from raw channels.
+        
+        A lap is valid if it has no incidents (every lap is without a
+        PlayerIncidents channel). The last lap of a recording is never
+        complete (it runs until the file ends); the first one only if it
+        started at the start/finish line, i.e. its LapCurrentLapTime was still
+        near zero (a recording started mid-lap begins with a partial lap).
+        
+        Args:
+            lap_data: Lap channel (lap number per sample)
+            session_time: SessionTime channel, used for lap times
+            incident_data: PlayerIncidents channel, used for incident counts
+            lap_time_data: LapCurrentLapTime channel, used to tell whether the first lap is complete
+            
+        Returns:
+            Laps with start/end indices, sample count, lap_time, incidents, valid and complete
+        """
         laps = LapService._parse_lap_indices(lap_data)
         
-        # Add incident detection if requested
-        if include_incidents:
-            laps = LapService._add_incident_data(session_id, laps, db)
+        for position, lap in enumerate(laps):
+            start_index = lap['start_index']
+            end_index = lap['end_index']
+            
+            # A lap runs until the next lap starts; the last lap until the final sample
+            lap['lap_time'] = None
+            if session_time is not None and len(session_time) > start_index:
+                finish_index = min(end_index + 1, len(session_time) - 1)
+                lap['lap_time'] = float(session_time[finish_index] - session_time[start_index])
+            
+            lap['incidents'] = None
+            if incident_data is not None:
+                lap['incidents'] = int(np.count_nonzero(incident_data[start_index:end_index + 1] == 1))
+            
+            complete = position < len(laps) - 1 and lap['lap_time'] is not None
+            if complete and position == 0:
+                complete = (
+                    lap_time_data is not None and len(lap_time_data) > start_index
+                    and 0.0 <= float(lap_time_data[start_index]) < FIRST_LAP_START_SECONDS
+                )
+            lap['complete'] = complete
+            lap['valid'] = not lap['incidents']
         
         return laps
     
     @staticmethod
-    def _parse_lap_indices(lap_data: List) -> List[Dict]:
+    async def remove_lap(session_id: str, lap: Dict, db: AsyncSession):
         """
-        Parse lap data array to find start and end indices for each lap.
+        Drop a lap whose samples were removed from the Lap channel and shift the
+        laps after it back by its sample count. The caller commits.
+        """
+        await db.execute(delete(Lap).where(
+            Lap.session_id == session_id,
+            Lap.lap_number == lap['lap_number']
+        ))
+        await db.execute(update(Lap).where(
+            Lap.session_id == session_id,
+            Lap.start_index > lap['end_index']
+        ).values({
+            Lap.start_index: Lap.start_index - lap['sample_count'],
+            Lap.end_index: Lap.end_index - lap['sample_count']
+        }))
+    
+    @staticmethod
+    def player_driver(player_driver_user_id: Optional[int], drivers: List[Dict]) -> Optional[Dict]:
+        """
+        The driver the session's telemetry was recorded for, among its drivers.
+        
+        Ingest stores the player's driver_user_id on session_info (matched on
+        DriverCarIdx); it is None if the player could not be told.
+        """
+        if player_driver_user_id is None:
+            return None
+        return next((driver for driver in drivers if driver['driver_user_id'] == player_driver_user_id), None)
+    
+    @staticmethod
+    def leaderboard_fields(session_info: Optional[Dict], drivers: List[Dict]) -> Dict:
+        """
+        Lap columns copied from the session and its player's driver for leaderboards.
         
         Args:
-            lap_data: Array of lap numbers indexed by sample position
-            
-        Returns:
-            Array of laps with their start and end indices
+            session_info: The session's columns (track_id, track_config,
+                session_date and player_driver_user_id at least)
+            drivers: The session's drivers (driver_user_id and car_name at least)
         """
-        if not lap_data:
-            return []
+        driver = LapService.player_driver(session_info['player_driver_user_id'], drivers) if session_info else None
+        return {
+            'track_id': session_info['track_id'] if session_info else None,
+            'track_config': session_info['track_config'] if session_info else None,
+            'session_date': session_info['session_date'] if session_info else None,
+            'driver_user_id': driver['driver_user_id'] if driver else None,
+            'car_name': driver['car_name'] if driver else None
+        }
+    
+    @staticmethod
+    async def session_leaderboard_fields(session_id: str, db: AsyncSession) -> Dict:
+        """leaderboard_fields of a stored session."""
+        session_info = (await db.execute(
+            select(
+                SessionInfo.track_id, SessionInfo.track_config, SessionInfo.session_date,
+                SessionInfo.player_driver_user_id
+            ).where(SessionInfo.session_id == session_id)
+        )).mappings().first()
+        drivers = (await db.execute(
+            select(Driver.driver_user_id, Driver.car_name).where(Driver.session_id == session_id)
+        )).mappings().all()
+        return LapService.leaderboard_fields(session_info, drivers)
+    
+    @staticmethod
+    def _lap_to_dict(row: Lap, include_incidents: bool) -> Dict:
+        """Serialize a stored lap in the shape the lap endpoints return."""
+        lap = {
+            'lap_number': row.lap_number,
+            'start_index': row.start_index,
+            'end_index': row.end_index,
+            'sample_count': row.sample_count,
+            'lap_time': row.lap_time
+        }
+        if include_incidents:
+            lap['valid_lap'] = row.valid if row.valid is not None else (row.incidents is None or row.incidents == 0)
+            lap['complete_lap'] = row.complete
+            lap['incidents_in_lap'] = row.incidents
+        return lap
+    
+    @staticmethod
+    async def _backfill_laps(session_id: str, db: AsyncSession, include_incidents: bool) -> List[Dict]:
+        """Parse laps from the stored Lap channel and persist them to the lap table."""
+        data_version = await ChannelService.data_version(session_id, db)
+        try:
+            lap_data = None
+            if data_version is not None:
+                lap_data = await ChannelService.read_channel(session_id, 'Lap', db, data_version)
+        except ValueError as e:
+            raise ValueError(f"Failed to parse lap data: {str(e)}")
+        if lap_data is None:
+            raise ValueError(f"No lap data found for session: {session_id}")
         
-        laps = []
-        current_lap = None
-        start_index = None
+        # The timing and incident channels are optional
+        optional = {}
+        for name in ('SessionTime', 'PlayerIncidents', 'LapCurrentLapTime'):
+            try:
+                optional[name] = await ChannelService.read_channel(session_id, name, db, data_version)
+            except ValueError:
+                optional[name] = None
         
-        for index, lap_number in enumerate(lap_data):
-            # Skip if lap number is 0 or negative (usually warmup/cooldown)
-            if lap_number <= 0:
-                continue
-            
-            # New lap detected
-            if current_lap != lap_number:
-                # Save previous lap if it exists
-                if current_lap is not None and start_index is not None:
-                    laps.append({
-                        'lap_number': current_lap,
-                        'start_index': start_index,
-                        'end_index': index - 1,
-                        'sample_count': (index - 1) - start_index + 1
-                    })
-                
-                # Start new lap
-                current_lap = lap_number
-                start_index = index
-        
-        # Add the last lap
-        if current_lap is not None and start_index is not None:
-            last_index = len(lap_data) - 1
-            laps.append({
-                'lap_number': current_lap,
-                'start_index': start_index,
-                'end_index': last_index,
-                'sample_count': last_index - start_index + 1
-            })
+        # Lap parsing is CPU-bound; run it in a compute worker
+        laps = await ComputePool.run(
+            LapService.compute_laps, lap_data, optional['SessionTime'], optional['PlayerIncidents'],
+            optional['LapCurrentLapTime']
+        )
         
-        return laps
+        fields = await LapService.session_leaderboard_fields(session_id, db)
+        rows = [Lap(session_id=session_id, **lap, **fields) for lap in laps]
+        result = [LapService._lap_to_dict(row, include_incidents) for row in rows]
+        if rows:
+            db.add_all(rows)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Another request backfilled the same session first
+                await db.rollback()
+        
+        return result
     
     @staticmethod
-    def _add_incident_data(session_id: str, laps: List[Dict], db: Session) -> List[Dict]:
+    def _parse_lap_indices(lap_data) -> List[Dict]:
         """
-        Add incident data to laps by checking PlayerIncidents attribute.
+        Parse lap data array to find start and end indices for each lap.
+        
+        Samples with a lap number of 0 or below (usually warmup/cooldown) never
+        start a lap; they are attributed to the lap that precedes them.
         
         Args:
-            session_id: The session ID
-            laps: Array of lap data with start/end indices
-            db: Database session
+            lap_data: Array of lap numbers indexed by sample position
             
         Returns:
-            Laps with added incident information
-        """
-        # Try to fetch PlayerIncidents attribute
-        incident_attr = db.query(AttributeValue).filter(
-            AttributeValue.session_id == session_id,
-            AttributeValue.attribute == 'PlayerIncidents'
-        ).first()
-        
-        # If PlayerIncidents doesn't exist, mark all laps as valid
-        if not incident_attr:
-            for lap in laps:
-                lap['valid_lap'] = True
-                lap['incidents_in_lap'] = None
-            return laps
-        
-        # Parse the PlayerIncidents data
-        try:
-            incident_data = json.loads(incident_attr.value)
-        except json.JSONDecodeError:
-            # If we can't parse incidents, assume all laps are valid
-            for lap in laps:
-                lap['valid_lap'] = True
-                lap['incidents_in_lap'] = None
-            return laps
-        
-        # Check each lap for incidents
-        for lap in laps:
-            start_index = lap['start_index']
-            end_index = lap['end_index']
-            
-            # Count all incidents (1 values) within the lap's frame range
-            incident_count = sum(
-                1 for i in range(start_index, end_index + 1)
-                if i < len(incident_data) and incident_data[i] == 1
-            )
-            
-            lap['incidents_in_lap'] = incident_count
-            lap['valid_lap'] = incident_count == 0
+            Array of laps with their start and end indices
+        """
+        lap_data = np.asarray(lap_data)
+        positive = np.flatnonzero(lap_data > 0)
+        if positive.size == 0:
+            return []
         
-        return laps
+        # A lap starts wherever the lap number differs from the previous positive sample
+        lap_numbers = lap_data[positive]
+        is_start = np.empty(positive.size, dtype=bool)
+        is_start[0] = True
+        is_start[1:] = lap_numbers[1:] != lap_numbers[:-1]
+        
+        starts = positive[is_start]
+        ends = np.append(starts[1:] - 1, len(lap_data) - 1)
+        
+        return [
+            {
+                'lap_number': int(lap_number),
+                'start_index': int(start_index),
+                'end_index': int(end_index),
+                'sample_count': int(end_index - start_index + 1)
+            }
+            for lap_number, start_index, end_index in zip(lap_data[starts], starts, ends)
+        ]
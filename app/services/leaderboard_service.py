@@ -0,0 +1,85 @@
+"""Per-track lap leaderboards across sessions."""
+from typing import Dict, Optional
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Lap, SessionInfo, Driver
+
+class LeaderboardService:
+    """Service for ranking stored laps by lap time."""
+
+    @staticmethod
+    async def top_laps(
+        db: AsyncSession,
+        track_id: int,
+        limit: int,
+        track_config: Optional[str] = None,
+        car_name: Optional[str] = None,
+        driver_user_id: Optional[int] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> Dict:
+        """
+        The fastest complete laps without incidents on a track, fastest first.
+
+        Laps carry their session's track and date and its player's driver and
+        car (copied at ingest), so the ranking is a range scan of one of the
+        lap leaderboard indexes in lap_time order that stops after limit rows:
+        ix_lap_leaderboard for a track/config, ix_lap_leaderboard_car with
+        car_name and ix_lap_leaderboard_driver with driver_user_id. Driver and session
+        names are joined in by primary key for the returned laps only.
+        session_date is stored as an ISO date string, so date_from/date_to
+        compare as strings.
+
+        Args:
+            track_id: Track to rank laps on
+            limit: Number of laps to return
+            track_config: Track configuration (default: every configuration)
+            car_name: Only laps driven in this car
+            driver_user_id: Only laps of this driver
+            date_from: Earliest session date (inclusive)
+            date_to: Latest session date (inclusive)
+
+        Returns:
+            Dict with the filters and the ranked `laps`
+        """
+        conditions = [
+            Lap.track_id == track_id, Lap.complete == True, Lap.valid == True, Lap.lap_time.is_not(None)
+        ]
+        if track_config is not None:
+            conditions.append(Lap.track_config == track_config)
+        if car_name is not None:
+            conditions.append(Lap.car_name == car_name)
+        if driver_user_id is not None:
+            conditions.append(Lap.driver_user_id == driver_user_id)
+        if date_from is not None:
+            conditions.append(Lap.session_date >= date_from)
+        if date_to is not None:
+            conditions.append(Lap.session_date <= date_to)
+
+        rows = (await db.execute(
+            select(
+                Lap.session_id,
+                Lap.lap_number,
+                Lap.lap_time,
+                Lap.track_config,
+                Lap.session_date,
+                Lap.driver_user_id,
+                Lap.car_name,
+                Driver.driver_name,
+                SessionInfo.track_name,
+                SessionInfo.session_type
+            )
+            .outerjoin(Driver, and_(Driver.session_id == Lap.session_id, Driver.driver_user_id == Lap.driver_user_id))
+            .outerjoin(SessionInfo, SessionInfo.session_id == Lap.session_id)
+            .where(*conditions)
+            .order_by(Lap.lap_time, Lap.session_id, Lap.lap_number)
+            .limit(limit)
+        )).mappings().all()
+
+        return {
+            "track_id": track_id,
+            "track_config": track_config,
+            "car_name": car_name,
+            "driver_user_id": driver_user_id,
+            "laps": [{"rank": rank, **row} for rank, row in enumerate(rows, start=1)]
+        }
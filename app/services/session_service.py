@@ -0,0 +1,140 @@
+"""Session listing service."""
+import json
+import base64
+import binascii
+from typing import Dict, List, Optional
+from sqlalchemy import select, func, and_, or_, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import SessionInfo, Driver
+
+# Fields /sessions/ can return, in response order
+LIST_FIELDS = [
+    "session_id",
+    "session_type",
+    "track_name",
+    "track_id",
+    "track_config",
+    "session_date",
+    "session_time",
+]
+
+class SessionService:
+    """Service for listing sessions with filters and keyset pagination."""
+
+    @staticmethod
+    async def list_sessions(
+        db: AsyncSession,
+        limit: int,
+        cursor: Optional[str] = None,
+        track_id: Optional[int] = None,
+        track_config: Optional[str] = None,
+        session_type: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        driver_user_id: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+        include_total: bool = True
+    ) -> Dict:
+        """
+        List one page of sessions, newest first.
+
+        Sessions are ordered by (session_date, session_id) descending and
+        paged with a keyset cursor on those columns, so every page is an index
+        range scan however deep it is. Filters match the composite indexes on
+        session_info (and driver for driver_user_id). session_date is stored
+        as an ISO date string, so date_from/date_to compare as strings.
+
+        Args:
+            limit: Maximum number of sessions to return
+            cursor: next_cursor of the previous page
+            fields: Fields to return (default: all of LIST_FIELDS)
+            include_total: Also count every session matching the filters
+
+        Returns:
+            Dict with `count` (total matching, or None), `sessions` and
+            `next_cursor` (None on the last page)
+
+        Raises:
+            ValueError: If a field is unknown or the cursor is malformed
+        """
+        fields = list(dict.fromkeys(fields)) if fields else LIST_FIELDS
+        unknown = [field for field in fields if field not in LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}; available: {', '.join(LIST_FIELDS)}")
+
+        conditions = []
+        if track_id is not None:
+            conditions.append(SessionInfo.track_id == track_id)
+        if track_config is not None:
+            conditions.append(SessionInfo.track_config == track_config)
+        if session_type is not None:
+            conditions.append(SessionInfo.session_type == session_type)
+        if date_from is not None:
+            conditions.append(SessionInfo.session_date >= date_from)
+        if date_to is not None:
+            conditions.append(SessionInfo.session_date <= date_to)
+        if driver_user_id is not None:
+            conditions.append(exists().where(
+                Driver.session_id == SessionInfo.session_id,
+                Driver.driver_user_id == driver_user_id
+            ))
+
+        total = None
+        if include_total:
+            total = (await db.execute(
+                select(func.count()).select_from(SessionInfo).where(*conditions)
+            )).scalar()
+
+        page_conditions = list(conditions)
+        if cursor:
+            page_conditions.append(SessionService._after_cursor(*SessionService._decode_cursor(cursor)))
+
+        # The cursor columns are always selected, whichever fields are returned
+        columns = [getattr(SessionInfo, field) for field in dict.fromkeys(["session_id", "session_date"] + fields)]
+        rows = (await db.execute(
+            select(*columns)
+            .where(*page_conditions)
+            .order_by(SessionInfo.session_date.desc(), SessionInfo.session_id.desc())
+            .limit(limit + 1)
+        )).mappings().all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = SessionService._encode_cursor(rows[-1]["session_date"], rows[-1]["session_id"])
+
+        return {
+            "count": total,
+            "sessions": [{field: row[field] for field in fields} for row in rows],
+            "next_cursor": next_cursor
+        }
+
+    @staticmethod
+    def _after_cursor(session_date: Optional[str], session_id: str):
+        """
+        Condition for the rows after (session_date, session_id) in descending
+        order. MySQL sorts NULL dates last when descending.
+        """
+        if session_date is None:
+            return and_(SessionInfo.session_date.is_(None), SessionInfo.session_id < session_id)
+        return or_(
+            SessionInfo.session_date < session_date,
+            and_(SessionInfo.session_date == session_date, SessionInfo.session_id < session_id),
+            SessionInfo.session_date.is_(None)
+        )
+
+    @staticmethod
+    def _encode_cursor(session_date: Optional[str], session_id: str) -> str:
+        raw = json.dumps([session_date, session_id], separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            session_date, session_id = json.loads(raw)
+        except (binascii.Error, ValueError, TypeError):
+            raise ValueError("Malformed cursor")
+        if not isinstance(session_id, str) or not (session_date is None or isinstance(session_date, str)):
+            raise ValueError("Malformed cursor")
+        return session_date, session_id
@@ -0,0 +1,241 @@
+"""Host-wide cache of decoded telemetry channels in memory-mapped files.
+
+With several API worker processes per host, each would otherwise decode and
+hold its own copy of every hot channel. Here a decoded channel is written
+once as a .npy file under settings.shared_cache_dir (a tmpfs such as
+/dev/shm by default) and every process maps it read-only, so the samples
+live in the page cache once per host and reads are zero-copy.
+
+Layout:
+
+    index.json                                   {"entries": {relative path: bytes}, "size_bytes": total}
+    .lock                                        flock taken by every writer
+    {session_id}/{attribute}@{data_version}.npy  one decoded channel
+
+Writers (put, invalidate) serialize on the lock, write data files to a
+temporary name and rename them into place, and keep the index within
+settings.shared_cache_bytes by evicting the least recently used entries
+(readers touch a file's mtime on every hit). Readers take no lock: a file is
+either complete or absent, and a mapping stays valid after the file is
+evicted. Keys carry the session's data_version, so a stale channel is never
+served even before its files are removed.
+"""
+import os
+import json
+import fcntl
+import errno
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import quote
+import numpy as np
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+# Per-process counters; sizes come from the shared index
+_counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_counters_lock = threading.Lock()
+
+class SharedChannelCache:
+    """Service for the host-wide, memory-mapped channel cache."""
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.shared_cache_bytes > 0
+
+    @staticmethod
+    def get(session_id: str, attribute: str, data_version: int) -> Optional[np.ndarray]:
+        """Map a cached channel read-only, or return None (counted as a miss)."""
+        path = os.path.join(settings.shared_cache_dir, _entry_path(session_id, attribute, data_version))
+        try:
+            values = np.load(path, mmap_mode="r", allow_pickle=False)
+            # Recently used entries are evicted last
+            os.utime(path)
+        except (OSError, ValueError):
+            _count("misses")
+            return None
+        _count("hits")
+        return values
+
+    @staticmethod
+    def put(session_id: str, attribute: str, data_version: int, values: np.ndarray) -> np.ndarray:
+        """
+        Store a decoded channel for every process on the host.
+
+        Channels larger than the byte cap are not stored. If the cache
+        directory cannot be written, the channel is returned uncached.
+
+        Returns:
+            A read-only mapping of the stored channel, or values itself if it
+            was not stored
+        """
+        relative_path = _entry_path(session_id, attribute, data_version)
+        path = os.path.join(settings.shared_cache_dir, relative_path)
+        size = values.nbytes
+        if size > settings.shared_cache_bytes:
+            return values
+
+        try:
+            with _writer_lock():
+                index = _read_index()
+                if relative_path not in index["entries"]:
+                    _evict(index, settings.shared_cache_bytes - size)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_atomically(
+                        path, "wb", lambda f: np.save(f, np.ascontiguousarray(values), allow_pickle=False)
+                    )
+                    index["entries"][relative_path] = size
+                    _write_index(index)
+            return np.load(path, mmap_mode="r", allow_pickle=False)
+        except OSError as e:
+            if e.errno not in (errno.ENOSPC, errno.EACCES, errno.EROFS, errno.ENOENT):
+                raise
+            logger.warning(
+                "Could not cache channel %s/%s in %s: %s", session_id, attribute, settings.shared_cache_dir, e
+            )
+            return values
+
+    @staticmethod
+    def invalidate(session_id: str, attributes=None):
+        """Remove a session's cached channels (only the given attributes, if any) for every process."""
+        prefix = quote(session_id, safe="") + "/"
+        names = None if attributes is None else {quote(attribute, safe="") for attribute in attributes}
+        try:
+            with _writer_lock():
+                index = _read_index()
+                stale = [
+                    relative_path for relative_path in index["entries"]
+                    if relative_path.startswith(prefix)
+                    and (names is None or relative_path[len(prefix):].rsplit("@", 1)[0] in names)
+                ]
+                for relative_path in stale:
+                    _remove(index, relative_path)
+                _write_index(index)
+        except OSError as e:
+            # Entries of older data versions are never served, so this only delays freeing them
+            logger.warning("Could not invalidate cached channels of %s: %s", session_id, e)
+            return
+        _count("invalidations", len(stale))
+
+    @staticmethod
+    def clear():
+        """Remove every cached channel."""
+        with _writer_lock():
+            index = _read_index()
+            for relative_path in list(index["entries"]):
+                _remove(index, relative_path)
+            _write_index(index)
+
+    @staticmethod
+    def stats() -> Dict:
+        """This process's hit/miss/eviction/invalidation counters and the host-wide size."""
+        with _counters_lock:
+            counters = dict(_counters)
+        lookups = counters["hits"] + counters["misses"]
+        index = _read_index()
+        return {
+            **counters,
+            "hit_ratio": counters["hits"] / lookups if lookups else None,
+            "entries": len(index["entries"]),
+            "size_bytes": sum(index["entries"].values()),
+            "budget_bytes": settings.shared_cache_bytes
+        }
+
+def _entry_path(session_id: str, attribute: str, data_version: int) -> str:
+    return f"{quote(session_id, safe='')}/{quote(attribute, safe='')}@{data_version}.npy"
+
+def _count(counter: str, amount: int = 1):
+    with _counters_lock:
+        _counters[counter] += amount
+
+@contextmanager
+def _writer_lock():
+    """Exclusive lock shared by every writer on the host."""
+    os.makedirs(settings.shared_cache_dir, exist_ok=True)
+    with open(os.path.join(settings.shared_cache_dir, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _read_index() -> Dict:
+    """Load the index, rebuilding it from the data files if it is missing or damaged."""
+    try:
+        with open(os.path.join(settings.shared_cache_dir, INDEX_FILE), encoding="utf-8") as f:
+            index = json.load(f)
+        if isinstance(index.get("entries"), dict):
+            return index
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    entries = {}
+    for root, _, files in os.walk(settings.shared_cache_dir):
+        for name in files:
+            if name.endswith(".npy"):
+                path = os.path.join(root, name)
+                try:
+                    entries[os.path.relpath(path, settings.shared_cache_dir)] = os.path.getsize(path)
+                except OSError:
+                    continue
+    return {"entries": entries}
+
+def _write_index(index: Dict):
+    """Replace the index atomically. Caller holds the writer lock."""
+    index["size_bytes"] = sum(index["entries"].values())
+    path = os.path.join(settings.shared_cache_dir, INDEX_FILE)
+    _write_atomically(path, "w", lambda f: json.dump(index, f))
+
+def _write_atomically(path: str, mode: str, write):
+    """
+    Write a file under a temporary name and rename it into place, removing
+    the temporary file if writing fails (a full tmpfs, typically).
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _remove(index: Dict, relative_path: str):
+    """Delete an entry's file and drop it from the index. Caller holds the writer lock."""
+    index["entries"].pop(relative_path, None)
+    path = os.path.join(settings.shared_cache_dir, relative_path)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass  # other channels of the session are still cached
+
+def _evict(index: Dict, budget: int):
+    """Remove least recently used entries until the index fits budget. Caller holds the writer lock."""
+    size = sum(index["entries"].values())
+    if size <= budget:
+        return
+
+    def last_used(relative_path):
+        try:
+            return os.path.getmtime(os.path.join(settings.shared_cache_dir, relative_path))
+        except OSError:
+            return 0.0
+
+    for relative_path in sorted(index["entries"], key=last_used):
+        if size <= budget:
+            break
+        size -= index["entries"][relative_path]
+        _remove(index, relative_path)
+        _count("evictions")
@@ -0,0 +1,254 @@
+"""Per-lap channel statistics for telemetry data."""
+from typing import List, Dict, Optional
+import numpy as np
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import LapChannelStats
+from services.compute_pool import ComputePool
+from services.lap_service import LapService
+from services.channel_service import ChannelService
+
+# lap_channel_stats columns filled by compute_lap_stats
+STATS_COLUMNS = ("sample_count", "value_sum", "value_sum_sq", "value_min", "value_max", "p50", "p95")
+
+class StatsService:
+    """Service for computing and reading per-lap aggregates of telemetry channels."""
+
+    @staticmethod
+    def compute_lap_stats(values, laps: List[Dict]) -> List[Dict]:
+        """
+        Compute count/sum/sum of squares/min/max/p50/p95 of a channel for every lap.
+
+        Sums and extremes are segment reductions over the whole channel in one
+        pass; non-finite samples are ignored. Array and non-numeric channels
+        get empty stats (sample_count 0) so they are not recomputed on read.
+
+        Args:
+            values: Decoded channel samples
+            laps: Laps with lap_number, start_index and end_index
+
+        Returns:
+            One stats dict per lap
+        """
+        values = np.asarray(values)
+        stats = [
+            {
+                'lap_number': lap['lap_number'],
+                'sample_count': 0,
+                'value_sum': None,
+                'value_sum_sq': None,
+                'value_min': None,
+                'value_max': None,
+                'p50': None,
+                'p95': None
+            }
+            for lap in laps
+        ]
+        if not laps or values.ndim != 1 or values.dtype.kind not in 'biuf' or values.size == 0:
+            return stats
+
+        data = values.astype(np.float64)
+        finite = np.isfinite(data)
+
+        # Segment bounds as [start, end + 1) pairs; one padding sample keeps every bound a valid index
+        starts = np.minimum([lap['start_index'] for lap in laps], data.size)
+        stops = np.minimum([lap['end_index'] + 1 for lap in laps], data.size)
+        bounds = np.empty(2 * len(laps), dtype=np.intp)
+        bounds[0::2] = starts
+        bounds[1::2] = stops
+
+        def segment_reduce(ufunc, samples, pad):
+            return ufunc.reduceat(np.append(samples, pad), bounds)[0::2]
+
+        counts = segment_reduce(np.add, finite.astype(np.int64), 0)
+        counts[starts >= stops] = 0
+        sums = segment_reduce(np.add, np.where(finite, data, 0.0), 0.0)
+        sums_sq = segment_reduce(np.add, np.where(finite, data * data, 0.0), 0.0)
+        mins = segment_reduce(np.minimum, np.where(finite, data, np.inf), np.inf)
+        maxs = segment_reduce(np.maximum, np.where(finite, data, -np.inf), -np.inf)
+
+        for i, lap_stats in enumerate(stats):
+            if counts[i] == 0:
+                continue
+            segment = data[starts[i]:stops[i]]
+            p50, p95 = np.percentile(segment[finite[starts[i]:stops[i]]], [50, 95])
+            lap_stats.update({
+                'sample_count': int(counts[i]),
+                'value_sum': float(sums[i]),
+                'value_sum_sq': float(sums_sq[i]),
+                'value_min': float(mins[i]),
+                'value_max': float(maxs[i]),
+                'p50': float(p50),
+                'p95': float(p95)
+            })
+
+        return stats
+
+    @staticmethod
+    async def get_lap_stats(session_id: str, lap_number: int, attributes: List[str], db: AsyncSession) -> Dict[str, Optional[Dict]]:
+        """
+        Get statistics for several attributes in one lap.
+
+        Stats precomputed at ingest are read from lap_channel_stats. Channels
+        ingested before that existed are decoded once, their stats computed for
+        every lap and stored, then answered.
+
+        Returns:
+            Dict of attribute name to stats (None if the attribute is not stored)
+        """
+        rows = (await db.execute(select(LapChannelStats).where(
+            LapChannelStats.session_id == session_id,
+            LapChannelStats.lap_number == lap_number,
+            LapChannelStats.attribute.in_(attributes)
+        ))).scalars().all()
+        result = {row.attribute: StatsService.stats_to_dict(StatsService._row_to_stats(row)) for row in rows}
+
+        missing = [attr for attr in dict.fromkeys(attributes) if attr not in result]
+        if missing:
+            laps = await LapService.get_lap_indices(session_id, db)
+            for attr_name in missing:
+                all_laps = await StatsService._backfill_channel(session_id, attr_name, laps, db)
+                result[attr_name] = next(
+                    (StatsService.stats_to_dict(stats) for stats in all_laps if stats['lap_number'] == lap_number),
+                    None
+                ) if all_laps is not None else None
+
+        return {attr: result[attr] for attr in attributes}
+
+    @staticmethod
+    async def get_laps_stats(
+        session_id: str,
+        laps: List[Dict],
+        attributes: List[str],
+        db: AsyncSession,
+        lap_numbers: Optional[List[int]] = None
+    ) -> Dict[int, Dict[str, Optional[Dict]]]:
+        """
+        Get statistics for several attributes in several laps.
+
+        Stored stats for every lap and attribute are read with one query. A
+        channel missing stats for any of the laps is decoded once and
+        backfilled for every lap of the session, so each channel costs at most
+        one decode however many laps are asked for.
+
+        Args:
+            laps: Every lap of the session (see LapService.get_lap_indices)
+            lap_numbers: Laps to return (default: all)
+
+        Returns:
+            Dict of lap number to a dict of attribute name to stats (None if
+            the attribute is not stored), in lap and attribute order
+        """
+        attributes = list(dict.fromkeys(attributes))
+        if lap_numbers is None:
+            lap_numbers = [lap['lap_number'] for lap in laps]
+        result = {lap_number: {} for lap_number in lap_numbers}
+        if not result or not attributes:
+            return result
+
+        statement = select(LapChannelStats).where(
+            LapChannelStats.session_id == session_id,
+            LapChannelStats.attribute.in_(attributes)
+        )
+        if len(result) < len(laps):
+            statement = statement.where(LapChannelStats.lap_number.in_(list(result)))
+        for row in (await db.execute(statement)).scalars().all():
+            if row.lap_number in result:
+                result[row.lap_number][row.attribute] = StatsService.stats_to_dict(StatsService._row_to_stats(row))
+
+        missing = [attr for attr in attributes if any(attr not in lap_stats for lap_stats in result.values())]
+        for attr_name in missing:
+            all_laps = await StatsService._backfill_channel(session_id, attr_name, laps, db)
+            by_lap = {stats['lap_number']: stats for stats in all_laps or []}
+            for lap_number, lap_stats in result.items():
+                stats = by_lap.get(lap_number)
+                lap_stats[attr_name] = StatsService.stats_to_dict(stats) if stats is not None else None
+
+        return {
+            lap_number: {attr: lap_stats[attr] for attr in attributes}
+            for lap_number, lap_stats in result.items()
+        }
+
+    @staticmethod
+    def stats_to_dict(stats: Dict) -> Dict:
+        """Serialize lap stats (as returned by compute_lap_stats) for API responses."""
+        count = stats['sample_count']
+        if not count:
+            return {
+                "average": None,
+                "min": None,
+                "max": None,
+                "stddev": None,
+                "p50": None,
+                "p95": None,
+                "sample_count": 0
+            }
+
+        average = stats['value_sum'] / count
+        variance = max(stats['value_sum_sq'] / count - average * average, 0.0)
+        return {
+            "average": average,
+            "min": stats['value_min'],
+            "max": stats['value_max'],
+            "stddev": variance ** 0.5,
+            "p50": stats['p50'],
+            "p95": stats['p95'],
+            "sample_count": count
+        }
+
+    @staticmethod
+    async def invalidate_for_lap_delete(session_id: str, lap_number: int, db: AsyncSession):
+        """
+        Drop the stats of a lap deleted from every channel of a session.
+
+        The other laps keep their samples, so their stats stay valid. The
+        caller commits.
+        """
+        await db.execute(delete(LapChannelStats).where(
+            LapChannelStats.session_id == session_id,
+            LapChannelStats.lap_number == lap_number
+        ))
+
+    @staticmethod
+    def _row_to_stats(row: LapChannelStats) -> Dict:
+        return {
+            'lap_number': row.lap_number,
+            'sample_count': row.sample_count,
+            'value_sum': row.value_sum,
+            'value_sum_sq': row.value_sum_sq,
+            'value_min': row.value_min,
+            'value_max': row.value_max,
+            'p50': row.p50,
+            'p95': row.p95
+        }
+
+    @staticmethod
+    async def _backfill_channel(session_id: str, attribute: str, laps: List[Dict], db: AsyncSession) -> Optional[List[Dict]]:
+        """
+        Compute and store stats for every lap of a channel missing some.
+
+        Laps that still have stats (a lap delete only drops the deleted lap's)
+        get the same values again, so one upsert stores them all.
+        """
+        try:
+            values = await ChannelService.read_channel(session_id, attribute, db)
+        except ValueError as e:
+            raise ValueError(f"Failed to parse attribute '{attribute}': {str(e)}")
+
+        if values is None:
+            return None
+
+        # The per-lap reductions are CPU-bound; run them in a compute worker
+        lap_stats = await ComputePool.run(StatsService.compute_lap_stats, values, laps)
+        if lap_stats:
+            insert = mysql_insert(LapChannelStats.__table__).values([
+                {"session_id": session_id, "attribute": attribute, **stats}
+                for stats in lap_stats
+            ])
+            # Also settles a concurrent backfill of the same channel
+            await db.execute(insert.on_duplicate_key_update({
+                column: insert.inserted[column] for column in STATS_COLUMNS
+            }))
+            await db.commit()
+        return lap_stats
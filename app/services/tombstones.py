@@ -0,0 +1,57 @@
+"""Tombstone masks: sample ranges deleted from stored channels but still in their values.
+
+Deleting a lap's samples does not rewrite the channels. Each channel gets
+tombstones instead (channel_tombstone rows): ranges of positions in its
+stored value, inclusive, sorted and disjoint. Every read applies them, so
+readers see the channel as if the samples had been removed, and value_len is
+the length readers see. The compaction job (services.compaction_service)
+later rewrites the value without them and drops the tombstones, which leaves
+what readers see unchanged.
+"""
+from typing import List, Tuple
+import numpy as np
+from services.channel_codec import decode_channel
+
+def physical_ranges(tombstones: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Stored positions of samples [start, end] of a channel as readers see it.
+
+    Samples on both sides of an existing tombstone map to two ranges.
+
+    Args:
+        tombstones: The channel's tombstones, sorted by start
+        start: First sample as seen by readers
+        end: Last sample as seen by readers (inclusive, within the channel)
+
+    Returns:
+        Sorted ranges of stored positions, none overlapping a tombstone
+    """
+    ranges = []
+    if start > end:
+        return ranges
+    shift = 0
+    for tomb_start, tomb_end in tombstones:
+        # Readers' samples before this tombstone are stored shift positions later
+        last_before = tomb_start - shift - 1
+        if start <= last_before:
+            piece_end = min(end, last_before)
+            ranges.append((start + shift, piece_end + shift))
+            start = piece_end + 1
+            if start > end:
+                return ranges
+        shift += tomb_end - tomb_start + 1
+    ranges.append((start + shift, end + shift))
+    return ranges
+
+def apply_tombstones(values: np.ndarray, tombstones: List[Tuple[int, int]]) -> np.ndarray:
+    """Decoded stored samples without the tombstoned positions."""
+    if not tombstones:
+        return values
+    keep = np.ones(values.shape[0], dtype=bool)
+    for start, end in tombstones:
+        keep[start:end + 1] = False
+    return values[keep]
+
+def decode_masked(value, tombstones: List[Tuple[int, int]]) -> np.ndarray:
+    """decode_channel followed by apply_tombstones (for compute workers)."""
+    return apply_tombstones(decode_channel(value), tombstones)
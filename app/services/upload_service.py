@@ -0,0 +1,201 @@
+"""Streaming receipt of multipart .ibt uploads."""
+import os
+import struct
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from config import settings
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# IBT files start with the irsdk header (48 bytes, then var buffer descriptors)
+# followed by the disk sub-header at offset 112; together they fill 144 bytes.
+IBT_HEADER_STRUCT = struct.Struct('<10i')
+IBT_DISK_HEADER_STRUCT = struct.Struct('<Qddii')
+IBT_DISK_HEADER_OFFSET = 112
+IBT_HEADER_LEN = IBT_DISK_HEADER_OFFSET + IBT_DISK_HEADER_STRUCT.size
+IBT_VERSIONS = (1, 2)
+
+FILE_FIELD = "telemetry_file"
+MAX_FIELD_BYTES = 64 * 1024
+
+class UploadRejected(Exception):
+    """Raised while receiving an upload that must be refused."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@dataclass
+class ReceivedUpload:
+    """Result of streaming a multipart upload to disk."""
+    file_path: str
+    file_name: Optional[str] = None
+    content_hash: Optional[str] = None
+    size: int = 0
+    fields: Dict[str, str] = field(default_factory=dict)
+
+def validate_ibt_header(data: bytes):
+    """
+    Check that the first bytes of a file look like an IBT header.
+
+    IBT files have no magic number, so the header version and the sanity of the
+    offsets and counts it declares are checked instead.
+
+    Raises:
+        UploadRejected: If the header is not a plausible IBT header
+    """
+    if len(data) < IBT_HEADER_LEN:
+        raise UploadRejected(400, "File is too small to be an .ibt file")
+
+    (version, _status, tick_rate, _session_info_update, session_info_len, session_info_offset,
+     num_vars, var_header_offset, num_buf, buf_len) = IBT_HEADER_STRUCT.unpack_from(data, 0)
+    _start_date, _start_time, _end_time, _lap_count, record_count = \
+        IBT_DISK_HEADER_STRUCT.unpack_from(data, IBT_DISK_HEADER_OFFSET)
+
+    if (
+        version not in IBT_VERSIONS
+        or not 0 < tick_rate <= 1000
+        or not 0 < num_vars <= 10000
+        or var_header_offset < IBT_HEADER_LEN
+        or session_info_offset < IBT_HEADER_LEN
+        or session_info_len <= 0
+        or not 0 < num_buf <= 4
+        or buf_len <= 0
+        or record_count < 0
+    ):
+        raise UploadRejected(400, "Invalid file contents. Not an iRacing .ibt telemetry file")
+
+async def receive_ibt_upload(request: Request, file_path: str) -> ReceivedUpload:
+    """
+    Stream a multipart/form-data upload straight to disk.
+
+    The request body is parsed as it arrives: the `telemetry_file` part is
+    written to file_path in fixed-size chunks while its SHA-256 is computed,
+    its IBT header is checked as soon as the first bytes arrive, and the
+    upload is refused once it exceeds settings.upload_max_bytes. Other form
+    fields are collected as strings. Received data is parsed, hashed and
+    written in the threadpool, settings.upload_chunk_size bytes at a time,
+    so large uploads never block the event loop.
+
+    Args:
+        request: Incoming request with a multipart/form-data body
+        file_path: Destination for the uploaded file
+
+    Returns:
+        The received upload
+
+    Raises:
+        UploadRejected: If the upload is malformed, too large or not an .ibt file
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.upload_max_bytes:
+        raise UploadRejected(413, f"Upload exceeds the maximum size of {settings.upload_max_bytes} bytes")
+
+    upload = ReceivedUpload(file_path=file_path)
+    hasher = hashlib.sha256()
+    state = {"headers": {}, "header_field": b"", "header_value": b"", "name": None, "value": None, "file": None}
+    head = bytearray()
+    header_checked = False
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if state["name"] == FILE_FIELD:
+            if upload.file_name is not None:
+                raise UploadRejected(400, "Only one telemetry_file may be uploaded")
+            upload.file_name = disposition.get(b"filename", b"").decode("utf-8", "replace")
+            if not upload.file_name.lower().endswith(".ibt"):
+                raise UploadRejected(400, "Invalid file type. Only .ibt files are allowed")
+            state["file"] = open(file_path, "wb", buffering=settings.upload_chunk_size)
+        else:
+            state["value"] = bytearray()
+
+    def on_part_data(data, start, end):
+        nonlocal header_checked
+        chunk = data[start:end]
+        if state["file"] is None:
+            if len(state["value"]) + len(chunk) > MAX_FIELD_BYTES:
+                raise UploadRejected(400, f"Form field '{state['name']}' is too large")
+            state["value"] += chunk
+            return
+
+        upload.size += len(chunk)
+        if upload.size > settings.upload_max_bytes:
+            raise UploadRejected(413, f"Upload exceeds the maximum size of {settings.upload_max_bytes} bytes")
+        if not header_checked:
+            head.extend(chunk[:IBT_HEADER_LEN - len(head)])
+            if len(head) >= IBT_HEADER_LEN:
+                validate_ibt_header(bytes(head))
+                header_checked = True
+        hasher.update(chunk)
+        state["file"].write(chunk)
+
+    def on_part_end():
+        if state["file"] is not None:
+            state["file"].close()
+            state["file"] = None
+        elif state["value"] is not None:
+            upload.fields[state["name"]] = state["value"].decode("utf-8", "replace")
+        state["headers"] = {}
+        state["value"] = None
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        try:
+            pending = bytearray()
+            async for chunk in request.stream():
+                pending += chunk
+                if len(pending) >= settings.upload_chunk_size:
+                    data, pending = pending, bytearray()
+                    await run_in_threadpool(parser.write, data)
+            if pending:
+                await run_in_threadpool(parser.write, pending)
+            await run_in_threadpool(parser.finalize)
+        except UploadRejected:
+            raise
+        except ValueError as e:
+            raise UploadRejected(400, f"Malformed multipart upload: {str(e)}")
+
+        if upload.file_name is None:
+            raise UploadRejected(400, "No telemetry_file was uploaded")
+        if not header_checked:
+            validate_ibt_header(bytes(head))
+    except Exception:
+        if state["file"] is not None:
+            state["file"].close()
+        if os.path.exists(file_path):
+            os.unlink(file_path)
+        raise
+
+    upload.content_hash = hasher.hexdigest()
+    return upload
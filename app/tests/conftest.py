@@ -0,0 +1,124 @@
+"""Test fixtures: the app and its services against a throwaway SQLite database.
+
+The models use MySQL column types and ingest upserts with ON DUPLICATE KEY
+UPDATE; both are compiled to their SQLite equivalents here, and the database
+module is pointed at SQLite before any service imports its engines.
+"""
+import os
+import sys
+import tempfile
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.dialects.mysql import MEDIUMBLOB, DOUBLE, INTEGER, SMALLINT
+from sqlalchemy.dialects.mysql.dml import OnDuplicateClause
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="telemetry-tests-")
+os.environ.setdefault("ANALYTICS_DIR", os.path.join(_tmp_dir, "analytics"))
+os.environ.setdefault("INGEST_SPOOL_DIR", os.path.join(_tmp_dir, "spool"))
+os.environ.setdefault("SESSION_INFO_CACHE_DIR", os.path.join(_tmp_dir, "session-info-cache"))
+
+@compiles(MEDIUMBLOB, "sqlite")
+def _compile_mediumblob(type_, compiler, **kw):
+    return "BLOB"
+
+@compiles(DOUBLE, "sqlite")
+def _compile_double(type_, compiler, **kw):
+    return "REAL"
+
+@compiles(INTEGER, "sqlite")
+@compiles(SMALLINT, "sqlite")
+def _compile_integer(type_, compiler, **kw):
+    return "INTEGER"
+
+@compiles(OnDuplicateClause, "sqlite")
+def _compile_on_duplicate(clause, compiler, **kw):
+    columns = [column if isinstance(column, str) else column.name for column in clause.update]
+    return "ON CONFLICT DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in columns)
+
+import database
+
+_db_url = os.path.join(_tmp_dir, "test.db")
+database.engine = create_engine(f"sqlite:///{_db_url}")
+database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+# Every TestClient and asyncio.run has its own event loop; do not pool connections across them
+database.async_engine = create_async_engine(f"sqlite+aiosqlite:///{_db_url}", poolclass=NullPool)
+database.AsyncSessionLocal = async_sessionmaker(database.async_engine, autoflush=False, expire_on_commit=False)
+
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+event.listen(database.engine, "connect", _enable_foreign_keys)
+event.listen(database.async_engine.sync_engine, "connect", _enable_foreign_keys)
+
+import numpy as np
+import main
+import auth_helpers
+import iRacingTelemetry.add_telemetry as add_telemetry
+from fastapi.testclient import TestClient
+from models import Base, SessionInfo, Driver, AttributeValue, Lap
+from services.channel_codec import encode_channel, describe_channel
+from services.channel_cache import ChannelCache
+
+# SQLite has no max_allowed_packet
+add_telemetry._max_allowed_packet = 64 * 1024 * 1024
+
+@pytest.fixture
+def db():
+    """An empty database; yields a sync session for arranging data."""
+    Base.metadata.drop_all(database.engine)
+    Base.metadata.create_all(database.engine)
+    ChannelCache.clear()
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def client(db):
+    """The API on the empty database, authenticated."""
+    main.app.dependency_overrides[auth_helpers.get_current_user] = lambda: {"sub": "test"}
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.clear()
+
+@pytest.fixture
+def add_session(db):
+    """
+    Store a session the way ingest does: its channels, and laps computed from
+    the Lap, SessionTime, PlayerIncidents and LapCurrentLapTime channels.
+    """
+    def add(session_id, channels, drivers=(), player_driver_user_id=None, **session_fields):
+        session_info = {
+            "session_id": session_id,
+            "track_id": 1,
+            "track_config": "Grand Prix",
+            "session_date": "2024-01-01",
+            "player_driver_user_id": player_driver_user_id,
+            **session_fields
+        }
+        drivers = [{"session_id": session_id, **driver} for driver in drivers]
+        db.add(SessionInfo(**session_info))
+        db.add_all([Driver(**driver) for driver in drivers])
+        for attribute, values in channels.items():
+            values = np.asarray(values)
+            db.add(AttributeValue(
+                session_id=session_id,
+                attribute=attribute,
+                value=encode_channel(values),
+                value_len=len(values),
+                **describe_channel(values)
+            ))
+        db.add_all([
+            Lap(**lap)
+            for lap in add_telemetry.get_lap_data(session_id, channels, session_info, drivers)
+        ])
+        db.commit()
+    return add
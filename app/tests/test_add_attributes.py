@@ -0,0 +1,29 @@
+"""Adding channels extracted from a session's .ibt file to the stored session."""
+import numpy as np
+import pytest
+from models import AttributeValue, LapChannelStats
+from iRacingTelemetry.add_telemetry import add_attributes
+
+SAMPLES = 300
+
+def _session(add_session):
+    add_session("s1", {
+        "Lap": np.repeat(np.arange(1, 4, dtype=np.int32), SAMPLES // 3),
+        "SessionTime": np.arange(SAMPLES, dtype=np.float64) / 60.0,
+    })
+
+def test_adds_channel_with_lap_stats(add_session, db):
+    _session(add_session)
+    added = add_attributes("s1", {"telemetry": {"Speed": np.arange(SAMPLES, dtype=np.float32)}})
+
+    assert added == ["Speed"]
+    assert db.get(AttributeValue, ("s1", "Speed")).value_len == SAMPLES
+    assert db.query(LapChannelStats).filter(LapChannelStats.attribute == "Speed").count() == 3
+
+def test_rejects_channels_once_a_lap_was_deleted(client, add_session, db):
+    _session(add_session)
+    assert client.delete("/sessions/s1/laps/2").status_code == 200
+
+    with pytest.raises(ValueError, match="laps deleted"):
+        add_attributes("s1", {"telemetry": {"Speed": np.arange(SAMPLES, dtype=np.float32)}})
+    assert db.get(AttributeValue, ("s1", "Speed")) is None
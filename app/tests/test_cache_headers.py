@@ -0,0 +1,35 @@
+"""Conditional GETs of a session's data."""
+import numpy as np
+
+def _session(add_session):
+    add_session("s1", {
+        "Lap": np.repeat(np.arange(1, 4, dtype=np.int32), 10),
+        "SessionTime": np.arange(30, dtype=np.float64) / 60.0,
+    })
+
+def test_matching_etag_is_not_modified(client, add_session):
+    _session(add_session)
+    response = client.get("/sessions/s1/laps")
+    etag = response.headers["ETag"]
+
+    assert client.get("/sessions/s1/laps", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/sessions/s1/laps", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    # Another representation of the session has another ETag
+    assert client.get("/sessions/s1", headers={"If-None-Match": etag}).status_code == 200
+
+def test_lap_delete_changes_the_etag(client, add_session):
+    _session(add_session)
+    etag = client.get("/sessions/s1/laps").headers["ETag"]
+
+    assert client.delete("/sessions/s1/laps/2").status_code == 200
+
+    response = client.get("/sessions/s1/laps", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [lap["lap_number"] for lap in response.json()["laps"]] == [1, 3]
+
+def test_unknown_session_is_not_cached(client, db):
+    response = client.get("/sessions/missing/laps")
+
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
@@ -0,0 +1,76 @@
+"""Binary channel storage format."""
+import json
+import numpy as np
+import pytest
+from services.channel_codec import (
+    HEADER_LEN, VAR_TYPE_BOOL, VAR_TYPE_CHAR, VAR_TYPE_DOUBLE, VAR_TYPE_FLOAT, VAR_TYPE_INT,
+    encode_channel, decode_channel, decode_header, decode_samples, sample_range, describe_channel
+)
+
+@pytest.mark.parametrize("values, var_type", [
+    (np.array([0.5, -1.25, np.nan, 3.0e6], dtype=np.float32), VAR_TYPE_FLOAT),
+    (np.array([1e-300, 2.0, -7.5], dtype=np.float64), VAR_TYPE_DOUBLE),
+    (np.array([-3, 0, 2 ** 31 - 1], dtype=np.int32), VAR_TYPE_INT),
+    (np.array([True, False, True]), VAR_TYPE_BOOL),
+    (np.array([b"a", b"b"]), VAR_TYPE_CHAR),
+])
+def test_round_trip_keeps_samples_and_type(values, var_type):
+    blob = encode_channel(values)
+
+    assert decode_header(blob).var_type == var_type
+    decoded = decode_channel(blob)
+    expected = values.view(np.uint8) if values.dtype.kind == "S" else values
+    np.testing.assert_array_equal(decoded, expected)
+    assert len(blob) == HEADER_LEN + expected.nbytes
+
+def test_round_trip_of_array_variables():
+    values = np.arange(12, dtype=np.float32).reshape(4, 3)
+
+    blob = encode_channel(values)
+
+    header = decode_header(blob)
+    assert (header.length, header.count) == (4, 3)
+    np.testing.assert_array_equal(decode_channel(blob), values)
+
+def test_explicit_var_type_converts_the_samples():
+    blob = encode_channel([1, 2, 3], VAR_TYPE_FLOAT)
+
+    decoded = decode_channel(blob)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, [1.0, 2.0, 3.0])
+
+def test_sample_range_reads_only_the_requested_samples():
+    values = np.arange(100, dtype=np.float64)
+    blob = encode_channel(values)
+    header = decode_header(blob)
+
+    offset, length = sample_range(header, 10, 19)
+    np.testing.assert_array_equal(decode_samples(header, blob[offset:offset + length]), values[10:20])
+
+    # Clamped to the channel
+    offset, length = sample_range(header, 95, 200)
+    np.testing.assert_array_equal(decode_samples(header, blob[offset:offset + length]), values[95:])
+
+def test_legacy_json_values_are_decoded():
+    decoded = decode_channel(json.dumps([1, 2, 3]))
+    assert decoded.dtype == np.int32
+    np.testing.assert_array_equal(decoded, [1, 2, 3])
+
+    decoded = decode_channel(json.dumps([0.5, 1.5]).encode())
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, [0.5, 1.5])
+
+def test_unknown_format_is_rejected():
+    blob = bytearray(encode_channel([1.0]))
+    blob[4] = 99  # format version
+
+    with pytest.raises(ValueError):
+        decode_channel(bytes(blob))
+
+def test_describe_channel_ignores_non_finite_values():
+    described = describe_channel(np.array([np.nan, 2.0, -1.0, np.inf], dtype=np.float32), "m/s")
+
+    assert (described["value_min"], described["value_max"]) == (-1.0, 2.0)
+    assert described["dtype"] == "<f4"
+    assert described["values_per_sample"] == 1
+    assert described["units"] == "m/s"
@@ -0,0 +1,136 @@
+"""Lap deletes through tombstones and their compaction."""
+import asyncio
+import numpy as np
+import database
+from models import AttributeValue, ChannelTombstone, Lap
+from services.compaction_service import CompactionService
+from services.lap_service import LapService
+
+LAP_SAMPLES = 100
+ARRAY = {"Accept": "application/json; layout=array"}
+
+def _channels():
+    lap = np.repeat(np.arange(1, 6, dtype=np.int32), LAP_SAMPLES)
+    return {
+        "Lap": lap,
+        "SessionTime": np.arange(lap.size, dtype=np.float64) / 60.0,
+        "LapCurrentLapTime": np.tile(np.arange(LAP_SAMPLES, dtype=np.float32) / 60.0, 5),
+        "Speed": np.arange(lap.size, dtype=np.float32),
+        "RPM": np.arange(lap.size, dtype=np.float32) * 10.0,
+    }
+
+def _compact():
+    async def compact():
+        async with database.AsyncSessionLocal() as db:
+            return await CompactionService.compact_pending(db)
+    return asyncio.run(compact())
+
+async def _get_lap(session_id, lap_number):
+    async with database.AsyncSessionLocal() as db:
+        return await LapService.get_lap(session_id, lap_number, db)
+
+def _lap_values(client, lap_number, attribute):
+    response = client.get(f"/sessions/s1/laps/{lap_number}?attribute={attribute}", headers=ARRAY)
+    assert response.status_code == 200
+    return response.json()["values"]
+
+def test_delete_then_compact_keeps_later_laps(client, add_session, db):
+    add_session("s1", _channels())
+    before = {attribute: _lap_values(client, 3, attribute) for attribute in ("Lap", "Speed", "RPM")}
+
+    response = client.delete("/sessions/s1/laps/2")
+    assert response.status_code == 200
+    assert response.json()["data_points_deleted"] == 5 * LAP_SAMPLES
+
+    laps = client.get("/sessions/s1/laps").json()["laps"]
+    assert [lap["lap_number"] for lap in laps] == [1, 3, 4, 5]
+    assert laps[1]["start_index"] == LAP_SAMPLES
+    for attribute, values in before.items():
+        assert _lap_values(client, 3, attribute) == values
+
+    assert _compact() == ["s1"]
+    assert db.query(ChannelTombstone).count() == 0
+    assert {row.value_len for row in db.query(AttributeValue).all()} == {4 * LAP_SAMPLES}
+    assert client.get("/sessions/s1/laps").json()["laps"] == laps
+    for attribute, values in before.items():
+        assert _lap_values(client, 3, attribute) == values
+
+    speed = client.get("/telemetry/s1/attributes/Speed", headers=ARRAY).json()["values"]
+    expected = np.delete(np.arange(5 * LAP_SAMPLES), np.s_[LAP_SAMPLES:2 * LAP_SAMPLES])
+    assert speed == expected.tolist()
+
+def test_partial_attribute_delete_is_rejected(client, add_session, db):
+    add_session("s1", _channels())
+    before = _lap_values(client, 3, "Speed")
+
+    response = client.delete("/sessions/s1/laps/2?attribute=Speed")
+    assert response.status_code == 400
+    assert db.query(ChannelTombstone).count() == 0
+
+    assert _compact() == []
+    assert _lap_values(client, 3, "Speed") == before
+    assert [lap["lap_number"] for lap in client.get("/sessions/s1/laps").json()["laps"]] == [1, 2, 3, 4, 5]
+
+def test_rebuilt_laps_keep_the_player_driver(client, add_session, db):
+    drivers = [
+        {"driver_user_id": 42, "driver_name": "A", "car_name": "Mazda MX-5"},
+        {"driver_user_id": 43, "driver_name": "B", "car_name": "Porsche 911 GT3"},
+    ]
+    add_session("s1", _channels(), drivers=drivers, player_driver_user_id=43)
+    assert client.delete("/sessions/s1/laps/2").status_code == 200
+    # Laps that drifted from the Lap channel are rebuilt from it
+    db.query(Lap).filter(Lap.lap_number == 4).update({Lap.end_index: Lap.end_index - 1})
+    db.commit()
+
+    assert _compact() == ["s1"]
+    db.expire_all()
+    laps = db.query(Lap).order_by(Lap.start_index).all()
+    assert [lap.lap_number for lap in laps] == [1, 3, 4, 5]
+    assert {(lap.driver_user_id, lap.car_name) for lap in laps} == {(43, "Porsche 911 GT3")}
+    leaderboard = client.get("/leaderboard/?track_id=1&car_name=Porsche%20911%20GT3").json()
+    assert [lap["lap_number"] for lap in leaderboard["laps"]]
+
+def test_repeated_delete_finds_no_lap_and_shifts_nothing(client, add_session, db, monkeypatch):
+    add_session("s1", _channels())
+    stale = asyncio.run(_get_lap("s1", 2))
+    assert client.delete("/sessions/s1/laps/2").status_code == 200
+    laps = client.get("/sessions/s1/laps").json()["laps"]
+    tombstones = db.query(ChannelTombstone).count()
+
+    assert client.delete("/sessions/s1/laps/2").status_code == 404
+    # A delete that read the lap before the first one committed
+    async def get_lap(session_id, lap_number, db, include_incidents=False):
+        return stale
+    monkeypatch.setattr(LapService, "get_lap", staticmethod(get_lap))
+    assert client.delete("/sessions/s1/laps/2").status_code == 404
+
+    assert db.query(ChannelTombstone).count() == tombstones
+    assert client.get("/sessions/s1/laps").json()["laps"] == laps
+
+def test_rebuilt_laps_are_not_timed_across_a_deleted_lap(client, add_session, db):
+    add_session("s1", _channels())
+    lap_time = db.get(Lap, ("s1", 1)).lap_time
+    assert client.delete("/sessions/s1/laps/2").status_code == 200
+    # Force a rebuild: laps that drifted from the Lap channel are recomputed
+    db.query(Lap).filter(Lap.lap_number == 1).update({Lap.sample_count: Lap.sample_count - 1})
+    db.query(Lap).filter(Lap.lap_number == 4).update({Lap.end_index: Lap.end_index - 1})
+    db.commit()
+
+    assert _compact() == ["s1"]
+    db.expire_all()
+    first = db.get(Lap, ("s1", 1))
+    # Lap 1 now runs right into lap 3; it is timed across the gap but can no longer count as complete
+    assert first.lap_time > lap_time and first.complete is False
+
+def test_unchanged_laps_keep_their_times_after_a_rebuild(client, add_session, db):
+    add_session("s1", _channels())
+    before = {lap.lap_number: (lap.lap_time, lap.complete, lap.valid) for lap in db.query(Lap).all()}
+    assert client.delete("/sessions/s1/laps/2").status_code == 200
+    db.query(Lap).filter(Lap.lap_number == 4).update({Lap.end_index: Lap.end_index - 1})
+    db.commit()
+
+    assert _compact() == ["s1"]
+    db.expire_all()
+    after = {lap.lap_number: (lap.lap_time, lap.complete, lap.valid) for lap in db.query(Lap).all()}
+    assert after == {lap_number: before[lap_number] for lap_number in (1, 3, 4, 5)}
+    assert before[1][1] is True
@@ -0,0 +1,54 @@
+"""Distance-aligned lap comparison across sessions."""
+import numpy as np
+import pytest
+
+def _channels():
+    lap = np.repeat(np.arange(1, 4, dtype=np.int32), 100)
+    return {
+        "Lap": lap,
+        "LapDistPct": np.tile(np.linspace(0.0, 0.99, 100, dtype=np.float32), 3),
+        "SessionTime": np.arange(lap.size, dtype=np.float64) / 60.0,
+        "Speed": np.arange(lap.size, dtype=np.float32),
+    }
+
+def test_compares_laps_at_the_same_track_and_config(client, add_session):
+    add_session("s1", _channels())
+    add_session("s2", _channels())
+
+    response = client.get("/sessions/compare?lap=s1:2&lap=s2:2&attribute=Speed&points=50")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["track_id"], body["track_config"]) == (1, "Grand Prix")
+    assert [lap["session_id"] for lap in body["laps"]] == ["s1", "s2"]
+    assert body["laps"][0]["channels"]["Speed"] == body["laps"][1]["channels"]["Speed"]
+
+def test_rejects_laps_from_another_config(client, add_session):
+    add_session("s1", _channels())
+    add_session("s2", _channels(), track_config="National")
+
+    response = client.get("/sessions/compare?lap=s1:2&lap=s2:2&attribute=Speed")
+
+    assert response.status_code == 400
+
+def test_elapsed_time_starts_at_the_first_sample_of_the_lap(client, add_session):
+    channels = _channels()
+    # Lap 2 starts three samples before the line, still at the end of the previous lap
+    channels["LapDistPct"][100:103] = 0.995
+    channels["LapDistPct"][103:200] = np.linspace(0.0, 0.99, 97, dtype=np.float32)
+    add_session("s1", channels)
+
+    response = client.get("/sessions/compare?lap=s1:2&attribute=Speed&points=50")
+
+    assert response.status_code == 200
+    assert response.json()["laps"][0]["time"][0] == pytest.approx(3 / 60.0)
+
+def test_lap_dist_pct_is_required(client, add_session):
+    channels = _channels()
+    del channels["LapDistPct"]
+    add_session("s1", channels)
+
+    response = client.get("/sessions/compare?lap=s1:2&attribute=Speed")
+
+    assert response.status_code == 400
+    assert "LapDistPct" in response.json()["detail"]
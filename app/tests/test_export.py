@@ -0,0 +1,40 @@
+"""Chunked downloads of stored channels."""
+import asyncio
+import io
+import numpy as np
+import pytest
+import database
+from config import settings
+from models import SessionInfo
+from services.export_service import ExportService, ChannelChanged
+
+SAMPLES = 1000
+
+@pytest.fixture
+def session(add_session, monkeypatch):
+    monkeypatch.setattr(settings, "export_chunk_samples", 64)
+    add_session("s1", {
+        "Lap": np.repeat(np.arange(1, 5, dtype=np.int32), SAMPLES // 4),
+        "Speed": np.arange(SAMPLES, dtype=np.float32),
+    })
+
+def test_npy_download_is_the_whole_channel(client, session):
+    response = client.get("/telemetry/s1/attributes/Speed", headers={"Accept": "application/x-npy"})
+
+    assert response.status_code == 200
+    np.testing.assert_array_equal(np.load(io.BytesIO(response.content)), np.arange(SAMPLES, dtype=np.float32))
+
+def test_chunk_reads_fail_once_the_session_changed(session, db):
+    async def read_after_change():
+        async with database.AsyncSessionLocal() as session_db:
+            channel = (await ExportService.open_channels("s1", ["Speed"], session_db))["Speed"]
+            first = await channel.read(0, 64, session_db)
+        db.query(SessionInfo).update({SessionInfo.data_version: SessionInfo.data_version + 1})
+        db.commit()
+        async with database.AsyncSessionLocal() as session_db:
+            with pytest.raises(ChannelChanged):
+                await channel.read(64, 64, session_db)
+        return first
+
+    first = asyncio.run(read_after_change())
+    np.testing.assert_array_equal(np.frombuffer(first, dtype=np.float32), np.arange(64, dtype=np.float32))
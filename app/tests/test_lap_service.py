@@ -0,0 +1,47 @@
+"""Lap boundaries, times and flags computed from the raw channels."""
+import numpy as np
+from services.lap_service import LapService
+
+def test_laps_run_until_the_next_lap_starts():
+    # Samples with lap 0 (out lap / cooldown) belong to the lap before them
+    lap_data = np.array([0, 0, 1, 1, 1, 2, 2, 0, 3, 3], dtype=np.int32)
+
+    laps = LapService.compute_laps(lap_data)
+
+    assert [(lap['lap_number'], lap['start_index'], lap['end_index'], lap['sample_count']) for lap in laps] == [
+        (1, 2, 4, 3), (2, 5, 7, 3), (3, 8, 9, 2)
+    ]
+    assert all(lap['lap_time'] is None and lap['incidents'] is None for lap in laps)
+
+def test_lap_time_ends_at_the_first_sample_of_the_next_lap():
+    lap_data = np.array([1, 1, 2, 2, 2, 3], dtype=np.int32)
+    session_time = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+
+    laps = LapService.compute_laps(lap_data, session_time)
+
+    assert [lap['lap_time'] for lap in laps] == [2.0, 3.0, 0.0]
+
+def test_only_laps_without_incidents_are_valid():
+    lap_data = np.array([1, 1, 2, 2, 3, 3], dtype=np.int32)
+    incidents = np.array([0, 0, 0, 1, 0, 0], dtype=np.int32)
+
+    laps = LapService.compute_laps(lap_data, incident_data=incidents)
+
+    assert [(lap['incidents'], lap['valid']) for lap in laps] == [(0, True), (1, False), (0, True)]
+
+def test_last_lap_and_a_first_lap_started_mid_track_are_not_complete():
+    lap_data = np.array([1, 1, 2, 2, 3, 3], dtype=np.int32)
+    session_time = np.arange(6, dtype=np.float64)
+
+    from_line = LapService.compute_laps(lap_data, session_time, lap_time_data=np.array([0.1, 1.1, 0.0, 1.0, 0.0, 1.0]))
+    mid_lap = LapService.compute_laps(lap_data, session_time, lap_time_data=np.array([42.0, 43.0, 0.0, 1.0, 0.0, 1.0]))
+    without_lap_time = LapService.compute_laps(lap_data, session_time)
+
+    assert [lap['complete'] for lap in from_line] == [True, True, False]
+    assert [lap['complete'] for lap in mid_lap] == [False, True, False]
+    assert [lap['complete'] for lap in without_lap_time] == [False, True, False]
+    # Completeness does not affect validity
+    assert all(lap['valid'] for lap in mid_lap)
+
+def test_no_laps_without_a_positive_lap_number():
+    assert LapService.compute_laps(np.zeros(5, dtype=np.int32)) == []
@@ -0,0 +1,43 @@
+"""Session listing with keyset pagination."""
+import numpy as np
+import pytest
+from services.session_service import SessionService
+
+def _channels():
+    return {"Lap": np.repeat(np.arange(1, 3, dtype=np.int32), 5)}
+
+def test_cursor_round_trip():
+    for session_date, session_id in (("2024-03-01", "s1"), (None, "s2")):
+        cursor = SessionService._encode_cursor(session_date, session_id)
+        assert "=" not in cursor
+        assert SessionService._decode_cursor(cursor) == (session_date, session_id)
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "WzEsMl0", "eyJhIjoxfQ"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Malformed cursor"):
+        SessionService._decode_cursor(cursor)
+
+def test_pages_follow_next_cursor_newest_first(client, add_session):
+    for session_id, session_date in (("a", "2024-01-01"), ("b", "2024-01-02"), ("c", "2024-01-02"),
+                                     ("d", "2024-01-03"), ("e", None)):
+        add_session(session_id, _channels(), session_date=session_date)
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, "fields": "session_id"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/sessions/", params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["count"] == 5
+        pages.append([session["session_id"] for session in body["sessions"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    # Sessions without a date come last, as MySQL sorts NULLs when descending
+    assert pages == [["d", "c"], ["b", "a"], ["e"]]
+
+def test_bad_cursor_is_a_bad_request(client, db):
+    assert client.get("/sessions/", params={"cursor": "not a cursor"}).status_code == 400
@@ -0,0 +1,34 @@
+"""Host-wide channel cache in memory-mapped files."""
+import errno
+import os
+import numpy as np
+import pytest
+from config import settings
+from services import shared_channel_cache
+from services.shared_channel_cache import SharedChannelCache
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "shared_cache_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "shared_cache_bytes", 1024 * 1024)
+    return tmp_path
+
+def test_cached_channel_is_mapped_read_only(cache_dir):
+    values = np.arange(100, dtype=np.float32)
+
+    cached = SharedChannelCache.put("s1", "Speed", 1, values)
+
+    np.testing.assert_array_equal(cached, values)
+    np.testing.assert_array_equal(SharedChannelCache.get("s1", "Speed", 1), values)
+    assert SharedChannelCache.get("s1", "Speed", 2) is None
+
+def test_failed_write_leaves_no_temporary_file(cache_dir, monkeypatch):
+    def save(*args, **kwargs):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(shared_channel_cache.np, "save", save)
+    values = np.arange(100, dtype=np.float32)
+
+    assert SharedChannelCache.put("s1", "Speed", 1, values) is values
+
+    assert not [name for _, _, names in os.walk(cache_dir) for name in names if name.endswith(".tmp")]
+    assert SharedChannelCache.get("s1", "Speed", 1) is None
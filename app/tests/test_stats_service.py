@@ -0,0 +1,54 @@
+"""Per-lap channel stats: computation and the stored lap_channel_stats rows."""
+import asyncio
+import numpy as np
+import pytest
+import database
+from models import LapChannelStats
+from services.lap_service import LapService
+from services.stats_service import StatsService
+
+def _laps_stats(session_id, attributes):
+    async def read():
+        async with database.AsyncSessionLocal() as db:
+            laps = await LapService.get_lap_indices(session_id, db)
+            return await StatsService.get_laps_stats(session_id, laps, attributes, db)
+    return asyncio.run(read())
+
+def test_backfill_stores_stats_of_laps_missing_them(add_session, db):
+    add_session("s1", {
+        "Lap": np.repeat(np.arange(1, 4, dtype=np.int32), 10),
+        "Speed": np.arange(30, dtype=np.float32),
+    })
+    # Only lap 1 keeps stored stats, as after a lap delete dropped the others
+    db.add(LapChannelStats(session_id="s1", lap_number=1, attribute="Speed", sample_count=10,
+                           value_sum=45.0, value_sum_sq=285.0, value_min=0.0, value_max=9.0, p50=4.5, p95=8.55))
+    db.commit()
+
+    stats = _laps_stats("s1", ["Speed"])
+
+    assert [stats[lap]["Speed"]["average"] for lap in (1, 2, 3)] == [4.5, 14.5, 24.5]
+    stored = db.query(LapChannelStats).filter(LapChannelStats.session_id == "s1").order_by(LapChannelStats.lap_number)
+    assert [(row.lap_number, row.value_sum) for row in stored] == [(1, 45.0), (2, 145.0), (3, 245.0)]
+
+def test_compute_lap_stats_per_lap():
+    laps = [
+        {'lap_number': 1, 'start_index': 0, 'end_index': 3},
+        {'lap_number': 2, 'start_index': 4, 'end_index': 7},
+    ]
+    values = np.array([1.0, 2.0, 3.0, 4.0, 10.0, np.nan, 20.0, np.inf], dtype=np.float32)
+
+    first, second = StatsService.compute_lap_stats(values, laps)
+
+    assert first == {'lap_number': 1, 'sample_count': 4, 'value_sum': 10.0, 'value_sum_sq': 30.0,
+                     'value_min': 1.0, 'value_max': 4.0, 'p50': 2.5, 'p95': pytest.approx(3.85)}
+    # Non-finite samples are ignored
+    assert (second['sample_count'], second['value_sum'], second['value_min'], second['value_max']) == (2, 30.0, 10.0, 20.0)
+    assert second['p50'] == 15.0
+
+def test_compute_lap_stats_of_channels_without_numeric_samples():
+    laps = [{'lap_number': 1, 'start_index': 0, 'end_index': 1}]
+
+    for values in (np.arange(6, dtype=np.float32).reshape(2, 3), np.array([b"a", b"b"]), np.array([np.nan, np.nan])):
+        (stats,) = StatsService.compute_lap_stats(values, laps)
+        assert stats['sample_count'] == 0
+        assert stats['value_sum'] is None and stats['p95'] is None
@@ -0,0 +1,15 @@
+"""Session info cache of the .ibt parser."""
+import os
+from config import settings
+from iRacingTelemetry import telemetry_parser
+
+def test_failed_cache_write_leaves_no_temporary_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "session_info_cache_dir", str(tmp_path))
+    # json.dump fails partway through, after the first keys were written
+    session_info = {"WeekendInfo": {"TrackID": 1}, "DriverInfo": object()}
+
+    telemetry_parser._store_cached_session_info("abc", session_info)
+
+    assert os.listdir(tmp_path) == []
+    # Still served from memory
+    assert telemetry_parser._load_cached_session_info("abc") is session_info
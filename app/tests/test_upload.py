@@ -0,0 +1,48 @@
+"""Streaming .ibt uploads into the ingest spool."""
+import os
+import hashlib
+import pytest
+from config import settings
+from models import IngestJob
+from services.ingest_service import IngestService
+from services.upload_service import IBT_HEADER_STRUCT, IBT_DISK_HEADER_STRUCT, IBT_DISK_HEADER_OFFSET, IBT_HEADER_LEN
+
+def _ibt(body_bytes):
+    header = bytearray(IBT_HEADER_LEN)
+    IBT_HEADER_STRUCT.pack_into(header, 0, 2, 0, 60, 0, 16, IBT_HEADER_LEN, 1, IBT_HEADER_LEN, 1, 4)
+    IBT_DISK_HEADER_STRUCT.pack_into(header, IBT_DISK_HEADER_OFFSET, 0, 0.0, 0.0, 0, 0)
+    return bytes(header) + os.urandom(body_bytes)
+
+@pytest.fixture
+def spool(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "ingest_spool_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "upload_chunk_size", 64 * 1024)
+    monkeypatch.setattr(IngestService, "submit", staticmethod(lambda job_id: None))
+    return str(tmp_path)
+
+def test_upload_is_spooled_with_its_hash(client, db, spool):
+    content = _ibt(1024 * 1024)
+
+    response = client.post(
+        "/telemetry/upload",
+        files={"telemetry_file": ("race.ibt", content, "application/octet-stream")},
+        data={"attributes": "Speed"}
+    )
+
+    assert response.status_code == 202
+    body = response.json()
+    assert body["content_hash"] == hashlib.sha256(content).hexdigest()
+    job = db.get(IngestJob, body["job_id"])
+    assert job.file_size == len(content)
+    with open(job.file_path, "rb") as f:
+        assert f.read() == content
+
+def test_upload_without_ibt_header_is_rejected(client, db, spool):
+    response = client.post(
+        "/telemetry/upload",
+        files={"telemetry_file": ("race.ibt", b"\0" * (2 * IBT_HEADER_LEN), "application/octet-stream")}
+    )
+
+    assert response.status_code == 400
+    assert db.query(IngestJob).count() == 0
+    assert not [name for name in os.listdir(spool) if name.endswith(".ibt")]
@@ -0,0 +1,82 @@
+"""Benchmark cheap endpoint latency while heavy lap queries run concurrently.
+
+Usage:
+    python benchmarks/concurrency.py SESSION_ID [--base-url http://localhost]
+        [--attribute Speed] [--heavy 16] [--seconds 20]
+
+Keeps --heavy concurrent clients fetching every lap of the attribute (lap data
+and lap averages) and meanwhile polls /health and /sessions/{id}. With the
+event loop kept free, the cheap endpoints' p99 should stay close to the p99
+measured without load (the first phase).
+"""
+import time
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+CHEAP_PATHS = ['/health', '/sessions/{session_id}']
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def report(label, samples):
+    print(f"{label:<28} n={len(samples):5d}  p50={percentile(samples, 50) * 1000:8.1f}ms  "
+          f"p99={percentile(samples, 99) * 1000:8.1f}ms  max={max(samples) * 1000:8.1f}ms")
+
+async def poll_cheap(client, session_id, deadline, interval=0.02):
+    latencies = []
+    while time.perf_counter() < deadline:
+        for path in CHEAP_PATHS:
+            start = time.perf_counter()
+            response = await client.get(path.format(session_id=session_id))
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+async def run_heavy(client, session_id, attribute, laps, deadline):
+    latencies = []
+    i = 0
+    while time.perf_counter() < deadline:
+        lap_number = laps[i % len(laps)]
+        i += 1
+        start = time.perf_counter()
+        await client.get(f"/sessions/{session_id}/laps/{lap_number}", params={"attribute": attribute})
+        await client.get(f"/telemetry/{session_id}/attributes/{attribute}")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('session_id')
+    parser.add_argument('--base-url', default='http://localhost')
+    parser.add_argument('--attribute', default='Speed')
+    parser.add_argument('--heavy', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.heavy + 4)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120, limits=limits) as client:
+        laps = (await client.get(f"/sessions/{args.session_id}/laps")).json()["laps"]
+        lap_numbers = [lap["lap_number"] for lap in laps] or [1]
+
+        idle = await poll_cheap(client, args.session_id, time.perf_counter() + args.seconds / 4)
+        report("cheap endpoints, idle", idle)
+
+        deadline = time.perf_counter() + args.seconds
+        heavy_tasks = [
+            asyncio.create_task(run_heavy(client, args.session_id, args.attribute, lap_numbers, deadline))
+            for _ in range(args.heavy)
+        ]
+        loaded = await poll_cheap(client, args.session_id, deadline)
+        heavy = [latency for latencies in await asyncio.gather(*heavy_tasks) for latency in latencies]
+        report(f"cheap endpoints, {args.heavy} heavy", loaded)
+        report("heavy requests", heavy)
+        print(f"p99 slowdown under load:    {percentile(loaded, 99) / percentile(idle, 99):8.1f}x "
+              f"(median {statistics.median(loaded) / statistics.median(idle):.1f}x)")
+
+if __name__ == '__main__':
+    asyncio.run(main())
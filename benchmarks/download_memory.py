@@ -0,0 +1,99 @@
+"""Benchmark server memory while full-session downloads stream concurrently.
+
+Usage:
+    python benchmarks/download_memory.py SESSION_ID --server-pid PID
+        [--base-url http://localhost] [--downloads 10] [--format json|csv]
+        [--encoding identity|gzip|zstd]
+
+Starts --downloads concurrent exports of every stored channel of the session
+(/telemetry/{id}/export) and samples the resident set size of the server
+process and its children (compute and ingest workers) from /proc while they
+run. With streamed responses the peak should stay close to the idle RSS
+however long the session is. Must run on the same host as the server.
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import httpx
+
+def process_tree(pid):
+    """pid and all of its descendants."""
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children = [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+        for child in children:
+            pids.extend(process_tree(child))
+    return pids
+
+def rss_bytes(pid):
+    """Combined resident set size of pid and its descendants."""
+    total = 0
+    for tree_pid in process_tree(pid):
+        try:
+            with open(f"/proc/{tree_pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+async def sample_rss(pid, done, interval=0.05):
+    peak = rss_bytes(pid)
+    while not done.is_set():
+        peak = max(peak, rss_bytes(pid))
+        await asyncio.sleep(interval)
+    return peak
+
+async def download(client, session_id, headers):
+    start = time.perf_counter()
+    size = 0
+    async with client.stream("GET", f"/telemetry/{session_id}/export", headers=headers) as response:
+        response.raise_for_status()
+        # Count the bytes on the wire, not the decompressed body
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+    return time.perf_counter() - start, size
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('session_id')
+    parser.add_argument('--server-pid', type=int, required=True)
+    parser.add_argument('--base-url', default='http://localhost')
+    parser.add_argument('--downloads', type=int, default=10)
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--encoding', choices=['identity', 'gzip', 'zstd'], default='identity')
+    args = parser.parse_args()
+
+    headers = {
+        "Accept": "text/csv" if args.format == "csv" else "application/json",
+        "Accept-Encoding": args.encoding
+    }
+    idle = rss_bytes(args.server_pid)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+        done = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(args.server_pid, done))
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            download(client, args.session_id, headers) for _ in range(args.downloads)
+        ])
+        elapsed = time.perf_counter() - start
+        done.set()
+        peak = await sampler
+
+    print(f"{args.downloads} concurrent {args.format} downloads ({args.encoding}) in {elapsed:.2f}s")
+    print(f"  per download: {results[0][1] / 1e6:.1f} MB on the wire, "
+          f"slowest {max(seconds for seconds, _ in results):.2f}s")
+    print(f"  server RSS:   idle {idle / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB "
+          f"(+{(peak - idle) / 1e6:.1f} MB)")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+"""Benchmark channel extraction: per-sample IBT.get_all vs. the vectorized extractor.
+
+Usage:
+    python benchmarks/extract_channels.py [path/to/file.ibt] [--channels 50]
+
+Without a file, a synthetic one-hour 60 Hz session is generated.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from irsdk import IBT
+from iRacingTelemetry.telemetry_parser import extract_channels
+from synthetic_ibt import write_session
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ibt_file', nargs='?')
+    parser.add_argument('--channels', type=int, default=50)
+    parser.add_argument('--seconds', type=int, default=3600)
+    args = parser.parse_args()
+
+    path = args.ibt_file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'synthetic.ibt')
+        write_session(path, seconds=args.seconds, extra_channels=args.channels)
+
+    ir = IBT()
+    ir.open(ibt_file=path)
+    try:
+        names = [name for name in ir.var_headers_names if name != 'CarIdxLap'][:args.channels]
+        print(f"{len(names)} channels x {ir._disk_header.session_record_count} records")
+
+        start = time.perf_counter()
+        channels = extract_channels(ir, names)
+        vectorized = time.perf_counter() - start
+        print(f"extract_channels: {vectorized:8.3f}s")
+
+        start = time.perf_counter()
+        reference = {name: ir.get_all(name) for name in names}
+        per_sample = time.perf_counter() - start
+        print(f"IBT.get_all:      {per_sample:8.3f}s")
+
+        assert all(channels[name].tolist() == reference[name] for name in names)
+        print(f"speedup:          {per_sample / vectorized:8.1f}x")
+    finally:
+        ir.close()
+
+if __name__ == '__main__':
+    main()
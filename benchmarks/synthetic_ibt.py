@@ -0,0 +1,126 @@
+"""Write synthetic iRacing .ibt files for benchmarks."""
+import struct
+import numpy as np
+
+IBT_VAR_TYPES = {
+    np.dtype('u1'): 0,
+    np.dtype('?'): 1,
+    np.dtype('<i4'): 2,
+    np.dtype('<u4'): 3,
+    np.dtype('<f4'): 4,
+    np.dtype('<f8'): 5,
+}
+
+SESSION_INFO_YAML = """---
+WeekendInfo:
+ TrackName: roadatlanta full
+ TrackID: 127
+ TrackDisplayName: Road Atlanta
+ TrackConfigName: Full Course
+ TrackAirTemp: 18.90 C
+ TrackPrecipitation: 0 %
+ TrackFogLevel: 0 %
+ WeekendOptions:
+  Date: 2025-10-25
+  TimeOfDay: 9:35 am
+  WindSpeed: 3.22 km/h
+  WindDirection: N
+
+SessionInfo:
+ Sessions:
+ - SessionNum: 0
+   SessionType: Offline Testing
+
+DriverInfo:
+ DriverCarIdx: 0
+ Drivers:
+{drivers}
+SplitTimeInfo:
+ Sectors:
+ - SectorNum: 0
+   SectorStartPct: 0.000000
+ - SectorNum: 1
+   SectorStartPct: 0.333333
+ - SectorNum: 2
+   SectorStartPct: 0.666666
+
+"""
+
+DRIVER_YAML = """ - CarIdx: {idx}
+   UserName: Driver {idx}
+   UserID: {user_id}
+   CarNumber: "{idx}"
+   CarScreenName: Porsche 911 GT3 R (992)
+   CarClassID: 0
+   IRating: 1500
+"""
+
+def write_ibt(path, channels, session_info_yaml, tick_rate=60):
+    """
+    Write channels (name -> array of samples) as an .ibt file.
+
+    Array dtypes must be native IBT types; 2-D arrays become array variables.
+    """
+    record_count = len(next(iter(channels.values())))
+    var_headers = b''
+    layout = []
+    offset = 0
+    for name, values in channels.items():
+        values = np.asarray(values)
+        count = values.shape[1] if values.ndim > 1 else 1
+        var_headers += struct.pack(
+            '<iii?3x32s64s32s',
+            IBT_VAR_TYPES[values.dtype], offset, count, False,
+            name.encode(), b'synthetic channel', b''
+        )
+        layout.append((values, offset))
+        offset += values.dtype.itemsize * count
+    buf_len = offset
+
+    session_info = session_info_yaml.encode('cp1252') + b'\x00'
+    var_header_offset = 144
+    session_info_offset = var_header_offset + len(var_headers)
+    buf_offset = session_info_offset + len(session_info)
+
+    header = struct.pack(
+        '<10i8x', 2, 1, tick_rate, 1, len(session_info), session_info_offset,
+        len(channels), var_header_offset, 1, buf_len
+    )
+    header += struct.pack('<iii4x', record_count, buf_offset, record_count) + b'\x00' * 48
+    header += struct.pack('<Qddii', 0, 0.0, record_count / tick_rate, 0, record_count)
+
+    records = np.zeros((record_count, buf_len), dtype=np.uint8)
+    for values, var_offset in layout:
+        raw = np.ascontiguousarray(values).view(np.uint8).reshape(record_count, -1)
+        records[:, var_offset:var_offset + raw.shape[1]] = raw
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(var_headers)
+        f.write(session_info)
+        f.write(records.tobytes())
+
+def write_session(path, seconds=3600, lap_seconds=90, extra_channels=50, drivers=1, tick_rate=60, seed=0):
+    """Write a plausible session: laps, lap distance, session time and noisy channels."""
+    rng = np.random.default_rng(seed)
+    record_count = seconds * tick_rate
+    session_time = np.arange(record_count) / tick_rate
+    lap_position = session_time / lap_seconds
+
+    lap = np.floor(lap_position).astype('<i4') + 1
+    lap[:tick_rate * 5] = 0  # pit exit before the first lap starts
+    channels = {
+        'Lap': lap,
+        'LapDistPct': (lap_position % 1).astype('<f4'),
+        'LapCurrentLapTime': (session_time % lap_seconds).astype('<f4'),
+        'SessionTime': session_time.astype('<f8'),
+        'PlayerIncidents': (rng.random(record_count) < 1e-5).astype('<i4'),
+        'OnPitRoad': np.zeros(record_count, dtype='?'),
+        'Speed': (60 + 20 * np.sin(lap_position * 2 * np.pi) + rng.normal(0, 1, record_count)).astype('<f4'),
+        'CarIdxLap': np.repeat(lap[:, None], 64, axis=1).astype('<i4'),
+    }
+    for i in range(extra_channels):
+        channels[f'Channel{i:02d}'] = rng.normal(0, 1, record_count).astype('<f4')
+
+    driver_yaml = ''.join(DRIVER_YAML.format(idx=i, user_id=100000 + i) for i in range(drivers))
+    write_ibt(path, channels, SESSION_INFO_YAML.format(drivers=driver_yaml), tick_rate=tick_rate)
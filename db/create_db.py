@@ -37,7 +37,7 @@ def create_tables():
         Base.metadata.create_all(bind=engine)
         
         # Print created tables
-        tables = ['session_info', 'weather', 'driver', 'attribute_values']
+        tables = ['session_info', 'weather', 'driver', 'attribute_values', 'lap', 'lap_channel_stats', 'channel_tombstone', 'ingest_job']
         for table in tables:
             print(f"✓ Created {table} table")
         
@@ -0,0 +1,77 @@
+"""Database migration script - converts JSON attribute values to the binary channel format."""
+import os
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Add app directory to path to import services
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from services.channel_codec import decode_channel, encode_channel, is_legacy_json
+
+def get_database_url():
+    """Get database URL from environment variables."""
+    host = os.getenv('DB_HOST', 'db')
+    port = os.getenv('DB_PORT', '3306')
+    database = os.getenv('DB_DATABASE', 'app')
+    user = os.getenv('DB_USER', 'appuser')
+    password = os.getenv('DB_PASSWORD', 'apppass')
+
+    return f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+
+def migrate_channel_storage():
+    """Change attribute_values.value to MEDIUMBLOB and re-encode legacy JSON rows."""
+    try:
+        engine = create_engine(
+            get_database_url(),
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=False
+        )
+
+        print("Connected to MySQL database")
+
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE attribute_values MODIFY value MEDIUMBLOB NULL"))
+        print("✓ attribute_values.value is now MEDIUMBLOB")
+
+        with engine.connect() as conn:
+            keys = conn.execute(text("SELECT session_id, attribute FROM attribute_values")).all()
+
+        # Convert one row per transaction so a large table never holds long locks
+        migrated = 0
+        for session_id, attribute in keys:
+            with engine.begin() as conn:
+                value = conn.execute(
+                    text("SELECT value FROM attribute_values WHERE session_id = :session_id AND attribute = :attribute FOR UPDATE"),
+                    {"session_id": session_id, "attribute": attribute}
+                ).scalar()
+
+                if not is_legacy_json(value):
+                    continue
+
+                values = decode_channel(value)
+                conn.execute(
+                    text("UPDATE attribute_values SET value = :value, value_len = :value_len "
+                         "WHERE session_id = :session_id AND attribute = :attribute"),
+                    {
+                        "value": encode_channel(values),
+                        "value_len": len(values),
+                        "session_id": session_id,
+                        "attribute": attribute
+                    }
+                )
+                migrated += 1
+
+        print(f"\n✅ Migration complete: {migrated} of {len(keys)} attribute values converted")
+
+    except SQLAlchemyError as e:
+        print(f"❌ Error migrating channel storage: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if 'engine' in locals():
+            engine.dispose()
+            print("Database connection closed")
+
+if __name__ == "__main__":
+    migrate_channel_storage()
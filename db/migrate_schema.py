@@ -0,0 +1,202 @@
+"""Database migration script - brings an existing database up to the current schema.
+
+create_db.py only creates missing tables. This script also adds the columns
+and indexes that later versions introduced on existing tables, skipping any
+that are already present, and fills the new columns of existing rows, so it
+is safe to run repeatedly.
+"""
+import os
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Add app directory to path to import models
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import Base
+from services.channel_codec import decode_channel, describe_channel
+
+# (table, column, column definition)
+COLUMNS = [
+    ("ingest_job", "mode", "VARCHAR(20) NOT NULL DEFAULT 'ingest'"),
+    ("ingest_job", "content_hash", "VARCHAR(64) NULL"),
+    ("ingest_job", "file_size", "INT UNSIGNED NULL"),
+    ("session_info", "content_hash", "VARCHAR(64) NULL"),
+    ("session_info", "data_version", "INT UNSIGNED NOT NULL DEFAULT 0"),
+    ("session_info", "player_driver_user_id", "INT NULL"),
+    ("attribute_values", "dtype", "VARCHAR(16) NULL"),
+    ("attribute_values", "values_per_sample", "SMALLINT UNSIGNED NULL"),
+    ("attribute_values", "units", "VARCHAR(32) NULL"),
+    ("attribute_values", "value_min", "DOUBLE NULL"),
+    ("attribute_values", "value_max", "DOUBLE NULL"),
+    ("attribute_values", "value_preview", "VARCHAR(128) NULL"),
+    ("lap", "valid", "TINYINT(1) NULL"),
+    ("lap", "complete", "TINYINT(1) NULL"),
+    ("lap", "track_id", "INT NULL"),
+    ("lap", "track_config", "VARCHAR(255) NULL"),
+    ("lap", "session_date", "VARCHAR(50) NULL"),
+    ("lap", "driver_user_id", "INT NULL"),
+    ("lap", "car_name", "VARCHAR(255) NULL"),
+]
+
+# (table, index name, index definition)
+INDEXES = [
+    ("session_info", "ux_session_info_content_hash", "UNIQUE INDEX ux_session_info_content_hash (content_hash)"),
+    ("session_info", "ix_session_info_date", "INDEX ix_session_info_date (session_date, session_id)"),
+    ("session_info", "ix_session_info_track", "INDEX ix_session_info_track (track_id, track_config, session_date, session_id)"),
+    ("session_info", "ix_session_info_type", "INDEX ix_session_info_type (session_type, session_date, session_id)"),
+    ("driver", "ix_driver_user", "INDEX ix_driver_user (driver_user_id, session_id)"),
+    ("lap", "ix_lap_leaderboard", "INDEX ix_lap_leaderboard (track_id, track_config, complete, valid, lap_time)"),
+    ("lap", "ix_lap_leaderboard_car", "INDEX ix_lap_leaderboard_car (track_id, track_config, car_name, complete, valid, lap_time)"),
+    ("lap", "ix_lap_leaderboard_driver", "INDEX ix_lap_leaderboard_driver (driver_user_id, track_id, track_config, complete, valid, lap_time)"),
+]
+
+# Fill columns added to rows stored before them; each only touches rows it has not filled yet
+BACKFILLS = [
+    # Leaderboard columns of laps from their session
+    ("lap.track_id", """
+        UPDATE lap JOIN session_info ON session_info.session_id = lap.session_id
+        SET lap.track_id = session_info.track_id,
+            lap.track_config = session_info.track_config,
+            lap.session_date = session_info.session_date
+        WHERE lap.track_id IS NULL AND session_info.track_id IS NOT NULL
+    """),
+    # Without DriverCarIdx (not stored before), the player is only known for single-driver sessions
+    ("session_info.player_driver_user_id", """
+        UPDATE session_info JOIN (
+            SELECT session_id, MIN(driver_user_id) AS driver_user_id
+            FROM driver GROUP BY session_id HAVING COUNT(*) = 1
+        ) AS single_driver ON single_driver.session_id = session_info.session_id
+        SET session_info.player_driver_user_id = single_driver.driver_user_id
+        WHERE session_info.player_driver_user_id IS NULL
+    """),
+    # Driver and car of laps from their session's player (see LapService.leaderboard_fields)
+    ("lap.driver_user_id", """
+        UPDATE lap
+        JOIN session_info ON session_info.session_id = lap.session_id
+        JOIN driver ON driver.session_id = session_info.session_id
+                   AND driver.driver_user_id = session_info.player_driver_user_id
+        SET lap.driver_user_id = driver.driver_user_id, lap.car_name = driver.car_name
+        WHERE lap.driver_user_id IS NULL
+    """),
+    # Without LapCurrentLapTime, only laps between two others are known to be complete
+    ("lap.complete", """
+        UPDATE lap JOIN (
+            SELECT session_id, MIN(start_index) AS first_start, MAX(start_index) AS last_start
+            FROM lap GROUP BY session_id
+        ) AS bounds ON bounds.session_id = lap.session_id
+        SET lap.complete = (lap.start_index > bounds.first_start AND lap.start_index < bounds.last_start
+                            AND lap.lap_time IS NOT NULL),
+            lap.valid = (lap.incidents IS NULL OR lap.incidents = 0)
+        WHERE lap.complete IS NULL
+    """),
+]
+
+# Channels described per transaction by backfill_channel_metadata
+METADATA_BATCH_ROWS = 100
+
+def get_database_url():
+    """Get database URL from environment variables."""
+    host = os.getenv('DB_HOST', 'db')
+    port = os.getenv('DB_PORT', '3306')
+    database = os.getenv('DB_DATABASE', 'app')
+    user = os.getenv('DB_USER', 'appuser')
+    password = os.getenv('DB_PASSWORD', 'apppass')
+
+    return f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+
+def migrate_schema():
+    """Create missing tables, then add missing columns and indexes."""
+    try:
+        engine = create_engine(
+            get_database_url(),
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=False
+        )
+
+        print("Connected to MySQL database")
+
+        Base.metadata.create_all(bind=engine)
+        print("✓ Created missing tables")
+
+        with engine.begin() as conn:
+            for table, column, definition in COLUMNS:
+                exists = conn.execute(text(
+                    "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column"
+                ), {"table": table, "column": column}).scalar()
+                if not exists:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                    print(f"✓ Added {table}.{column}")
+
+            for table, index, definition in INDEXES:
+                exists = conn.execute(text(
+                    "SELECT COUNT(*) FROM information_schema.STATISTICS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index"
+                ), {"table": table, "index": index}).scalar()
+                if not exists:
+                    conn.execute(text(f"ALTER TABLE {table} ADD {definition}"))
+                    print(f"✓ Added index {table}.{index}")
+
+            for column, statement in BACKFILLS:
+                filled = conn.execute(text(statement)).rowcount
+                if filled:
+                    print(f"✓ Backfilled {column} for {filled} rows")
+
+        backfill_channel_metadata(engine)
+
+        print(f"\n✅ Migration complete: schema is up to date")
+
+    except SQLAlchemyError as e:
+        print(f"❌ Error migrating schema: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if 'engine' in locals():
+            engine.dispose()
+            print("Database connection closed")
+
+def backfill_channel_metadata(engine):
+    """
+    Describe stored channels that have no metadata yet (dtype, values per
+    sample, range and preview; see ChannelService.list_channels), decoding
+    each value once. Rows are locked and updated METADATA_BATCH_ROWS per
+    transaction so a large table never holds long locks; a channel that
+    cannot be decoded is skipped and left to the lazy backfill.
+    """
+    described = 0
+    after = ("", "")
+    while True:
+        with engine.begin() as conn:
+            keys = conn.execute(text(
+                "SELECT session_id, attribute FROM attribute_values "
+                "WHERE dtype IS NULL AND value IS NOT NULL AND (session_id, attribute) > (:session_id, :attribute) "
+                "ORDER BY session_id, attribute LIMIT :limit FOR UPDATE"
+            ), {"session_id": after[0], "attribute": after[1], "limit": METADATA_BATCH_ROWS}).all()
+            if not keys:
+                break
+
+            for session_id, attribute in keys:
+                value = conn.execute(
+                    text("SELECT value FROM attribute_values WHERE session_id = :session_id AND attribute = :attribute"),
+                    {"session_id": session_id, "attribute": attribute}
+                ).scalar()
+                try:
+                    metadata = describe_channel(decode_channel(value))
+                except ValueError as e:
+                    print(f"⚠ Could not describe {session_id}/{attribute}: {e}")
+                    continue
+                conn.execute(text(
+                    "UPDATE attribute_values SET dtype = :dtype, values_per_sample = :values_per_sample, "
+                    "units = COALESCE(units, :units), value_min = :value_min, value_max = :value_max, "
+                    "value_preview = :value_preview "
+                    "WHERE session_id = :session_id AND attribute = :attribute"
+                ), {**metadata, "session_id": session_id, "attribute": attribute})
+                described += 1
+        after = tuple(keys[-1])
+
+    if described:
+        print(f"✓ Backfilled attribute_values metadata for {described} rows")
+
+if __name__ == "__main__":
+    migrate_schema()